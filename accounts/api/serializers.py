@@ -1,6 +1,9 @@
 from accounts.models import UserProfile
+from accounts.services import UserService
 from django.contrib.auth.models import User
 from rest_framework import serializers, exceptions
+from utils.compiled_serializers import CompiledSerializerMixin
+from utils.memcached_helper import MemcachedHelper
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -9,13 +12,47 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id', 'username')
 
 
-class UserSerializerWithProfile(UserSerializer):
-    nickname = serializers.CharField(source='profile.nickname')
+class UserSerializerWithProfile(CompiledSerializerMixin, UserSerializer):
+    nickname = serializers.SerializerMethodField()
     avatar_url = serializers.SerializerMethodField()
 
+    @classmethod
+    def prefetch(cls, user_ids, context):
+        """
+        批量读出一页数据里所有的 users 和 profiles 放在 context 里
+        序列化的时候不需要每个 user 单独访问一次 memcached
+        """
+        prefetched = context.setdefault('users', {})
+        user_ids = [
+            user_id
+            for user_id in dict.fromkeys(user_ids)
+            if user_id is not None and user_id not in prefetched
+        ]
+        if not user_ids:
+            return
+        users = MemcachedHelper.get_objects_through_cache(User, user_ids)
+        prefetched.update({user.id: user for user in users})
+        profiles = UserService.get_profiles_through_cache(
+            [user.id for user in users],
+        )
+        context.setdefault('profiles', {}).update({
+            profile.user_id: profile
+            for profile in profiles
+        })
+
+    def _get_profile(self, obj):
+        profile = self.context.get('profiles', {}).get(obj.id)
+        if profile is None:
+            return obj.profile
+        return profile
+
+    def get_nickname(self, obj):
+        return self._get_profile(obj).nickname
+
     def get_avatar_url(self, obj):
-        if obj.profile.avatar:
-            return obj.profile.avatar.url
+        profile = self._get_profile(obj)
+        if profile.avatar:
+            return profile.avatar.url
         return None
 
     class Meta:
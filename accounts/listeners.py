@@ -2,3 +2,10 @@ def profile_changed(sender, instance, **kwargs):
     # import 写在函数里面避免循环依赖
     from accounts.services import UserService
     UserService.invalidate_profile(instance.user_id)
+    # profile 里的 nickname 和 avatar 在 user 的 JSON 片段里
+    UserService.invalidate_user_fragment(instance.user_id)
+
+
+def user_changed(sender, instance, **kwargs):
+    from accounts.services import UserService
+    UserService.invalidate_user_fragment(instance.id)
@@ -2,8 +2,12 @@ from accounts.models import UserProfile
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import caches
-from twitter.cache import USER_PROFILE_PATTERN
+from twitter.cache import USER_FRAGMENT_PATTERN, USER_PROFILE_PATTERN
+from utils import xfetch
+from utils.fragment_cache import FragmentCache
 from utils.memcached_helper import MemcachedHelper
+from utils.metrics import Metrics
+from utils.request_cache import RequestCache
 
 
 cache = caches['testing'] if settings.TESTING else caches['default']
@@ -19,18 +23,97 @@ class UserService:
     def get_profile_through_cache(cls, user_id):
         key = USER_PROFILE_PATTERN.format(user_id=user_id)
 
+        # 同一个 request 里已经读过了
+        profile = RequestCache.get(key)
+        if profile is not None:
+            return profile
+
         # read from cache first
-        profile = cache.get(key)
+        with Metrics.timer('cache_latency_ms', tier='memcached', pattern='userprofile'):
+            data = cache.get(key)
+        profile = MemcachedHelper.load(data)
         # cache hit return
         if profile is not None:
+            Metrics.cache_hit('memcached', key, len(data))
+            RequestCache.set(key, profile)
             return profile
+        Metrics.cache_miss('memcached', key)
 
         # cache miss, read from db
-        profile, _ = UserProfile.objects.get_or_create(user_id=user_id)
-        cache.set(key, profile)
+        with xfetch.Timer() as timer:
+            profile, _ = UserProfile.objects.get_or_create(user_id=user_id)
+        data = MemcachedHelper.encode(profile, timer.delta)
+        cache.set(key, data)
+        Metrics.cache_fill('memcached', key, len(data))
+        RequestCache.set(key, profile)
         return profile
 
+    @classmethod
+    def get_profiles_through_cache(cls, user_ids):
+        """
+        批量读取 profiles，按照 user_ids 的顺序返回
+        """
+        keys = {
+            user_id: USER_PROFILE_PATTERN.format(user_id=user_id)
+            for user_id in user_ids
+        }
+        profiles = {}
+        for user_id, key in keys.items():
+            profile = RequestCache.get(key)
+            if profile is not None:
+                profiles[user_id] = profile
+        with Metrics.timer('cache_latency_ms', tier='memcached', pattern='userprofile'):
+            cached = cache.get_many([
+                key
+                for user_id, key in keys.items()
+                if user_id not in profiles
+            ])
+
+        missing_ids = []
+        for user_id, key in keys.items():
+            if user_id in profiles:
+                continue
+            profile = MemcachedHelper.load(cached.get(key))
+            if profile is not None:
+                Metrics.cache_hit('memcached', key, len(cached[key]))
+                profiles[user_id] = profile
+                RequestCache.set(key, profile)
+            else:
+                Metrics.cache_miss('memcached', key)
+                missing_ids.append(user_id)
+
+        if missing_ids:
+            with xfetch.Timer() as timer:
+                db_profiles = {
+                    profile.user_id: profile
+                    for profile in UserProfile.objects.filter(user_id__in=missing_ids)
+                }
+            # 还没有 profile 的 user 很少，和 get_profile_through_cache 一样单独创建
+            for user_id in missing_ids:
+                if user_id not in db_profiles:
+                    db_profiles[user_id], _ = UserProfile.objects.get_or_create(
+                        user_id=user_id,
+                    )
+            encoded = {
+                USER_PROFILE_PATTERN.format(user_id=user_id):
+                    MemcachedHelper.encode(profile, timer.delta)
+                for user_id, profile in db_profiles.items()
+            }
+            cache.set_many(encoded)
+            for key, data in encoded.items():
+                Metrics.cache_fill('memcached', key, len(data))
+            for user_id, profile in db_profiles.items():
+                RequestCache.set(USER_PROFILE_PATTERN.format(user_id=user_id), profile)
+            profiles.update(db_profiles)
+
+        return [profiles[user_id] for user_id in user_ids]
+
     @classmethod
     def invalidate_profile(cls, user_id):
         key = USER_PROFILE_PATTERN.format(user_id=user_id)
         cache.delete(key)
+        RequestCache.delete(key)
+
+    @classmethod
+    def invalidate_user_fragment(cls, user_id):
+        FragmentCache.invalidate(USER_FRAGMENT_PATTERN, user_id)
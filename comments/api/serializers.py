@@ -1,13 +1,34 @@
 from accounts.api.serializers import UserSerializerForComment
 from comments.models import Comment
+from django.db.models import Manager
 from likes.services import LikeService
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from tweets.models import Tweet
+from utils.compiled_serializers import CompiledSerializerMixin
+from utils.redis_helper import RedisHelper
 
 
-class CommentSerializer(serializers.ModelSerializer):
-    user = UserSerializerForComment(source='cached_user')
+class CommentListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        comments = list(data.all() if isinstance(data, Manager) else data)
+        UserSerializerForComment.prefetch(
+            [comment.user_id for comment in comments],
+            self.context,
+        )
+        # 一次 pipeline 读出这一页 comments 的 likes_count
+        self.context.setdefault('comment_counts', {}).update(RedisHelper.get_counts(
+            Comment,
+            [comment.id for comment in comments],
+            ['likes_count'],
+        ))
+        LikeService.prefetch_has_liked(comments, self.context)
+        return super(CommentListSerializer, self).to_representation(comments)
+
+
+class CommentSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
+    user = serializers.SerializerMethodField()
     likes_count = serializers.SerializerMethodField()
     has_liked = serializers.SerializerMethodField()
 
@@ -22,12 +43,23 @@ class CommentSerializer(serializers.ModelSerializer):
             'likes_count',
             'has_liked',
         )
+        list_serializer_class = CommentListSerializer
+
+    def get_user(self, obj):
+        user = self.context.get('users', {}).get(obj.user_id)
+        if user is None:
+            user = obj.cached_user
+        return UserSerializerForComment(user, context=self.context).data
 
     def get_likes_count(self, obj):
-        return obj.like_set.count()
+        # select count(*) -> redis hmget
+        counts = self.context.get('comment_counts', {}).get(obj.id)
+        if counts is None:
+            return RedisHelper.get_count(obj, 'likes_count')
+        return counts['likes_count']
 
     def get_has_liked(self, obj):
-        return LikeService.has_liked(self.context['request'].user, obj)
+        return LikeService.get_has_liked_from_context(self.context, obj)
 
 
 class CommentSerializerForCreate(serializers.ModelSerializer):
@@ -1,7 +1,10 @@
 from comments.models import Comment
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
+from utils.paginations import EndlessPagination
 
 
 COMMENT_URL = '/api/comments/'
@@ -113,6 +116,8 @@ class CommentApiTests(TestCase):
         # 必须带 tweet_id
         response = self.anonymous_client.get(COMMENT_URL)
         self.assertEqual(response.status_code, 400)
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': 'abc'})
+        self.assertEqual(response.status_code, 400)
 
         # 带了 tweet_id 可以访问
         # 一开始没有评论
@@ -140,6 +145,57 @@ class CommentApiTests(TestCase):
         })
         self.assertEqual(len(response.data['comments']), 2)
 
+    def test_pagination(self):
+        page_size = EndlessPagination.page_size
+        comments = [
+            self.create_comment(self.alex, self.tweet, str(i))
+            for i in range(page_size * 2)
+        ]
+
+        # 第一页是最新的 comments，按照时间顺序排列
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertEqual(
+            [comment['id'] for comment in response.data['comments']],
+            [comment.id for comment in comments[page_size:]],
+        )
+
+        # 往前翻页
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'created_at__lt': response.data['comments'][0]['created_at'],
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(
+            [comment['id'] for comment in response.data['comments']],
+            [comment.id for comment in comments[:page_size]],
+        )
+
+        # 加载新的 comments
+        new_comment = self.create_comment(self.bob, self.tweet, 'new')
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'created_at__gt': comments[-1].created_at,
+        })
+        self.assertEqual(len(response.data['comments']), 1)
+        self.assertEqual(response.data['comments'][0]['id'], new_comment.id)
+
+        # 修改和删除之后列表也会更新
+        new_comment.content = 'edited'
+        new_comment.save()
+        comments[-1].delete()
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(response.data['comments'][-1]['content'], 'edited')
+        self.assertEqual(response.data['comments'][-2]['id'], comments[-2].id)
+
+        # 读取的时候不需要查询 comments 表
+        with CaptureQueriesContext(connection) as queries:
+            self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(
+            any('comments_comment' in query['sql'] for query in queries.captured_queries),
+            False,
+        )
+
     def test_comments_count(self):
         # test tweet detail api
         tweet = self.create_tweet(self.alex)
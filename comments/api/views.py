@@ -6,12 +6,17 @@ from comments.api.serializers import (
     CommentSerializerForUpdate,
 )
 from comments.models import Comment
+from comments.services import CommentService
 from django.utils.decorators import method_decorator
+from functools import partial
 from ratelimit.decorators import ratelimit
 from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
+from utils.compiled_serializers import COMPILED_CONTEXT_KEY
 from utils.decorators import required_params
+from utils.paginations import EndlessPagination
+from utils.renderers import FAST_RENDERER_CLASSES
 
 
 class CommentViewSet(viewsets.GenericViewSet):
@@ -22,6 +27,8 @@ class CommentViewSet(viewsets.GenericViewSet):
     serializer_class = CommentSerializerForCreate
     queryset = Comment.objects.all()
     filterset_fields = ('tweet_id',)
+    pagination_class = EndlessPagination
+    renderer_classes = FAST_RENDERER_CLASSES
 
     def get_permissions(self):
         # 注意要加用 AllowAny() / IsAuthenticated() 实例化出对象
@@ -33,21 +40,39 @@ class CommentViewSet(viewsets.GenericViewSet):
         return [AllowAny()]
 
     @required_params(params=['tweet_id'])
-    @method_decorator(ratelimit(key='user', rate='3/m', method='GET', block=True))
+    @method_decorator(ratelimit(key='user_or_ip', rate='5/s', method='GET', block=True))
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        comments = self.filter_queryset(queryset)\
-            .prefetch_related('user')\
-            .order_by('created_at')
+        """
+        第一页是最新的 page_size 个 comments，用第一个（最旧的）comment 的 created_at
+        作为 created_at__lt 往前翻页，用最后一个的 created_at 作为 created_at__gt 加载新的 comments
+        每一页里都按照时间顺序排列
+        """
+        # tweet_id 会用来拼 redis 的 key 和查询数据库，不是整数的时候直接返回 400
+        try:
+            tweet_id = int(request.query_params['tweet_id'])
+        except ValueError:
+            return Response({
+                'message': 'Please check input',
+                'errors': {'tweet_id': ['A valid integer is required.']},
+            }, status=status.HTTP_400_BAD_REQUEST)
+        # 从 redis 里按 tweet 缓存的列表里读取当前这一页
+        page = self.paginator.paginate_cached_window(
+            partial(CommentService.get_cached_comments_window, tweet_id),
+            request,
+        )
+        if page is None:
+            # 用到 tweet 和 created_at 的联合索引
+            queryset = self.filter_queryset(self.get_queryset())
+            page = self.paginate_queryset(queryset)
         serializer = CommentSerializer(
-            comments,
-            context={'request': request},
+            list(page)[::-1],
+            context={'request': request, COMPILED_CONTEXT_KEY: True},
             many=True,
         )
-        return Response(
-            {'comments': serializer.data},
-            status=status.HTTP_200_OK,
-        )
+        return Response({
+            'comments': serializer.data,
+            'has_next_page': self.paginator.has_next_page,
+        }, status=status.HTTP_200_OK)
 
     @method_decorator(ratelimit(key='user', rate='3/s', method='POST', block=True))
     def create(self, request, *args, **kwargs):
@@ -1,3 +1,4 @@
+from gatekeeper.models import GateKeeper
 from utils.listeners import invalidate_object_cache
 from utils.redis_helper import RedisHelper
 
@@ -5,13 +6,19 @@ from utils.redis_helper import RedisHelper
 def incr_comments_count(sender, instance, created, **kwargs):
     from tweets.models import Tweet
     from django.db.models import F
+    from django.db.models.functions import Coalesce
 
     if not created:
         return
 
     # handle new comment
+    if GateKeeper.is_switch_on('switch_counters_write_behind'):
+        # redis 里的计数器是实时的，由 flush_tweet_counts_task 定期批量写回数据库
+        RedisHelper.incr_count(instance.tweet, 'comments_count', write_behind=True)
+        return
+
     Tweet.objects.filter(id=instance.tweet_id)\
-        .update(comments_count=F('comments_count') + 1)
+        .update(comments_count=Coalesce(F('comments_count'), 0) + 1)
     # update 操作不会触发 invalidate_object_cache
     # 想让它触发 tweet 的 post_save 逻辑，就要手动触发
     RedisHelper.incr_count(instance.tweet, 'comments_count')
@@ -20,8 +27,28 @@ def incr_comments_count(sender, instance, created, **kwargs):
 def decr_comments_count(sender, instance, **kwargs):
     from tweets.models import Tweet
     from django.db.models import F
+    from django.db.models.functions import Coalesce
 
     # handle comment deletion
+    if GateKeeper.is_switch_on('switch_counters_write_behind'):
+        RedisHelper.decr_count(instance.tweet, 'comments_count', write_behind=True)
+        return
+
     Tweet.objects.filter(id=instance.tweet_id)\
-        .update(comments_count=F('comments_count') - 1)
+        .update(comments_count=Coalesce(F('comments_count'), 0) - 1)
     RedisHelper.decr_count(instance.tweet, 'comments_count')
+
+
+def push_comment_to_cache(sender, instance, created, **kwargs):
+    from comments.services import CommentService
+
+    if created:
+        CommentService.push_comment_to_cache(instance)
+        return
+    # 修改了 content，只替换 cache 里的这一个 comment
+    CommentService.update_comment_in_cache(instance)
+
+
+def remove_comment_from_cache(sender, instance, **kwargs):
+    from comments.services import CommentService
+    CommentService.remove_comment_from_cache(instance)
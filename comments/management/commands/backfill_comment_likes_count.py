@@ -0,0 +1,58 @@
+from comments.models import Comment
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from likes.models import Like
+from utils.redis_helper import RedisHelper
+
+
+class Command(BaseCommand):
+    help = 'Backfill Comment.likes_count from the Like table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of comments updated per query',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Recount every comment instead of only those with a null likes_count',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Comment.objects.order_by('id')
+        if not options['all']:
+            queryset = queryset.filter(likes_count__isnull=True)
+        content_type = ContentType.objects.get_for_model(Comment)
+
+        # 按照 id 分批处理，每一批用一次 group by 查询统计 likes 的个数，一次 bulk_update 写回
+        # 避免一个大事务长时间锁住整张表
+        total, last_id = 0, 0
+        while True:
+            comment_ids = list(
+                queryset.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size]
+            )
+            if not comment_ids:
+                break
+            counts = dict(
+                Like.objects.filter(content_type=content_type, object_id__in=comment_ids)
+                .values('object_id')
+                .annotate(count=Count('id'))
+                .values_list('object_id', 'count')
+            )
+            Comment.objects.bulk_update(
+                [
+                    Comment(id=comment_id, likes_count=counts.get(comment_id, 0))
+                    for comment_id in comment_ids
+                ],
+                ['likes_count'],
+            )
+            # redis 里的计数器可能是在回填之前从 null 读出来的，删掉之后重新 load
+            RedisHelper.delete_counts(Comment, comment_ids)
+            total += len(comment_ids)
+            last_id = comment_ids[-1]
+            self.stdout.write('{} comments backfilled'.format(total))
@@ -0,0 +1,26 @@
+# Generated by Django 3.1.3 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0001_initial'),
+    ]
+
+    operations = [
+        # 先不带 default 加上这一列，原有的 comments 都是 null
+        # backfill_comment_likes_count 只回填 null 的 comments
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.IntegerField(null=True),
+        ),
+        # default 只在 Django 创建新的 comment 的时候使用，不会修改原有的数据
+        migrations.AlterField(
+            model_name='comment',
+            name='likes_count',
+            field=models.IntegerField(default=0, null=True),
+        ),
+    ]
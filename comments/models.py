@@ -1,8 +1,13 @@
-from comments.listeners import incr_comments_count, decr_comments_count
+from comments.listeners import (
+    decr_comments_count,
+    incr_comments_count,
+    push_comment_to_cache,
+    remove_comment_from_cache,
+)
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import post_delete, post_save, pre_delete
 from likes.models import Like
 from tweets.models import Tweet
 from utils.memcached_helper import MemcachedHelper
@@ -17,6 +22,9 @@ class Comment(models.Model):
     content = models.TextField(max_length=140)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # 和 Tweet.likes_count 一样，新增的 field 设置 null=True 避免 migration 锁表
+    # 原有的数据用 backfill_comment_likes_count 命令回填
+    likes_count = models.IntegerField(default=0, null=True)
 
     class Meta:
         # 有在某个 tweet 下排序所有 comments 的需求
@@ -43,4 +51,6 @@ class Comment(models.Model):
 
 
 post_save.connect(incr_comments_count, sender=Comment)
-pre_delete.connect(decr_comments_count, sender=Comment)
\ No newline at end of file
+pre_delete.connect(decr_comments_count, sender=Comment)
+post_save.connect(push_comment_to_cache, sender=Comment)
+post_delete.connect(remove_comment_from_cache, sender=Comment)
@@ -0,0 +1,48 @@
+from comments.models import Comment
+from twitter.cache import TWEET_COMMENTS_PATTERN
+from utils.redis_helper import RedisHelper
+
+
+class CommentService(object):
+
+    @classmethod
+    def get_tweet_comments_queryset(cls, tweet_id):
+        return Comment.objects.filter(tweet_id=tweet_id).order_by('-created_at')
+
+    @classmethod
+    def get_cached_comments_window(
+        cls,
+        tweet_id,
+        limit=None,
+        created_at__lt=None,
+        created_at__gt=None,
+    ):
+        # 按照 created_at 倒序，返回 None 表示超出了 cache 的范围，需要去数据库查询
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=tweet_id)
+        return RedisHelper.load_objects_window(
+            key,
+            cls.get_tweet_comments_queryset(tweet_id),
+            limit=limit,
+            created_at__lt=created_at__lt,
+            created_at__gt=created_at__gt,
+        )
+
+    @classmethod
+    def push_comment_to_cache(cls, comment):
+        # list 不在 cache 里的时候跳过，下次读取的时候再从数据库 load
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=comment.tweet_id)
+        RedisHelper.push_objects([(key, comment, None)])
+
+    @classmethod
+    def update_comment_in_cache(cls, comment):
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=comment.tweet_id)
+        RedisHelper.replace_object(key, comment)
+
+    @classmethod
+    def remove_comment_from_cache(cls, comment):
+        key = TWEET_COMMENTS_PATTERN.format(tweet_id=comment.tweet_id)
+        RedisHelper.remove_object(
+            key,
+            comment,
+            cls.get_tweet_comments_queryset(comment.tweet_id),
+        )
@@ -0,0 +1,17 @@
+from celery import shared_task
+from comments.models import Comment
+from tweets.constants import COUNTS_FLUSH_BATCH_SIZE, COUNTS_FLUSH_MAX_BATCHES
+from utils.redis_helper import RedisHelper
+from utils.time_constants import ONE_HOUR
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def flush_comment_counts_task():
+    # 由 celery beat 定期执行，把 write behind 模式下 redis 里 comments 的
+    # likes_count 批量写回数据库
+    total = RedisHelper.flush_counts_in_batches(
+        Comment,
+        COUNTS_FLUSH_BATCH_SIZE,
+        COUNTS_FLUSH_MAX_BATCHES,
+    )
+    return '{} comment counts flushed'.format(total)
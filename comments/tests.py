@@ -1,10 +1,21 @@
+from comments.models import Comment
+from comments.tasks import flush_comment_counts_task
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+from gatekeeper.models import GateKeeper
 from testing.testcases import TestCase
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+import io
 
 
 class CommentModelTests(TestCase):
 
     def setUp(self):
         super(CommentModelTests, self).setUp()
+        self.clear_cache()
         self.alex = self.create_user('alex')
         self.tweet = self.create_tweet(self.alex)
         self.comment = self.create_comment(self.alex, self.tweet)
@@ -22,3 +33,99 @@ class CommentModelTests(TestCase):
         bob = self.create_user('bob')
         self.create_like(bob, self.comment)
         self.assertEqual(self.comment.like_set.count(), 2)
+
+    def test_likes_count(self):
+        bob = self.create_user('bob')
+        self.create_like(self.alex, self.comment)
+        like = self.create_like(bob, self.comment)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 2)
+        self.assertEqual(RedisHelper.get_count(self.comment, 'likes_count'), 2)
+        like.delete()
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 1)
+        self.assertEqual(RedisHelper.get_count(self.comment, 'likes_count'), 1)
+
+        # write behind 模式下由 flush_comment_counts_task 写回数据库
+        GateKeeper.turn_on('switch_counters_write_behind')
+        self.create_like(bob, self.comment)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 1)
+        self.assertEqual(RedisHelper.get_count(self.comment, 'likes_count'), 2)
+        flush_comment_counts_task()
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 2)
+
+    def test_backfill_likes_count(self):
+        bob = self.create_user('bob')
+        self.create_like(self.alex, self.comment)
+        self.create_like(bob, self.comment)
+        # --all 重新统计所有 comments，包括已经有 likes_count 的
+        Comment.objects.filter(id=self.comment.id).update(likes_count=5)
+        call_command('backfill_comment_likes_count', all=True, stdout=io.StringIO())
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 2)
+
+
+class CommentLikesCountMigrationTests(TransactionTestCase):
+    """
+    从加上 likes_count 之前的数据开始，执行 migration 和 backfill_comment_likes_count
+    migration 需要修改表结构，所以不能用在事务里执行的 TestCase
+    """
+    migrate_from = [('comments', '0001_initial')]
+    migrate_to = [('comments', '0002_comment_likes_count')]
+
+    def setUp(self):
+        RedisClient.clear()
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        # 其他的 app 都是最新的 migration
+        nodes = [
+            node
+            for node in executor.loader.graph.leaf_nodes()
+            if node[0] != 'comments'
+        ]
+        self.old_apps = executor.loader.project_state(nodes + self.migrate_from).apps
+
+    def tearDown(self):
+        # 恢复到最新的 migration
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        RedisClient.clear()
+
+    def test_backfill_after_migration(self):
+        User = self.old_apps.get_model('auth', 'User')
+        Tweet = self.old_apps.get_model('tweets', 'Tweet')
+        OldComment = self.old_apps.get_model('comments', 'Comment')
+        Like = self.old_apps.get_model('likes', 'Like')
+        ContentType = self.old_apps.get_model('contenttypes', 'ContentType')
+
+        alex = User.objects.create(username='alex')
+        bob = User.objects.create(username='bob')
+        tweet = Tweet.objects.create(user=alex, content='old tweet')
+        liked = OldComment.objects.create(user=alex, tweet=tweet, content='liked')
+        not_liked = OldComment.objects.create(user=bob, tweet=tweet, content='not liked')
+        content_type, _ = ContentType.objects.get_or_create(
+            app_label='comments',
+            model='comment',
+        )
+        for user in [alex, bob]:
+            Like.objects.create(user=user, content_type=content_type, object_id=liked.id)
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.migrate_to)
+        # migration 之后原有的 comments 都是 null，等待回填
+        self.assertEqual(
+            Comment.objects.filter(likes_count__isnull=True).count(),
+            2,
+        )
+
+        call_command('backfill_comment_likes_count', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(Comment.objects.get(id=liked.id).likes_count, 2)
+        self.assertEqual(Comment.objects.get(id=not_liked.id).likes_count, 0)
+        self.assertEqual(
+            RedisHelper.get_count(Comment.objects.get(id=liked.id), 'likes_count'),
+            2,
+        )
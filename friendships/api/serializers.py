@@ -4,9 +4,10 @@ from friendships.models import Friendship
 from friendships.services import FriendshipService
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from utils.compiled_serializers import CompiledSerializerMixin
 
 
-class BaseFriendshipSerializer(serializers.Serializer):
+class BaseFriendshipSerializer(CompiledSerializerMixin, serializers.Serializer):
     user = serializers.SerializerMethodField()
     created_at = serializers.SerializerMethodField()
     has_followed = serializers.SerializerMethodField()
@@ -42,7 +43,7 @@ class BaseFriendshipSerializer(serializers.Serializer):
 
     def get_user(self, obj):
         user = UserService.get_user_by_id(self.get_user_id(obj))
-        return UserSerializerForFriendship(user).data
+        return UserSerializerForFriendship(user, context=self.context).data
 
     def get_created_at(self, obj):
         return obj.created_at
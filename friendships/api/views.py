@@ -14,6 +14,7 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
+from utils.compiled_serializers import COMPILED_CONTEXT_KEY
 from utils.paginations import EndlessPagination
 
 
@@ -40,7 +41,11 @@ class FriendshipViewSet(viewsets.GenericViewSet):
                 .order_by('-created_at')
             page = paginator.paginate_queryset(queryset=friendships, request=request)
 
-        serializer = FollowerSerializer(page, many=True, context={'request': request})
+        serializer = FollowerSerializer(
+            page,
+            many=True,
+            context={'request': request, COMPILED_CONTEXT_KEY: True},
+        )
         return paginator.get_paginated_response(serializer.data)
 
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
@@ -55,7 +60,11 @@ class FriendshipViewSet(viewsets.GenericViewSet):
                 .order_by('-created_at')
             page = paginator.paginate_queryset(queryset=friendships, request=request)
 
-        serializer = FollowingSerializer(page, many=True, context={'request': request})
+        serializer = FollowingSerializer(
+            page,
+            many=True,
+            context={'request': request, COMPILED_CONTEXT_KEY: True},
+        )
         return paginator.get_paginated_response(serializer.data)
 
     @action(methods=['POST'], detail=True, permission_classes=[IsAuthenticated])
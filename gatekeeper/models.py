@@ -5,7 +5,7 @@ class GateKeeper:
 
     @classmethod
     def get(cls, gk_name):
-        conn = RedisClient.get_connection()
+        conn = RedisClient.get_connection(read_only=True)
         name = f'gatekeeper:{gk_name}'
         if not conn.exists(name):
             return {
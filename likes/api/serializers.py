@@ -1,18 +1,38 @@
 from accounts.api.serializers import UserSerializerForLike
 from comments.models import Comment
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import Manager
 from likes.models import Like
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from tweets.models import Tweet
+from utils.compiled_serializers import CompiledSerializerMixin
 
 
-class LikeSerializer(serializers.ModelSerializer):
-    user = UserSerializerForLike(source='cached_user')
+class LikeListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        likes = list(data.all() if isinstance(data, Manager) else data)
+        UserSerializerForLike.prefetch(
+            [like.user_id for like in likes],
+            self.context,
+        )
+        return super(LikeListSerializer, self).to_representation(likes)
+
+
+class LikeSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
+    user = serializers.SerializerMethodField()
 
     class Meta:
         model = Like
         fields = ('user', 'created_at')
+        list_serializer_class = LikeListSerializer
+
+    def get_user(self, obj):
+        user = self.context.get('users', {}).get(obj.user_id)
+        if user is None:
+            user = obj.cached_user
+        return UserSerializerForLike(user, context=self.context).data
 
 
 class BaseLikeSerializerForCreateAndCancel(serializers.ModelSerializer):
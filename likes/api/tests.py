@@ -1,5 +1,14 @@
+from comments.models import Comment
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.contenttypes.models import ContentType
+from likes.constants import LIKERS_SET_SIZE_LIMIT
+from likes.models import Like
+from likes.services import LikeService
 from testing.testcases import TestCase
 from rest_framework.test import APIClient
+from tweets.models import Tweet
+from utils.redis_helper import RedisHelper
+from utils.paginations import EndlessPagination
 
 
 LIKE_BASE_URL = '/api/likes/'
@@ -7,6 +16,7 @@ LIKE_CANCEL_URL = '/api/likes/cancel/'
 COMMENT_LIST_API = '/api/comments/'
 TWEET_LIST_API = '/api/tweets/'
 TWEET_DETAIL_API = '/api/tweets/{}/'
+TWEET_LIKES_API = '/api/tweets/{}/likes/'
 NEWSFEED_LIST_API = '/api/newsfeeds/'
 
 
@@ -221,6 +231,145 @@ class LikeApiTests(TestCase):
         self.assertEqual(response.data['likes'][0]['user']['id'], self.alex.id)
         self.assertEqual(response.data['likes'][1]['user']['id'], self.bob.id)
 
+    def test_has_liked_in_one_query(self):
+        tweets = [self.create_tweet(self.alex) for _ in range(3)]
+        comment = self.create_comment(self.alex, tweets[0])
+        self.create_like(self.bob, tweets[0])
+        self.create_like(self.bob, tweets[2])
+        self.create_like(self.bob, comment)
+
+        # tweets 和 comments 混在一起也只需要一次 viewer 自己的 likes 的查询
+        # 测试里 celery 是同步执行的，后台 back fill liker sets 的任务还有两次查询
+        # 之后都从 redis 的 liker set 里读
+        self.clear_cache()
+        tweet_type = ContentType.objects.get_for_model(Tweet)
+        comment_type = ContentType.objects.get_for_model(Comment)
+        expected = {
+            (tweet_type.id, tweets[0].id): True,
+            (tweet_type.id, tweets[1].id): False,
+            (tweet_type.id, tweets[2].id): True,
+            (comment_type.id, comment.id): True,
+        }
+        with self.assertNumQueries(1 + 2):
+            has_liked = LikeService.get_has_liked(self.bob, tweets + [comment])
+        self.assertEqual(has_liked, expected)
+        with self.assertNumQueries(0):
+            has_liked = LikeService.get_has_liked(self.bob, tweets + [comment])
+        self.assertEqual(has_liked, expected)
+
+        # liker set 由 like 的 listener 维护
+        self.create_like(self.bob, tweets[1])
+        Like.objects.filter(user=self.bob, object_id=tweets[0].id).first().delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(LikeService.has_liked(self.bob, tweets[0]), False)
+            self.assertEqual(LikeService.has_liked(self.bob, tweets[1]), True)
+        self.assertEqual(LikeService.get_likers_count(tweets[1]), 1)
+        self.assertEqual(LikeService.get_likers_count(tweets[0]), 0)
+        self.clear_cache()
+        self.assertEqual(LikeService.get_likers_count(tweets[0]), None)
+        with self.assertNumQueries(0):
+            has_liked = LikeService.get_has_liked(AnonymousUser(), tweets)
+        self.assertEqual(set(has_liked.values()), {False})
+
+        # 列表里的 has_liked 来自 context
+        response = self.bob_client.get(TWEET_LIST_API, {'user_id': self.alex.id})
+        self.assertEqual(
+            [tweet['has_liked'] for tweet in response.data['results']],
+            [True, True, False],
+        )
+
+    def test_like_during_liker_set_back_fill(self):
+        tweet = self.create_tweet(self.alex)
+        key = LikeService.get_likers_key(Tweet, tweet.id)
+        self.clear_cache()
+
+        # back fill 读数据库之后才 like，读到的是 like 之前的数据，不能写进 cache
+        generations = RedisHelper.get_set_generations([key])
+        members = list(Like.objects.filter(object_id=tweet.id).values_list('user_id', flat=True))
+        self.create_like(self.bob, tweet)
+        self.assertEqual(RedisHelper.load_sets({key: members}, generations), 0)
+        self.assertEqual(LikeService.get_likers_count(tweet), None)
+
+        # 下一次读取的时候重新 back fill，不会因为刚刚被修改过而一直不 load
+        self.assertEqual(LikeService.has_liked(self.bob, tweet), True)
+        self.assertEqual(LikeService.get_likers_count(tweet), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(LikeService.has_liked(self.bob, tweet), True)
+
+    def test_liker_set_back_fill_enqueued_once(self):
+        tweet = self.create_tweet(self.alex)
+        self.create_like(self.bob, tweet)
+        key = LikeService.get_likers_key(Tweet, tweet.id)
+        self.clear_cache()
+
+        # 已经有任务在 back fill 的时候不再提交新的任务
+        self.assertEqual(RedisHelper.acquire_set_loading([key]), [True])
+        self.assertEqual(RedisHelper.acquire_set_loading([key]), [False])
+        with self.assertNumQueries(1):
+            self.assertEqual(LikeService.has_liked(self.bob, tweet), True)
+        self.assertEqual(LikeService.get_likers_count(tweet), None)
+
+        # 任务结束之后释放标记
+        RedisHelper.release_set_loading([key])
+        self.assertEqual(LikeService.has_liked(self.bob, tweet), True)
+        self.assertEqual(LikeService.get_likers_count(tweet), 1)
+        self.assertEqual(RedisHelper.acquire_set_loading([key]), [True])
+
+    def test_has_liked_without_liker_set(self):
+        tweet = self.create_tweet(self.alex)
+        for i in range(LIKERS_SET_SIZE_LIMIT + 1):
+            self.create_like(self.create_user('liker{}'.format(i)), tweet)
+        self.create_like(self.bob, tweet)
+        tweet.refresh_from_db()
+        self.clear_cache()
+
+        # like 太多的 tweet 不缓存 liker set，每次用 viewer 自己的 likes 查询
+        self.assertEqual(LikeService.has_liked(self.bob, tweet), True)
+        self.assertEqual(LikeService.has_liked(self.alex, tweet), False)
+        self.assertEqual(LikeService.get_likers_count(tweet), None)
+        with self.assertNumQueries(1):
+            self.assertEqual(LikeService.has_liked(self.bob, tweet), True)
+
+    def test_tweet_likes_list_api(self):
+        tweet = self.create_tweet(self.alex)
+        url = TWEET_LIKES_API.format(tweet.id)
+        response = self.anonymous_client.get(TWEET_LIKES_API.format(-1))
+        self.assertEqual(response.status_code, 404)
+
+        page_size = EndlessPagination.page_size
+        users = [
+            self.create_user('liker{}'.format(i))
+            for i in range(page_size + 2)
+        ]
+        for user in users:
+            self.create_like(user, tweet)
+
+        response = self.anonymous_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertEqual(len(response.data['results']), page_size)
+        self.assertEqual(response.data['results'][0]['user']['id'], users[-1].id)
+
+        # 用最旧的一个 like 的 created_at 往下翻页
+        response = self.anonymous_client.get(url, {
+            'created_at__lt': response.data['results'][-1]['created_at'],
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(
+            [like['user']['id'] for like in response.data['results']],
+            [users[1].id, users[0].id],
+        )
+
+        # 取消之后从列表里消失
+        self.create_like(self.bob, tweet)
+        response = self.bob_client.post(LIKE_CANCEL_URL, {
+            'content_type': 'tweet',
+            'object_id': tweet.id,
+        })
+        self.assertEqual(response.status_code, 200)
+        response = self.anonymous_client.get(url)
+        self.assertEqual(response.data['results'][0]['user']['id'], users[-1].id)
+
     def test_likes_count(self):
         tweet = self.create_tweet(self.alex)
         data = {'content_type': 'tweet', 'object_id': tweet.id}
@@ -239,6 +388,19 @@ class LikeApiTests(TestCase):
         response = self.bob_client.get(tweet_url)
         self.assertEqual(response.data['likes_count'], 0)
 
+    def test_likes_count_not_backfilled(self):
+        tweet = self.create_tweet(self.alex)
+        comment = self.create_comment(self.alex, tweet)
+        # 加 likes_count 字段之前的旧 comment，还没有 backfill
+        Comment.objects.filter(id=comment.id).update(likes_count=None)
+
+        self.create_like(self.bob, comment)
+        comment.refresh_from_db()
+        self.assertEqual(comment.likes_count, 1)
+        self.create_like(self.alex, comment)
+        comment.refresh_from_db()
+        self.assertEqual(comment.likes_count, 2)
+
     def test_likes_count_with_cache(self):
         tweet = self.create_tweet(self.alex)
         self.create_newsfeed(self.alex, tweet)
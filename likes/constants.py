@@ -0,0 +1,5 @@
+from django.conf import settings
+
+# like 的数量超过这个值的 object 不在 redis 里缓存 liker set
+# 这些 object 的 has_liked 直接用 viewer 自己的 likes 查询，走 <user, content_type, object_id> 的索引
+LIKERS_SET_SIZE_LIMIT = 10000 if not settings.TESTING else 5
@@ -1,22 +1,27 @@
+from gatekeeper.models import GateKeeper
 from utils.redis_helper import RedisHelper
 
 
 def incr_likes_count(sender, instance, created, **kwargs):
+    from comments.models import Comment
     from tweets.models import Tweet
     from django.db.models import F
+    from django.db.models.functions import Coalesce
 
     if not created:
         return
 
-    # 查看是否是 tweet 的 like
+    from likes.services import LikeService
+    LikeService.add_liker(instance)
+
+    # 查看是 tweet 还是 comment 的 like
     # 因为 like 可以同时记录 tweet 的 like 和 comment 的 like
-    # 但此处我们只 denormalize 了 tweet 的 like
+    # 两者都 denormalize 了 likes_count
     model_class = instance.content_type.model_class()
-    if model_class != Tweet:
-        # TODO: 给 Comment 使用类似的方法进行 likes_count 的统计
+    if model_class not in (Tweet, Comment):
         return
 
-    # handle new tweet like
+    # handle new tweet/comment like
 
     # 不可以使用 tweet.likes_count += 1; tweet.save() 的方式
     # 因此这个操作不是原子操作，必须使用 update 语句才是原子操作
@@ -25,10 +30,18 @@ def incr_likes_count(sender, instance, created, **kwargs):
     # FROM tweets_table
     # WHERE id=<instance.object_id>
 
+    target = instance.content_object
+    if GateKeeper.is_switch_on('switch_counters_write_behind'):
+        # redis 里的计数器是实时的，由 flush_tweet_counts_task 和 flush_comment_counts_task
+        # 定期批量写回数据库，避免热门 tweet 的同一行被频繁 update 导致的行锁竞争
+        RedisHelper.incr_count(target, 'likes_count', write_behind=True)
+        return
+
     # 方法 1
-    Tweet.objects.filter(id=instance.object_id).update(likes_count=F('likes_count') + 1)
-    tweet = instance.content_object
-    RedisHelper.incr_count(tweet, 'likes_count')
+    # 还没有 backfill 的旧数据 likes_count 是 NULL，NULL + 1 还是 NULL，所以先当成 0
+    model_class.objects.filter(id=instance.object_id)\
+        .update(likes_count=Coalesce(F('likes_count'), 0) + 1)
+    RedisHelper.incr_count(target, 'likes_count')
     # 想要 likes_count 的更新不要与 tweet 的更新绑在一起，否则 cache 会一直 miss
     # 不想让它触发 tweet 的 post_save 逻辑，就不需要 invalidate_object_cache
 
@@ -39,15 +52,45 @@ def incr_likes_count(sender, instance, created, **kwargs):
 
 
 def decr_likes_count(sender, instance, **kwargs):
+    from comments.models import Comment
     from tweets.models import Tweet
     from django.db.models import F
+    from django.db.models.functions import Coalesce
+    from likes.services import LikeService
+
+    LikeService.remove_liker(instance)
 
     model_class = instance.content_type.model_class()
-    if model_class != Tweet:
-        # TODO: 给 Comment 使用类似的方法进行 likes_count 的统计
+    if model_class not in (Tweet, Comment):
+        return
+
+    # handle tweet/comment likes cancel
+    target = instance.content_object
+    if GateKeeper.is_switch_on('switch_counters_write_behind'):
+        RedisHelper.decr_count(target, 'likes_count', write_behind=True)
+        return
+
+    model_class.objects.filter(id=instance.object_id)\
+        .update(likes_count=Coalesce(F('likes_count'), 0) - 1)
+    RedisHelper.decr_count(target, 'likes_count')
+
+
+def push_like_to_cache(sender, instance, created, **kwargs):
+    from likes.services import LikeService
+    from tweets.models import Tweet
+
+    if not created:
+        return
+    # 只 cache tweet 下面的 likes 列表
+    if instance.content_type.model_class() != Tweet:
         return
+    LikeService.push_tweet_like_to_cache(instance)
 
-    # handle tweet likes cancel
-    Tweet.objects.filter(id=instance.object_id).update(likes_count=F('likes_count') - 1)
-    tweet = instance.content_object
-    RedisHelper.decr_count(tweet, 'likes_count')
+
+def remove_like_from_cache(sender, instance, **kwargs):
+    from likes.services import LikeService
+    from tweets.models import Tweet
+
+    if instance.content_type.model_class() != Tweet:
+        return
+    LikeService.remove_tweet_like_from_cache(instance)
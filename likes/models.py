@@ -2,8 +2,13 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models.signals import pre_delete, post_save
-from likes.listeners import decr_likes_count, incr_likes_count
+from django.db.models.signals import post_delete, pre_delete, post_save
+from likes.listeners import (
+    decr_likes_count,
+    incr_likes_count,
+    push_like_to_cache,
+    remove_like_from_cache,
+)
 from utils.memcached_helper import MemcachedHelper
 
 
@@ -43,3 +48,5 @@ class Like(models.Model):
 
 pre_delete.connect(decr_likes_count, sender=Like)
 post_save.connect(incr_likes_count, sender=Like)
+post_save.connect(push_like_to_cache, sender=Like)
+post_delete.connect(remove_like_from_cache, sender=Like)
@@ -1,15 +1,220 @@
+from likes.constants import LIKERS_SET_SIZE_LIMIT
 from likes.models import Like
+from likes.tasks import load_likers_task
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count, Q
+from twitter.cache import LIKERS_PATTERN, TWEET_LIKES_PATTERN
+from utils.redis_helper import RedisHelper
 
 
 class LikeService(object):
 
+    @classmethod
+    def get_tweet_likes_queryset(cls, tweet_id):
+        from tweets.models import Tweet
+        return Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(Tweet),
+            object_id=tweet_id,
+        ).order_by('-created_at')
+
+    @classmethod
+    def get_cached_tweet_likes_window(
+        cls,
+        tweet_id,
+        limit=None,
+        created_at__lt=None,
+        created_at__gt=None,
+    ):
+        # 按照 created_at 倒序，返回 None 表示超出了 cache 的范围，需要去数据库查询
+        key = TWEET_LIKES_PATTERN.format(tweet_id=tweet_id)
+        return RedisHelper.load_objects_window(
+            key,
+            cls.get_tweet_likes_queryset(tweet_id),
+            limit=limit,
+            created_at__lt=created_at__lt,
+            created_at__gt=created_at__gt,
+        )
+
+    @classmethod
+    def push_tweet_like_to_cache(cls, like):
+        # list 不在 cache 里的时候跳过，下次读取的时候再从数据库 load
+        key = TWEET_LIKES_PATTERN.format(tweet_id=like.object_id)
+        RedisHelper.push_objects([(key, like, None)])
+
+    @classmethod
+    def remove_tweet_like_from_cache(cls, like):
+        key = TWEET_LIKES_PATTERN.format(tweet_id=like.object_id)
+        RedisHelper.remove_object(
+            key,
+            like,
+            cls.get_tweet_likes_queryset(like.object_id),
+        )
+
+    @classmethod
+    def get_likers_key(cls, model_class, object_id):
+        return LIKERS_PATTERN.format(
+            model_name=model_class.__name__,
+            object_id=object_id,
+        )
+
     @classmethod
     def has_liked(cls, user, target):
+        content_type = ContentType.objects.get_for_model(target.__class__)
+        return cls.get_has_liked(user, [target])[(content_type.id, target.id)]
+
+    @classmethod
+    def get_has_liked(cls, user, targets):
+        """
+        一次 redis pipeline 得到 user 是否 like 过 targets 里的每一个 object
+        返回 {(content_type_id, object_id): True/False}
+        liker set 不在 cache 里的 objects 用一次 viewer 自己的 likes 的查询得到结果
+        liker set 交给后台任务 back fill，不占用当前 request 的时间
+        """
+        keys, objects = {}, {}
+        for target in targets:
+            content_type = ContentType.objects.get_for_model(target.__class__)
+            keys[(content_type.id, target.id)] = cls.get_likers_key(
+                target.__class__,
+                target.id,
+            )
+            objects[(content_type.id, target.id)] = target
         if user.is_anonymous:
-            return False
-        return Like.objects.filter(
-            content_type=ContentType.objects.get_for_model(target.__class__),
-            object_id=target.id,
-            user=user,
-        ).exists()
+            return {target: False for target in keys}
+
+        has_liked, missing = {}, []
+        memberships = RedisHelper.get_set_memberships([
+            (key, user.id)
+            for key in keys.values()
+        ])
+        for target, is_member in zip(keys, memberships):
+            if is_member is None:
+                missing.append(target)
+            else:
+                has_liked[target] = is_member
+        if not missing:
+            return has_liked
+
+        # 用到 <user, content_type, object_id> 的索引
+        liked = set(Like.objects.filter(
+            cls._get_targets_condition(missing),
+            user_id=user.id,
+        ).values_list('content_type_id', 'object_id'))
+        for target in missing:
+            has_liked[target] = target in liked
+        # 根据 denormalize 的 likes_count 跳过肯定不会 cache 的 objects，任务里会再检查一次
+        missing = [
+            target
+            for target in missing
+            if (getattr(objects[target], 'likes_count', 0) or 0) <= LIKERS_SET_SIZE_LIMIT
+        ]
+        # 已经有任务在 back fill 的 set 不再重复提交
+        acquired = RedisHelper.acquire_set_loading([keys[target] for target in missing])
+        missing = [target for target, ok in zip(missing, acquired) if ok]
+        if missing:
+            load_likers_task.delay(missing)
+        return has_liked
+
+    @classmethod
+    def _get_targets_condition(cls, targets):
+        object_ids_by_content_type = {}
+        for content_type_id, object_id in targets:
+            object_ids_by_content_type.setdefault(content_type_id, []).append(object_id)
+        condition = Q()
+        for content_type_id, object_ids in object_ids_by_content_type.items():
+            condition |= Q(content_type_id=content_type_id, object_id__in=object_ids)
+        return condition
+
+    @classmethod
+    def load_likers_to_cache(cls, targets):
+        """
+        targets 是 [(content_type_id, object_id), ...]，从数据库 back fill 它们的 liker sets
+        like 的数量超过 LIKERS_SET_SIZE_LIMIT 的不 cache，返回写入的 set 的个数
+        读数据库的过程中被修改过的 set 不写入，见 RedisHelper.load_sets
+        """
+        keys = {
+            target: cls.get_likers_key(
+                ContentType.objects.get_for_id(target[0]).model_class(),
+                target[1],
+            )
+            for target in targets
+        }
+        try:
+            return cls._load_likers_to_cache(targets, keys)
+        finally:
+            RedisHelper.release_set_loading(list(keys.values()))
+
+    @classmethod
+    def _load_likers_to_cache(cls, targets, keys):
+        # 必须在读数据库之前拿到 generation
+        generations = RedisHelper.get_set_generations(list(keys.values()))
+        # 用到 <content_type, object_id, created_at> 的索引
+        condition = cls._get_targets_condition(targets)
+        sizes = {
+            (content_type_id, object_id): count
+            for content_type_id, object_id, count in Like.objects.filter(condition)
+                .values_list('content_type_id', 'object_id')
+                .annotate(count=Count('id'))
+                .order_by()
+        }
+        targets = [
+            target
+            for target in targets
+            if sizes.get(target, 0) <= LIKERS_SET_SIZE_LIMIT
+        ]
+        if not targets:
+            return 0
+
+        likers = {target: [] for target in targets}
+        if any(sizes.get(target) for target in targets):
+            for content_type_id, object_id, user_id in Like.objects.filter(
+                cls._get_targets_condition(targets),
+            ).values_list('content_type_id', 'object_id', 'user_id'):
+                if user_id is not None:
+                    likers[(content_type_id, object_id)].append(user_id)
+        return RedisHelper.load_sets(
+            {keys[target]: members for target, members in likers.items()},
+            generations,
+        )
+
+    @classmethod
+    def add_liker(cls, like):
+        model_class = like.content_type.model_class()
+        RedisHelper.add_to_set(
+            cls.get_likers_key(model_class, like.object_id),
+            like.user_id,
+        )
+
+    @classmethod
+    def remove_liker(cls, like):
+        model_class = like.content_type.model_class()
+        RedisHelper.remove_from_set(
+            cls.get_likers_key(model_class, like.object_id),
+            like.user_id,
+        )
+
+    @classmethod
+    def get_likers_count(cls, target):
+        """
+        liker set 的大小，可以用来核对 likes_count，set 不在 cache 里的时候返回 None
+        """
+        return RedisHelper.get_set_size(
+            cls.get_likers_key(target.__class__, target.id),
+        )
+
+    @classmethod
+    def prefetch_has_liked(cls, targets, context):
+        # 序列化一页 objects 之前，把 request.user 是否 like 过这些 objects 放在 context 里
+        request = context.get('request')
+        if request is None:
+            return
+        context.setdefault('has_liked', {}).update(
+            cls.get_has_liked(request.user, targets),
+        )
+
+    @classmethod
+    def get_has_liked_from_context(cls, context, target):
+        content_type = ContentType.objects.get_for_model(target.__class__)
+        has_liked = context.get('has_liked', {}).get((content_type.id, target.id))
+        if has_liked is None:
+            return cls.has_liked(context['request'].user, target)
+        return has_liked
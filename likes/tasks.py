@@ -0,0 +1,12 @@
+from celery import shared_task
+from utils.time_constants import ONE_HOUR
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def load_likers_task(targets):
+    # import 写在里面避免循环依赖
+    from likes.services import LikeService
+
+    # celery 传过来的参数是 JSON，tuple 变成了 list
+    loaded = LikeService.load_likers_to_cache([tuple(target) for target in targets])
+    return '{} liker sets loaded'.format(loaded)
@@ -1,11 +1,67 @@
+from django.db.models import Manager
 from rest_framework import serializers
 from newsfeeds.models import NewsFeed
 from tweets.api.serializers import TweetSerializer
+from tweets.models import Tweet
+from utils.compiled_serializers import CompiledSerializerMixin
+from utils.fragment_cache import FragmentCache
+from utils.memcached_helper import MemcachedHelper
 
 
-class NewsFeedSerializer(serializers.ModelSerializer):
-    tweet = TweetSerializer(source='cached_tweet')
+class NewsFeedListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        newsfeeds = list(data.all() if isinstance(data, Manager) else data)
+        # 一次 get_many 读出这一页所有的 tweets，而不是每个 newsfeed 读一次 cached_tweet
+        tweets = MemcachedHelper.get_objects_through_cache(
+            Tweet,
+            [newsfeed.tweet_id for newsfeed in newsfeeds],
+        )
+        self.context.setdefault('tweets', {}).update({
+            tweet.id: tweet
+            for tweet in tweets
+        })
+        TweetSerializer.prefetch(tweets, self.context)
+        return super(NewsFeedListSerializer, self).to_representation(newsfeeds)
+
+
+class NewsFeedSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
+    tweet = serializers.SerializerMethodField()
 
     class Meta:
         model = NewsFeed
         fields = ('id', 'created_at', 'tweet')
+        list_serializer_class = NewsFeedListSerializer
+
+    @classmethod
+    def render_fragments(cls, newsfeeds, context):
+        """
+        返回每个 newsfeed 渲染好的 JSON bytes，tweet 的部分来自 TweetSerializer.render_fragments
+        """
+        tweets = MemcachedHelper.get_objects_through_cache(
+            Tweet,
+            [newsfeed.tweet_id for newsfeed in newsfeeds],
+        )
+        tweet_fragments = dict(zip(
+            [tweet.id for tweet in tweets],
+            TweetSerializer.render_fragments(tweets, context),
+        ))
+        created_at_field = serializers.DateTimeField()
+        return [
+            b''.join([
+                b'{"id":',
+                str(newsfeed.id).encode(),
+                b',"created_at":',
+                FragmentCache.render(created_at_field.to_representation(newsfeed.created_at)),
+                b',"tweet":',
+                tweet_fragments.get(newsfeed.tweet_id, b'null'),
+                b'}',
+            ])
+            for newsfeed in newsfeeds
+        ]
+
+    def get_tweet(self, obj):
+        tweet = self.context.get('tweets', {}).get(obj.tweet_id)
+        if tweet is None:
+            tweet = obj.cached_tweet
+        return TweetSerializer(tweet, context=self.context).data
@@ -1,10 +1,13 @@
 from django.conf import settings
 from friendships.models import Friendship
+from gatekeeper.models import GateKeeper
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
+from tweets.models import TweetPhoto
 from utils.paginations import EndlessPagination
+import json
 
 NEWSFEEDS_URL = '/api/newsfeeds/'
 POST_TWEETS_URL = '/api/tweets/'
@@ -171,6 +174,45 @@ class NewsFeedApiTests(TestCase):
         results = response.data['results']
         self.assertEqual(results[0]['tweet']['content'], 'content2')
 
+    def test_fragments(self):
+        tweets = [self.create_tweet(self.alex, 'content{}'.format(i)) for i in range(3)]
+        TweetPhoto.objects.create(tweet=tweets[0], user=self.alex, file='photo.jpg')
+        for tweet in tweets:
+            self.create_newsfeed(self.bob, tweet)
+        self.create_like(self.bob, tweets[1])
+        self.create_comment(self.alex, tweets[2])
+
+        # 拼接出来的 response 和序列化出来的内容一样
+        # 字段的顺序也一样，渲染出来的 bytes 完全相同
+        expected = self.bob_client.get(NEWSFEEDS_URL).content
+        GateKeeper.turn_on('switch_tweet_fragments')
+        response = self.bob_client.get(NEWSFEEDS_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected)
+        # 第二次从 cache 里读片段
+        response = self.bob_client.get(NEWSFEEDS_URL)
+        self.assertEqual(response.content, expected)
+
+        # like 和计数器每次都是实时的
+        self.create_like(self.bob, tweets[0])
+        results = json.loads(self.bob_client.get(NEWSFEEDS_URL).content)['results']
+        self.assertEqual(results[2]['tweet']['has_liked'], True)
+        self.assertEqual(results[2]['tweet']['likes_count'], 1)
+        results = json.loads(self.alex_client.get(NEWSFEEDS_URL).content)['results']
+        self.assertEqual(results, [])
+
+        # tweet, profile 和图片修改之后片段会被更新
+        tweets[2].content = 'updated'
+        tweets[2].save()
+        profile = self.alex.profile
+        profile.nickname = 'alexnick'
+        profile.save()
+        TweetPhoto.objects.create(tweet=tweets[1], user=self.alex, file='photo2.jpg')
+        results = json.loads(self.bob_client.get(NEWSFEEDS_URL).content)['results']
+        self.assertEqual(results[0]['tweet']['content'], 'updated')
+        self.assertEqual(results[0]['tweet']['user']['nickname'], 'alexnick')
+        self.assertEqual(len(results[1]['tweet']['photo_urls']), 1)
+
     # 没有以 test 开头，所以不会被当成单元测试
     def test_redis_list_limit(self):
         list_limit = settings.REDIS_LIST_LENGTH_LIMIT
@@ -211,3 +253,11 @@ class NewsFeedApiTests(TestCase):
         # cache expired
         self.clear_cache()
         _test_newsfeeds_after_new_feed_pushed()
+
+    def test_pagination_with_sorted_set(self):
+        GateKeeper.turn_on('switch_user_newsfeeds_to_zset')
+        self.test_pagination()
+
+    def test_redis_list_limit_with_sorted_set(self):
+        GateKeeper.turn_on('switch_user_newsfeeds_to_zset')
+        self.test_redis_list_limit()
@@ -1,15 +1,20 @@
 from django.utils.decorators import method_decorator
+from functools import partial
+from gatekeeper.models import GateKeeper
 from newsfeeds.api.serializers import NewsFeedSerializer
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
 from ratelimit.decorators import ratelimit
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
+from utils.compiled_serializers import COMPILED_CONTEXT_KEY
 from utils.paginations import EndlessPagination
+from utils.renderers import FAST_RENDERER_CLASSES
 
 class NewsFeedViewSet(viewsets.GenericViewSet):
     permission_classes = [IsAuthenticated]
     pagination_class = EndlessPagination
+    renderer_classes = FAST_RENDERER_CLASSES
 
     def get_queryset(self):
         # 自定义 queryset，因为 newsfeed 的查看是有权限的
@@ -25,16 +30,24 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
         # page = self.paginate_queryset(queryset)
         # page = self.paginate_queryset(self.get_queryset())
         # Solution 2 : read from redis cache
-        cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(request.user.id)
-        # 用 EndlessPagination 的自己实现的 paginated_cached_list
-        page = self.paginator.paginate_cached_list(cached_newsfeeds, request)
+        # 用 EndlessPagination 的自己实现的 paginate_cached_window
+        # 只从 redis 里读取并反序列化当前这一页需要的 newsfeeds
+        page = self.paginator.paginate_cached_window(
+            partial(NewsFeedService.get_cached_newsfeeds_window, request.user.id),
+            request,
+        )
         # page 是 None 说明我现在请求的数据可能不在 cache 里，需要直接去 db query
         if page is None:
             queryset = NewsFeed.objects.filter(user=request.user)
             page = self.paginate_queryset(queryset)
+        if GateKeeper.is_switch_on('switch_tweet_fragments'):
+            # 和 viewer 无关的部分直接用 cache 里渲染好的 JSON 片段拼接
+            return self.paginator.get_paginated_fragments_response(
+                NewsFeedSerializer.render_fragments(list(page), {'request': request}),
+            )
         serializer = NewsFeedSerializer(
             page,
-            context={'request': request},
+            context={'request': request, COMPILED_CONTEXT_KEY: True},
             many=True,
         )
         return self.get_paginated_response(serializer.data)
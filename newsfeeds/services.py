@@ -1,6 +1,7 @@
+from gatekeeper.models import GateKeeper
 from newsfeeds.models import NewsFeed
 from newsfeeds.tasks import fanout_newsfeeds_main_task
-from twitter.cache import USER_NEWSFEEDS_PATTERN
+from twitter.cache import USER_NEWSFEEDS_PATTERN, USER_NEWSFEEDS_ZSET_PATTERN
 from utils.redis_helper import RedisHelper
 
 
@@ -30,11 +31,66 @@ class NewsFeedService(object):
         # queryset 是 lazy loading 模式，
         # 未真正访问 / 转换成 list 结果，就不会真正触发数据库的查询
         queryset = NewsFeed.objects.filter(user_id=user_id).order_by('-created_at')
+        # 和 push_newsfeed_to_cache 用同一个 switch，读写同一种存储方式
+        if GateKeeper.is_switch_on('switch_user_newsfeeds_to_zset'):
+            key = USER_NEWSFEEDS_ZSET_PATTERN.format(user_id=user_id)
+            return RedisHelper.load_sorted_objects(key, queryset)
         key = USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
         return RedisHelper.load_objects(key, queryset)
 
+    @classmethod
+    def get_cached_newsfeeds_window(
+        cls,
+        user_id,
+        limit=None,
+        created_at__lt=None,
+        created_at__gt=None,
+    ):
+        queryset = NewsFeed.objects.filter(user_id=user_id).order_by('-created_at')
+        if GateKeeper.is_switch_on('switch_user_newsfeeds_to_zset'):
+            key = USER_NEWSFEEDS_ZSET_PATTERN.format(user_id=user_id)
+            return RedisHelper.load_sorted_objects_window(
+                key,
+                queryset,
+                limit=limit,
+                created_at__lt=created_at__lt,
+                created_at__gt=created_at__gt,
+            )
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
+        return RedisHelper.load_objects_window(
+            key,
+            queryset,
+            limit=limit,
+            created_at__lt=created_at__lt,
+            created_at__gt=created_at__gt,
+        )
+
     @classmethod
     def push_newsfeed_to_cache(cls, newsfeed):
         queryset = NewsFeed.objects.filter(user_id=newsfeed.user_id).order_by('-created_at')
         key = USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
-        RedisHelper.push_object(key, newsfeed, queryset)
+        zset_key = USER_NEWSFEEDS_ZSET_PATTERN.format(user_id=newsfeed.user_id)
+        # 只写当前在用的那种存储方式，同时删掉另一种存储方式下的 key
+        if GateKeeper.is_switch_on('switch_user_newsfeeds_to_zset'):
+            RedisHelper.push_sorted_object(zset_key, newsfeed, queryset, stale_key=key)
+        else:
+            RedisHelper.push_object(key, newsfeed, queryset, stale_key=zset_key)
+
+    @classmethod
+    def push_newsfeeds_to_cache(cls, newsfeeds):
+        """
+        fanout 的时候一次 pipeline 把一批 newsfeeds push 到各自 user 的 cache 里
+        cache 里没有的 user 跳过，等他下次读 newsfeeds 的时候再从数据库 load
+        """
+        items = []
+        use_zset = GateKeeper.is_switch_on('switch_user_newsfeeds_to_zset')
+        for newsfeed in newsfeeds:
+            key = USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
+            zset_key = USER_NEWSFEEDS_ZSET_PATTERN.format(user_id=newsfeed.user_id)
+            if use_zset:
+                items.append((zset_key, newsfeed, key))
+            else:
+                items.append((key, newsfeed, zset_key))
+        if use_zset:
+            return RedisHelper.push_sorted_objects(items)
+        return RedisHelper.push_objects(items)
@@ -30,8 +30,11 @@ def fanout_newsfeeds_batch_task(tweet_id, follower_ids):
 
     # bulk create 不会触发 post_save 的 signal，所以需要手动 push 到 cache 里
     # post_save 的 signal 只会单个触发，不会批量触发，所以得手动写触发机制
-    for newsfeed in newsfeeds:
-        NewsFeedService.push_newsfeed_to_cache(newsfeed)
+    # MySQL 的 bulk_create 不会把 id 写回 objects 里，重新查一次拿到 id
+    # 用到 user 和 tweet 的联合索引
+    newsfeeds = NewsFeed.objects.filter(tweet_id=tweet_id, user_id__in=follower_ids)
+    # 一次 pipeline 写完这一批所有 followers 的 cache，而不是每个 newsfeed 访问几次 redis
+    NewsFeedService.push_newsfeeds_to_cache(newsfeeds)
 
     return '{} newsfeeds created'.format(len(newsfeeds))
     # 其实若是一个 1kw 粉丝的博主发了一个 144字节的 tweet，
@@ -1,8 +1,9 @@
+from gatekeeper.models import GateKeeper
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
-from newsfeeds.tasks import fanout_newsfeeds_main_task
+from newsfeeds.tasks import fanout_newsfeeds_batch_task, fanout_newsfeeds_main_task
 from testing.testcases import TestCase
-from twitter.cache import USER_NEWSFEEDS_PATTERN
+from twitter.cache import USER_NEWSFEEDS_PATTERN, USER_NEWSFEEDS_ZSET_PATTERN
 from utils.redis_client import RedisClient
 
 
@@ -36,6 +37,37 @@ class NewsFeedServiceTests(TestCase):
         newsfeed_ids.insert(0, new_newsfeed.id)
         self.assertEqual([f.id for f in newsfeeds], newsfeed_ids)
 
+    def test_get_user_newsfeeds_with_zset(self):
+        GateKeeper.turn_on('switch_user_newsfeeds_to_zset')
+        newsfeed_ids = []
+        for i in range(3):
+            tweet = self.create_tweet(self.bob)
+            newsfeed = self.create_newsfeed(self.alex, tweet)
+            newsfeed_ids.append(newsfeed.id)
+        newsfeed_ids = newsfeed_ids[::-1]
+        conn = RedisClient.get_connection()
+        zset_key = USER_NEWSFEEDS_ZSET_PATTERN.format(user_id=self.alex.id)
+        list_key = USER_NEWSFEEDS_PATTERN.format(user_id=self.alex.id)
+
+        # cache miss，load 到 sorted set 里
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.alex.id)
+        self.assertEqual([f.id for f in newsfeeds], newsfeed_ids)
+        self.assertEqual(conn.zcard(zset_key), 3)
+        self.assertFalse(conn.exists(list_key))
+
+        # cache hit
+        with self.assertNumQueries(0):
+            newsfeeds = NewsFeedService.get_cached_newsfeeds(self.alex.id)
+        self.assertEqual([f.id for f in newsfeeds], newsfeed_ids)
+
+        # 写入的 newsfeed 读的时候能看到
+        tweet = self.create_tweet(self.alex)
+        new_newsfeed = self.create_newsfeed(self.alex, tweet)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.alex.id)
+        newsfeed_ids.insert(0, new_newsfeed.id)
+        self.assertEqual([f.id for f in newsfeeds], newsfeed_ids)
+        self.assertFalse(conn.exists(list_key))
+
     def test_create_new_newsfeed_before_get_cached_newsfeeds(self):
         feed1 = self.create_newsfeed(self.alex, self.create_tweet(self.alex))
 
@@ -87,3 +119,32 @@ class NewsFeedTaskTests(TestCase):
         self.assertEqual(len(cached_list), 3)
         cached_list = NewsFeedService.get_cached_newsfeeds(self.bob.id)
         self.assertEqual(len(cached_list), 3)
+
+    def _test_fanout_batch_task(self, pattern):
+        charlie = self.create_user('charlie')
+        tweet = self.create_tweet(self.alex, 'tweet 1')
+        old_feed = self.create_newsfeed(self.bob, self.create_tweet(self.alex))
+        NewsFeedService.get_cached_newsfeeds_window(self.bob.id)
+
+        conn = RedisClient.get_connection()
+        bob_key = pattern.format(user_id=self.bob.id)
+        charlie_key = pattern.format(user_id=charlie.id)
+        self.assertEqual(conn.exists(bob_key), True)
+        self.assertEqual(conn.exists(charlie_key), False)
+
+        msg = fanout_newsfeeds_batch_task(tweet.id, [self.bob.id, charlie.id])
+        self.assertEqual(msg, '2 newsfeeds created')
+        # 在 cache 里的 push 到头部，不在 cache 里的跳过，等读的时候再 load
+        new_feed = NewsFeed.objects.get(user=self.bob, tweet=tweet)
+        feeds = NewsFeedService.get_cached_newsfeeds_window(self.bob.id)
+        self.assertEqual([f.id for f in feeds], [new_feed.id, old_feed.id])
+        self.assertEqual(conn.exists(charlie_key), False)
+        feeds = NewsFeedService.get_cached_newsfeeds_window(charlie.id)
+        self.assertEqual([f.tweet_id for f in feeds], [tweet.id])
+
+    def test_fanout_batch_task(self):
+        self._test_fanout_batch_task(USER_NEWSFEEDS_PATTERN)
+
+    def test_fanout_batch_task_with_sorted_set(self):
+        GateKeeper.turn_on('switch_user_newsfeeds_to_zset')
+        self._test_fanout_batch_task(USER_NEWSFEEDS_ZSET_PATTERN)
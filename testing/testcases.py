@@ -11,6 +11,7 @@ from friendships.services import FriendshipService
 from gatekeeper.models import GateKeeper
 from rest_framework.test import APIClient
 from tweets.models import Tweet
+from utils.metrics import Metrics
 from utils.redis_client import RedisClient
 
 
@@ -36,6 +37,7 @@ class TestCase(DjangoTestCase):
     def clear_cache(self):
         RedisClient.clear()
         caches['testing'].clear()
+        Metrics.reset()
 
         # open the switch for hbase
         # 测试时手动 comment / uncomment
@@ -1,17 +1,35 @@
 from accounts.api.serializers import UserSerializerForTweet
 from comments.api.serializers import CommentSerializer
+from comments.services import CommentService
+from django.db.models import Manager
+from functools import partial
 from likes.api.serializers import LikeSerializer
 from likes.services import LikeService
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from tweets.constants import TWEET_PHOTOS_UPLOAD_LIMIT
+from tweets.constants import (
+    TWEET_DETAIL_COMMENTS_LIMIT,
+    TWEET_DETAIL_LIKES_LIMIT,
+    TWEET_PHOTOS_UPLOAD_LIMIT,
+)
 from tweets.models import Tweet
 from tweets.services import TweetService
+from twitter.cache import TWEET_FRAGMENT_PATTERN, USER_FRAGMENT_PATTERN
+from utils.compiled_serializers import CompiledSerializerMixin
+from utils.fragment_cache import FragmentCache
 from utils.redis_helper import RedisHelper
 
 
-class TweetSerializer(serializers.ModelSerializer):
-    user = UserSerializerForTweet(source='cached_user')
+class TweetListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        tweets = list(data.all() if isinstance(data, Manager) else data)
+        TweetSerializer.prefetch(tweets, self.context)
+        return super(TweetListSerializer, self).to_representation(tweets)
+
+
+class TweetSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
+    user = serializers.SerializerMethodField()
     comments_count = serializers.SerializerMethodField()
     likes_count = serializers.SerializerMethodField()
     has_liked = serializers.SerializerMethodField()
@@ -29,29 +47,157 @@ class TweetSerializer(serializers.ModelSerializer):
             'has_liked',
             'photo_urls',
         )
+        list_serializer_class = TweetListSerializer
+
+    @classmethod
+    def prefetch(cls, tweets, context):
+        """
+        序列化一页 tweets 之前，一次性批量读出需要的数据放在 context 里
+        避免每个 tweet 单独访问一次 redis 和 memcached
+        """
+        context.setdefault('tweet_counts', {}).update(RedisHelper.get_counts(
+            Tweet,
+            [tweet.id for tweet in tweets],
+            ['likes_count', 'comments_count'],
+        ))
+        UserSerializerForTweet.prefetch(
+            [tweet.user_id for tweet in tweets],
+            context,
+        )
+        context.setdefault('photo_urls', {}).update(TweetService.get_photo_urls(
+            [tweet.id for tweet in tweets],
+        ))
+        LikeService.prefetch_has_liked(tweets, context)
+
+    @classmethod
+    def render_fragments(cls, tweets, context):
+        """
+        返回每个 tweet 渲染好的 JSON bytes，和 TweetSerializer 的输出完全一样
+        和 viewer 无关的部分（tweet 本身和 user）从 FragmentCache 里读
+        has_liked 和计数器每次实时读取，替换掉片段里的占位符，不需要再解析 JSON
+        """
+        tweets_by_id = {tweet.id: tweet for tweet in tweets}
+        counts = RedisHelper.get_counts(
+            Tweet,
+            list(tweets_by_id),
+            ['likes_count', 'comments_count'],
+        )
+        LikeService.prefetch_has_liked(tweets, context)
+        tweet_fragments = FragmentCache.get_many(
+            TWEET_FRAGMENT_PATTERN,
+            list(tweets_by_id),
+            partial(cls._render_tweets, tweets_by_id),
+        )
+        user_fragments = FragmentCache.get_many(
+            USER_FRAGMENT_PATTERN,
+            [tweet.user_id for tweet in tweets if tweet.user_id is not None],
+            partial(cls._render_users, context),
+        )
+
+        fragments = []
+        for tweet in tweets:
+            has_liked = LikeService.get_has_liked_from_context(context, tweet)
+            fragment = tweet_fragments[tweet.id]
+            for field, value in [
+                ('user', user_fragments.get(tweet.user_id, b'null')),
+                ('comments_count', str(counts[tweet.id]['comments_count']).encode()),
+                ('likes_count', str(counts[tweet.id]['likes_count']).encode()),
+                ('has_liked', b'true' if has_liked else b'false'),
+            ]:
+                # 字符串里的 " 都会被转义成 \"，所以占位符不会出现在 content 之类的字符串里
+                placeholder = ',"{}":null'.format(field).encode()
+                fragment = fragment.replace(
+                    placeholder,
+                    placeholder[:-len(b'null')] + value,
+                    1,
+                )
+            fragments.append(fragment)
+        return fragments
+
+    @classmethod
+    def _render_tweets(cls, tweets_by_id, tweet_ids):
+        context = {'photo_urls': TweetService.get_photo_urls(tweet_ids)}
+        return {
+            tweet_id: TweetSerializerForFragment(
+                tweets_by_id[tweet_id],
+                context=context,
+            ).data
+            for tweet_id in tweet_ids
+        }
+
+    @classmethod
+    def _render_users(cls, context, user_ids):
+        UserSerializerForTweet.prefetch(user_ids, context)
+        users = context.get('users', {})
+        return {
+            user_id: UserSerializerForTweet(users[user_id], context=context).data
+            for user_id in user_ids
+            if user_id in users
+        }
+
+    def get_user(self, obj):
+        user = self.context.get('users', {}).get(obj.user_id)
+        if user is None:
+            user = obj.cached_user
+        return UserSerializerForTweet(user, context=self.context).data
+
+    def _get_count(self, obj, attr):
+        counts = self.context.get('tweet_counts', {}).get(obj.id)
+        if counts is None:
+            return RedisHelper.get_count(obj, attr)
+        return counts[attr]
 
     def get_likes_count(self, obj):
         # return obj.like_set.count()  # like_set为自定义的 Tweet 的 property
-        # select count(*) -> redis get
-        # N + 1 queries
-        # 如果 N 是 db queries -> 不可接受的
-        # 如果 N 是 redis/memcached queries -> 可以接受
-        return RedisHelper.get_count(obj, 'likes_count')
+        # select count(*) -> redis hmget
+        # 一页的 tweets 在 prefetch 里通过一次 pipeline 批量读出
+        return self._get_count(obj, 'likes_count')
 
     def get_comments_count(self, obj):
         # return obj.comment_set.count()  # django的ForeignKey的反查机制
-        return RedisHelper.get_count(obj, 'comments_count')
+        return self._get_count(obj, 'comments_count')
 
     def get_has_liked(self, obj):
-        return LikeService.has_liked(self.context['request'].user, obj)
+        return LikeService.get_has_liked_from_context(self.context, obj)
 
     def get_photo_urls(self, obj):
-        photo_urls = []
-        for photo in obj.tweetphoto_set.all().order_by('order'):
-            photo_urls.append(photo.file.url)
+        photo_urls = self.context.get('photo_urls', {}).get(obj.id)
+        if photo_urls is None:
+            photo_urls = TweetService.get_photo_urls([obj.id])[obj.id]
         return photo_urls
 
 
+class TweetSerializerForFragment(serializers.ModelSerializer):
+    """
+    字段和顺序都和 TweetSerializer 一样，和 viewer 有关或者会随着 like 和 comment 变化的字段
+    输出 null 作为占位符，由 TweetSerializer.render_fragments 替换
+    """
+    user = serializers.SerializerMethodField()
+    comments_count = serializers.SerializerMethodField()
+    likes_count = serializers.SerializerMethodField()
+    has_liked = serializers.SerializerMethodField()
+    photo_urls = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Tweet
+        fields = TweetSerializer.Meta.fields
+
+    def get_user(self, obj):
+        return None
+
+    def get_comments_count(self, obj):
+        return None
+
+    def get_likes_count(self, obj):
+        return None
+
+    def get_has_liked(self, obj):
+        return None
+
+    def get_photo_urls(self, obj):
+        return self.context['photo_urls'][obj.id]
+
+
 class TweetSerializerForCreate(serializers.ModelSerializer):
     content = serializers.CharField(min_length=6, max_length=140)
     files = serializers.ListField(
@@ -86,8 +232,15 @@ class TweetSerializerForCreate(serializers.ModelSerializer):
 
 
 class TweetSerializerForDetail(TweetSerializer):
-    comments = CommentSerializer(source='comment_set', many=True)
-    likes = LikeSerializer(source='like_set', many=True)
+    """
+    只带上最新的 TWEET_DETAIL_COMMENTS_LIMIT 个 comments 和 TWEET_DETAIL_LIKES_LIMIT 个 likes
+    从 redis 里按 tweet 缓存的列表里读取。还有更多的时候 *_next_cursor 是最旧的那一个的
+    created_at，作为 created_at__lt 参数去 /api/comments/ 和 /api/tweets/<id>/likes/ 里继续翻页
+    """
+    comments = serializers.SerializerMethodField()
+    likes = serializers.SerializerMethodField()
+    comments_next_cursor = serializers.SerializerMethodField()
+    likes_next_cursor = serializers.SerializerMethodField()
 
     class Meta:
         model = Tweet
@@ -103,5 +256,52 @@ class TweetSerializerForDetail(TweetSerializer):
             'comments_count',
             'has_liked',
             'photo_urls',
+            'comments_next_cursor',
+            'likes_next_cursor',
         )
 
+    def _get_recent(self, obj, name):
+        """
+        返回 (最新的 limit 个 objects, 是否还有更多)，同一个 tweet 只读一次 cache
+        """
+        recent = self.context.setdefault('recent', {})
+        if (name, obj.id) not in recent:
+            if name == 'comments':
+                load_window, limit = CommentService.get_cached_comments_window, \
+                    TWEET_DETAIL_COMMENTS_LIMIT
+                queryset = obj.comment_set.order_by('-created_at')
+            else:
+                load_window, limit = LikeService.get_cached_tweet_likes_window, \
+                    TWEET_DETAIL_LIKES_LIMIT
+                queryset = obj.like_set
+            # 多取一个用来判断是否还有更多
+            objects = load_window(obj.id, limit=limit + 1)
+            if objects is None:
+                objects = list(queryset[:limit + 1])
+            recent[(name, obj.id)] = (objects[:limit], len(objects) > limit)
+        return recent[(name, obj.id)]
+
+    def _get_next_cursor(self, obj, name):
+        objects, has_more = self._get_recent(obj, name)
+        if not has_more:
+            return None
+        return serializers.DateTimeField().to_representation(objects[-1].created_at)
+
+    def get_comments(self, obj):
+        comments, _ = self._get_recent(obj, 'comments')
+        # 和 comments 的列表 API 一样，按照时间顺序展示
+        return CommentSerializer(
+            comments[::-1],
+            context=self.context,
+            many=True,
+        ).data
+
+    def get_likes(self, obj):
+        likes, _ = self._get_recent(obj, 'likes')
+        return LikeSerializer(likes, context=self.context, many=True).data
+
+    def get_comments_next_cursor(self, obj):
+        return self._get_next_cursor(obj, 'comments')
+
+    def get_likes_next_cursor(self, obj):
+        return self._get_next_cursor(obj, 'likes')
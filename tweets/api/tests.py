@@ -1,6 +1,10 @@
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from gatekeeper.models import GateKeeper
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
+from tweets.constants import TWEET_DETAIL_COMMENTS_LIMIT, TWEET_DETAIL_LIKES_LIMIT
 from tweets.models import Tweet, TweetPhoto
 from utils.paginations import EndlessPagination
 
@@ -141,6 +145,51 @@ class TweetApiTests(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(TweetPhoto.objects.count(), 3)
 
+    def test_list_photo_urls(self):
+        for tweet in self.tweets1:
+            for order in (1, 0):
+                TweetPhoto.objects.create(
+                    tweet=tweet,
+                    user=self.user1,
+                    file='photo{}_{}.jpg'.format(tweet.id, order),
+                    order=order,
+                )
+
+        # 一页 tweets 的图片只需要一次查询
+        with CaptureQueriesContext(connection) as queries:
+            response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
+        self.assertEqual(response.status_code, 200)
+        photo_queries = [
+            query
+            for query in queries.captured_queries
+            if 'tweets_tweetphoto' in query['sql']
+        ]
+        self.assertEqual(len(photo_queries), 1)
+        for result in response.data['results']:
+            self.assertEqual(len(result['photo_urls']), 2)
+            self.assertEqual('photo{}_0'.format(result['id']) in result['photo_urls'][0], True)
+            self.assertEqual('photo{}_1'.format(result['id']) in result['photo_urls'][1], True)
+
+        # 没有图片的 tweet
+        response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user2.id})
+        self.assertEqual(response.data['results'][0]['photo_urls'], [])
+
+    def test_list_with_fragments(self):
+        TweetPhoto.objects.create(tweet=self.tweets1[0], user=self.user1, file='a.jpg')
+        self.create_like(self.user1, self.tweets1[1])
+        expected = self.user1_client.get(
+            TWEET_LIST_API,
+            {'user_id': self.user1.id},
+        ).content
+
+        GateKeeper.turn_on('switch_tweet_fragments')
+        for _ in range(2):
+            response = self.user1_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            # 字段的顺序也要和原来的一样
+            self.assertEqual(response.content, expected)
+
     def test_retrieve(self):
         # tweet with id=-1 does not exist
         url = TWEET_RETRIEVE_API.format(-1)
@@ -165,6 +214,43 @@ class TweetApiTests(TestCase):
         self.assertEqual(response.data['user']['nickname'], profile.nickname)
         self.assertEqual(response.data['user']['avatar_url'], None)
 
+    def test_retrieve_recent_comments_and_likes(self):
+        tweet = self.create_tweet(self.user1)
+        comments = [
+            self.create_comment(self.user2, tweet, str(i))
+            for i in range(TWEET_DETAIL_COMMENTS_LIMIT + 2)
+        ]
+        users = [
+            self.create_user('liker{}'.format(i))
+            for i in range(TWEET_DETAIL_LIKES_LIMIT)
+        ]
+        for user in users:
+            self.create_like(user, tweet)
+
+        url = TWEET_RETRIEVE_API.format(tweet.id)
+        response = self.anonymous_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # 只带上最新的 comments，按照时间顺序排列
+        self.assertEqual(len(response.data['comments']), TWEET_DETAIL_COMMENTS_LIMIT)
+        self.assertEqual(response.data['comments'][0]['id'], comments[2].id)
+        self.assertEqual(response.data['comments'][-1]['id'], comments[-1].id)
+        self.assertEqual(
+            response.data['comments_next_cursor'],
+            response.data['comments'][0]['created_at'],
+        )
+        # likes 刚好 TWEET_DETAIL_LIKES_LIMIT 个，没有更多了
+        self.assertEqual(len(response.data['likes']), TWEET_DETAIL_LIKES_LIMIT)
+        self.assertEqual(response.data['likes'][0]['user']['id'], users[-1].id)
+        self.assertEqual(response.data['likes_next_cursor'], None)
+
+        # comment 修改和删除之后 cache 里的列表也会更新
+        comments[-1].content = 'updated'
+        comments[-1].save()
+        comments[2].delete()
+        response = self.anonymous_client.get(url)
+        self.assertEqual(response.data['comments'][-1]['content'], 'updated')
+        self.assertEqual(response.data['comments'][0]['id'], comments[1].id)
+
     def test_pagination(self):
         page_size = EndlessPagination.page_size
 
@@ -211,3 +297,7 @@ class TweetApiTests(TestCase):
         self.assertEqual(response.data['has_next_page'], False)
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['id'], new_tweet.id)
+
+    def test_pagination_with_sorted_set(self):
+        GateKeeper.turn_on('switch_user_tweets_to_zset')
+        self.test_pagination()
@@ -1,7 +1,13 @@
+from django.http import Http404
 from django.utils.decorators import method_decorator
+from functools import partial
+from gatekeeper.models import GateKeeper
+from likes.api.serializers import LikeSerializer
+from likes.services import LikeService
 from newsfeeds.services import NewsFeedService
 from ratelimit.decorators import ratelimit
 from rest_framework import viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from tweets.api.serializers import (
@@ -11,8 +17,11 @@ from tweets.api.serializers import (
 )
 from tweets.models import Tweet
 from tweets.services import TweetService
+from utils.compiled_serializers import COMPILED_CONTEXT_KEY
 from utils.decorators import required_params
+from utils.memcached_helper import MemcachedHelper
 from utils.paginations import EndlessPagination
+from utils.renderers import FAST_RENDERER_CLASSES
 
 
 class TweetViewSet(viewsets.GenericViewSet):
@@ -23,12 +32,13 @@ class TweetViewSet(viewsets.GenericViewSet):
     queryset = Tweet.objects.all()
     serializer_class = TweetSerializerForCreate
     pagination_class = EndlessPagination
+    renderer_classes = FAST_RENDERER_CLASSES
 
     def get_permissions(self):
         """
         Assign permission requirement for each method
         """
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'likes']:
             return [AllowAny()]
         return [IsAuthenticated()]
 
@@ -43,11 +53,42 @@ class TweetViewSet(viewsets.GenericViewSet):
         # if request.query_params['with_preview_comments'] == "1":
         #     return Response(TweetSerializerWithComments(tweet).data[:3])
         serializer = TweetSerializerForDetail(
-            self.get_object(),
+            self._get_cached_tweet(),
             context={'request': request},
         )
         return Response(serializer.data)
 
+    @action(methods=['GET'], detail=True)
+    @method_decorator(ratelimit(key='user_or_ip', rate='5/s', method='GET', block=True))
+    def likes(self, request, *args, **kwargs):
+        """
+        tweet 详情里只有最新的几个 likes，更多的 likes 通过这个 API 用 created_at__lt 往下翻页
+        """
+        tweet = self._get_cached_tweet()
+        page = self.paginator.paginate_cached_window(
+            partial(LikeService.get_cached_tweet_likes_window, tweet.id),
+            request,
+        )
+        if page is None:
+            page = self.paginate_queryset(LikeService.get_tweet_likes_queryset(tweet.id))
+        serializer = LikeSerializer(
+            page,
+            context={'request': request},
+            many=True,
+        )
+        return self.get_paginated_response(serializer.data)
+
+    def _get_cached_tweet(self):
+        # 通过 cache 读取，不存在的 tweet 也会在 cache 里留一个 tombstone
+        # 避免反复请求不存在的 id 的时候每次都查询数据库
+        try:
+            return MemcachedHelper.get_object_through_cache(
+                Tweet,
+                int(self.kwargs['pk']),
+            )
+        except (ValueError, Tweet.DoesNotExist):
+            raise Http404
+
     @required_params(params=['user_id'])
     def list(self, request, *args, **kwargs):
         """
@@ -65,8 +106,11 @@ class TweetViewSet(viewsets.GenericViewSet):
         # tweets = TweetService.get_cached_tweets(user_id=request.query_params['user_id'])
         # tweets = self.paginate_queryset(tweets)
         user_id = request.query_params['user_id']
-        cached_tweets = TweetService.get_cached_tweets(user_id)
-        page = self.paginator.paginate_cached_list(cached_tweets, request)
+        # 只从 redis 里读取并反序列化当前这一页需要的 tweets
+        page = self.paginator.paginate_cached_window(
+            partial(TweetService.get_cached_tweets_window, user_id),
+            request,
+        )
         if page is None:
             # 这句查询会被翻译为
             # select * from twitter_tweets
@@ -78,9 +122,13 @@ class TweetViewSet(viewsets.GenericViewSet):
                 .prefetch_related('user')\
                 .order_by('-created_at')
             page = self.paginate_queryset(queryset)
+        if GateKeeper.is_switch_on('switch_tweet_fragments'):
+            return self.paginator.get_paginated_fragments_response(
+                TweetSerializer.render_fragments(list(page), {'request': request}),
+            )
         serializer = TweetSerializer(
             instance=page,
-            context={'request': request},
+            context={'request': request, COMPILED_CONTEXT_KEY: True},
             many=True,
         )
         return self.get_paginated_response(serializer.data)
@@ -10,4 +10,16 @@ TWEET_PHOTO_STATUS_CHOICES = (
     (TweetPhotoStatus.REJECTED, 'Rejected'),
 )
 
-TWEET_PHOTOS_UPLOAD_LIMIT = 9
\ No newline at end of file
+TWEET_PHOTOS_UPLOAD_LIMIT = 9
+
+# tweet 详情里只带上最新的这么多个 comments 和 likes，更多的通过 cursor 去列表 API 里翻页
+TWEET_DETAIL_COMMENTS_LIMIT = 20
+TWEET_DETAIL_LIKES_LIMIT = 20
+
+# 进程内缓存生成好的图片 url，S3 带签名的 url 默认一个小时过期，缓存的时间要比它短
+PHOTO_URL_CACHE_SIZE = 10000
+PHOTO_URL_CACHE_TTL = 600  # in seconds
+
+# write behind 模式下每次从 redis 写回数据库的 tweet 计数器的个数
+COUNTS_FLUSH_BATCH_SIZE = 500
+COUNTS_FLUSH_MAX_BATCHES = 20
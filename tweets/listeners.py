@@ -4,3 +4,14 @@ def push_tweet_to_cache(sender, instance, created, **kwargs):
 
     from tweets.services import TweetService
     TweetService.push_tweet_to_cache(instance)
+
+
+def invalidate_tweet_fragment(sender, instance, **kwargs):
+    from tweets.services import TweetService
+    TweetService.invalidate_tweet_fragment(instance.id)
+
+
+def photo_changed(sender, instance, **kwargs):
+    from tweets.services import TweetService
+    # 图片的 url 在 tweet 的 JSON 片段里
+    TweetService.invalidate_tweet_fragment(instance.tweet_id)
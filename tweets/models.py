@@ -1,10 +1,14 @@
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import post_delete, post_save, pre_delete
 from likes.models import Like
 from tweets.constants import TweetPhotoStatus, TWEET_PHOTO_STATUS_CHOICES
-from tweets.listeners import push_tweet_to_cache
+from tweets.listeners import (
+    invalidate_tweet_fragment,
+    photo_changed,
+    push_tweet_to_cache,
+)
 from utils.listeners import invalidate_object_cache
 from utils.memcached_helper import MemcachedHelper
 from utils.time_helpers import utc_now
@@ -92,3 +96,7 @@ class TweetPhoto(models.Model):
 post_save.connect(invalidate_object_cache, sender=Tweet)
 pre_delete.connect(invalidate_object_cache, sender=Tweet)
 post_save.connect(push_tweet_to_cache, sender=Tweet)
+post_save.connect(invalidate_tweet_fragment, sender=Tweet)
+pre_delete.connect(invalidate_tweet_fragment, sender=Tweet)
+post_save.connect(photo_changed, sender=TweetPhoto)
+post_delete.connect(photo_changed, sender=TweetPhoto)
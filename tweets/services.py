@@ -1,6 +1,21 @@
+from gatekeeper.models import GateKeeper
+from tweets.constants import PHOTO_URL_CACHE_SIZE, PHOTO_URL_CACHE_TTL
 from tweets.models import TweetPhoto, Tweet
-from twitter.cache import USER_TWEETS_PATTERN
+from twitter.cache import (
+    TWEET_FRAGMENT_PATTERN,
+    USER_TWEETS_PATTERN,
+    USER_TWEETS_ZSET_PATTERN,
+)
+from utils.fragment_cache import FragmentCache
 from utils.redis_helper import RedisHelper
+import functools
+import time
+
+
+@functools.lru_cache(maxsize=PHOTO_URL_CACHE_SIZE)
+def _build_photo_url(name, time_bucket):
+    # time_bucket 不参与计算，只是让缓存的 url 每隔 PHOTO_URL_CACHE_TTL 秒重新生成一次
+    return TweetPhoto._meta.get_field('file').storage.url(name)
 
 
 class TweetService(object):
@@ -17,15 +32,79 @@ class TweetService(object):
             )
             photos.append(photo)
         TweetPhoto.objects.bulk_create(photos)
+        # bulk_create 不会触发 post_save
+        cls.invalidate_tweet_fragment(tweet.id)
+
+    @classmethod
+    def invalidate_tweet_fragment(cls, tweet_id):
+        FragmentCache.invalidate(TWEET_FRAGMENT_PATTERN, tweet_id)
+
+    @classmethod
+    def get_photo_url(cls, name):
+        # 生成 S3 的 url 需要计算签名，同一个文件在一段时间内复用生成好的 url
+        return _build_photo_url(name, int(time.time() // PHOTO_URL_CACHE_TTL))
+
+    @classmethod
+    def get_photo_urls(cls, tweet_ids):
+        """
+        一次查询读出一页 tweets 的所有图片，返回 {tweet_id: [url, ...]}，按照 order 排序
+        """
+        photo_urls = {tweet_id: [] for tweet_id in tweet_ids}
+        if not photo_urls:
+            return photo_urls
+        photos = TweetPhoto.objects.filter(
+            tweet_id__in=photo_urls,
+        ).order_by('tweet_id', 'order').values_list('tweet_id', 'file')
+        for tweet_id, name in photos:
+            if name:
+                photo_urls[tweet_id].append(cls.get_photo_url(name))
+        return photo_urls
 
     @classmethod
     def get_cached_tweets(cls, user_id):
         queryset = Tweet.objects.filter(user_id=user_id).order_by('-created_at')
+        # 和 push_tweet_to_cache 用同一个 switch，读写同一种存储方式
+        if GateKeeper.is_switch_on('switch_user_tweets_to_zset'):
+            key = USER_TWEETS_ZSET_PATTERN.format(user_id=user_id)
+            return RedisHelper.load_sorted_objects(key, queryset)
         key = USER_TWEETS_PATTERN.format(user_id=user_id)
         return RedisHelper.load_objects(key, queryset)
 
+    @classmethod
+    def get_cached_tweets_window(
+        cls,
+        user_id,
+        limit=None,
+        created_at__lt=None,
+        created_at__gt=None,
+    ):
+        queryset = Tweet.objects.filter(user_id=user_id).order_by('-created_at')
+        if GateKeeper.is_switch_on('switch_user_tweets_to_zset'):
+            key = USER_TWEETS_ZSET_PATTERN.format(user_id=user_id)
+            return RedisHelper.load_sorted_objects_window(
+                key,
+                queryset,
+                limit=limit,
+                created_at__lt=created_at__lt,
+                created_at__gt=created_at__gt,
+            )
+        key = USER_TWEETS_PATTERN.format(user_id=user_id)
+        return RedisHelper.load_objects_window(
+            key,
+            queryset,
+            limit=limit,
+            created_at__lt=created_at__lt,
+            created_at__gt=created_at__gt,
+        )
+
     @classmethod
     def push_tweet_to_cache(cls, tweet):
         queryset = Tweet.objects.filter(user_id=tweet.user_id).order_by('-created_at')
         key = USER_TWEETS_PATTERN.format(user_id=tweet.user_id)
-        RedisHelper.push_object(key, tweet, queryset)
\ No newline at end of file
+        zset_key = USER_TWEETS_ZSET_PATTERN.format(user_id=tweet.user_id)
+        # 只写当前在用的那种存储方式，同时删掉另一种存储方式下的 key
+        # 这样 switch 切回去的时候会重新从数据库 load，而不会读到过时的数据
+        if GateKeeper.is_switch_on('switch_user_tweets_to_zset'):
+            RedisHelper.push_sorted_object(zset_key, tweet, queryset, stale_key=key)
+        else:
+            RedisHelper.push_object(key, tweet, queryset, stale_key=zset_key)
@@ -1,10 +1,13 @@
 from datetime import timedelta
+from gatekeeper.models import GateKeeper
 from testing.testcases import TestCase
 from tweets.constants import TweetPhotoStatus
-from tweets.models import TweetPhoto
+from tweets.models import Tweet, TweetPhoto
 from tweets.services import TweetService
-from twitter.cache import USER_TWEETS_PATTERN
+from tweets.tasks import flush_tweet_counts_task
+from twitter.cache import USER_TWEETS_PATTERN, USER_TWEETS_ZSET_PATTERN
 from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
 from utils.redis_serializers import DjangoModelSerializer
 from utils.time_helpers import utc_now
 
@@ -54,6 +57,35 @@ class TweetTests(TestCase):
         cached_tweet = DjangoModelSerializer.deserialize(data)
         self.assertEqual(tweet, cached_tweet)
 
+    def test_write_behind_counts(self):
+        GateKeeper.turn_on('switch_counters_write_behind')
+        bob = self.create_user('bob')
+        self.create_like(self.alex, self.tweet)
+        self.create_like(bob, self.tweet)
+        self.create_comment(bob, self.tweet)
+
+        # 数据库还没有更新，redis 里的计数是实时的
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 0)
+        self.assertEqual(self.tweet.comments_count, 0)
+        self.assertEqual(RedisHelper.get_count(self.tweet, 'likes_count'), 2)
+        conn = RedisClient.get_connection()
+        key = RedisHelper.get_counts_key(Tweet, self.tweet.id)
+        self.assertEqual(conn.ttl(key), -1)
+
+        flush_tweet_counts_task()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 2)
+        self.assertEqual(self.tweet.comments_count, 1)
+        self.assertEqual(conn.scard(RedisHelper.get_counts_dirty_key(Tweet)), 0)
+        self.assertEqual(conn.ttl(key) > 0, True)
+
+        # 重复 flush 不会重复计数
+        flush_tweet_counts_task()
+        flush_tweet_counts_task()
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.likes_count, 2)
+
 
 class TweetServiceTests(TestCase):
 
@@ -85,6 +117,36 @@ class TweetServiceTests(TestCase):
         tweet_ids.insert(0, new_tweet.id)
         self.assertEqual([t.id for t in tweets], tweet_ids)
 
+    def test_get_user_tweets_with_zset(self):
+        tweet_ids = []
+        for i in range(3):
+            tweet = self.create_tweet(self.linghu, 'tweet {}'.format(i))
+            tweet_ids.append(tweet.id)
+        tweet_ids = tweet_ids[::-1]
+
+        RedisClient.clear()
+        GateKeeper.turn_on('switch_user_tweets_to_zset')
+        conn = RedisClient.get_connection()
+        zset_key = USER_TWEETS_ZSET_PATTERN.format(user_id=self.linghu.id)
+
+        # cache miss，load 到 sorted set 里
+        tweets = TweetService.get_cached_tweets(self.linghu.id)
+        self.assertEqual([t.id for t in tweets], tweet_ids)
+        self.assertEqual(conn.zcard(zset_key), 3)
+
+        # cache hit
+        with self.assertNumQueries(0):
+            tweets = TweetService.get_cached_tweets(self.linghu.id)
+        self.assertEqual([t.id for t in tweets], tweet_ids)
+
+        # cache updated
+        new_tweet = self.create_tweet(self.linghu, 'new tweet')
+        tweets = TweetService.get_cached_tweets(self.linghu.id)
+        tweet_ids.insert(0, new_tweet.id)
+        self.assertEqual([t.id for t in tweets], tweet_ids)
+        key = USER_TWEETS_PATTERN.format(user_id=self.linghu.id)
+        self.assertFalse(conn.exists(key))
+
     def test_create_new_tweet_before_get_cached_tweets(self):
         tweet1 = self.create_tweet(self.linghu, 'tweet1')
 
@@ -1,7 +1,20 @@
 # memcached
 FOLLOWINGS_PATTERN = 'followings:{user_id}'
 USER_PROFILE_PATTERN = 'userprofile:{user_id}'
+# 和 viewer 无关的那部分 JSON，version 是片段格式的版本号
+TWEET_FRAGMENT_PATTERN = 'tweet_fragment:{version}:{object_id}'
+USER_FRAGMENT_PATTERN = 'user_fragment:{version}:{object_id}'
 
 # redis
 USER_TWEETS_PATTERN = 'user_tweets:{user_id}'
 USER_NEWSFEEDS_PATTERN = 'user_newsfeeds:{user_id}'
+# 某个 tweet 下面的 comments 和 likes，按照 created_at 倒序
+TWEET_COMMENTS_PATTERN = 'tweet_comments:{tweet_id}'
+TWEET_LIKES_PATTERN = 'tweet_likes:{tweet_id}'
+# like 过某个 tweet 或者 comment 的所有 user id，比如 Tweet.likers:1
+LIKERS_PATTERN = '{model_name}.likers:{object_id}'
+
+# redis sorted set，通过 gatekeeper 的 switch_user_tweets_to_zset 和
+# switch_user_newsfeeds_to_zset 灰度切换
+USER_TWEETS_ZSET_PATTERN = 'user_tweets_zset:{user_id}'
+USER_NEWSFEEDS_ZSET_PATTERN = 'user_newsfeeds_zset:{user_id}'
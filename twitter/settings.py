@@ -52,6 +52,7 @@ INSTALLED_APPS = [
     'comments',
     'likes',
     'inbox',
+    'utils',
 ]
 
 REST_FRAMEWORK = {
@@ -61,6 +62,12 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
     'EXCEPTION_HANDLER': 'utils.ratelimit.exception_handler',
+    # 热点接口（tweets, newsfeeds, comments）已经用了 utils.renderers.ORJSONRenderer
+    # 想要所有接口都使用的话，打开下面的配置
+    # 'DEFAULT_RENDERER_CLASSES': [
+    #     'utils.renderers.ORJSONRenderer',
+    #     'rest_framework.renderers.BrowsableAPIRenderer',
+    # ],
 }
 
 MIDDLEWARE = [
@@ -71,6 +78,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utils.middleware.RequestCacheMiddleware',
     "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
@@ -197,6 +205,12 @@ CACHES = {
          'KEY_PREFIX': 'rl',
      },
 }
+# 数据库里不存在的 object 在 memcached 里的 tombstone 的过期时间
+MEMCACHED_TOMBSTONE_TIMEOUT = 60  # in seconds
+# tweet 和 user 的 JSON 片段的过期时间，里面的图片和头像是带签名的 url，过期时间要比签名的短
+FRAGMENT_CACHE_TIMEOUT = 600  # in seconds
+# XFetch 提前刷新的系数，越大越早刷新，1 是论文里推荐的默认值
+XFETCH_BETA = 1.0
 
 # Redis
 # 安装方法: sudo apt-get install redis
@@ -206,6 +220,28 @@ REDIS_PORT = 6379
 REDIS_DB = 0 if TESTING else 1
 REDIS_KEY_EXPIRE_TIME = 7 * 86400  # in seconds
 REDIS_LIST_LENGTH_LIMIT = 1000 if not TESTING else 20
+# 连接池，默认 REDIS_MAX_CONNECTIONS = None 不限制每个进程的连接数
+# 需要限制的时候（比如 redis 的 maxclients 比较小）设置成一个足够大的数字，
+# 连接池满了之后最多等待 REDIS_POOL_TIMEOUT 秒，还没有空闲的连接再抛出 ConnectionError
+REDIS_MAX_CONNECTIONS = None
+REDIS_POOL_TIMEOUT = 5  # in seconds
+REDIS_SOCKET_TIMEOUT = 1  # in seconds
+REDIS_SOCKET_CONNECT_TIMEOUT = 1  # in seconds
+# 连接空闲超过这个时间之后，下次使用之前先 ping 一下，避免用到已经断开的连接
+REDIS_HEALTH_CHECK_INTERVAL = 30  # in seconds
+# 只读的 replica，配置之后 load_objects, get_count, GateKeeper.get 之类的读操作会走 replica
+REDIS_REPLICA_HOST = None
+REDIS_REPLICA_PORT = 6379
+
+# 进程内的 LRU cache，放在 memcached 前面，只缓存 LOCAL_CACHE_MODELS 里的 models
+LOCAL_CACHE_ENABLED = False
+LOCAL_CACHE_MODELS = ('User', 'Tweet')
+LOCAL_CACHE_MAX_ENTRIES = 10000
+LOCAL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+LOCAL_CACHE_TTL = 60  # in seconds
+
+# cache 的命中率，延迟等统计先在进程内累加，每隔这么久写一次 redis
+METRICS_FLUSH_INTERVAL = 10  # in seconds
 
 # Celery Configuration Options
 # 使用如下命令把 worker 进程（只执行异步任务的进程，可以在不同的机器上）单独跑起来
@@ -217,6 +253,20 @@ CELERY_TASK_ALWAYS_EAGER = TESCELERY_QUEUES = (
     Queue('default', routing_key='default'),
     Queue('newsfeeds', routing_key='newsfeeds'),
 )
+# 使用如下命令启动定时任务
+#   celery -A twitter beat -l INFO
+CELERY_BEAT_SCHEDULE = {
+    'flush-tweet-counts': {
+        'task': 'tweets.tasks.flush_tweet_counts_task',
+        'schedule': 10.0,  # in seconds
+        'options': {'routing_key': 'default'},
+    },
+    'flush-comment-counts': {
+        'task': 'comments.tasks.flush_comment_counts_task',
+        'schedule': 10.0,  # in seconds
+        'options': {'routing_key': 'default'},
+    },
+}
 
 # Rate Limiter
 RATELIMIT_USE_CACHE = 'ratelimit'
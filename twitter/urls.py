@@ -25,6 +25,7 @@ from likes.api.views import LikeViewSet
 from newsfeeds.api.views import NewsFeedViewSet
 from rest_framework import routers
 from tweets.api.views import TweetViewSet
+from utils.api.views import MetricsViewSet
 
 router = routers.DefaultRouter()
 router.register(r'api/users', UserViewSet)
@@ -36,6 +37,7 @@ router.register(r'api/comments', CommentViewSet, basename='comments')
 router.register(r'api/likes', LikeViewSet, basename='likes')
 router.register(r'api/notifications', NotificationViewSet, basename='notifications')
 router.register(r'api/profiles', UserProfileViewSet, basename='profiles')
+router.register(r'api/metrics', MetricsViewSet, basename='metrics')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
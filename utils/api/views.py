@@ -0,0 +1,15 @@
+from rest_framework import viewsets
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from utils.metrics import Metrics
+
+
+class MetricsViewSet(viewsets.ViewSet):
+    permission_classes = (IsAdminUser,)
+
+    def list(self, request):
+        # process 是处理这个请求的进程自己的值，cluster 是所有进程汇总到 redis 里的值
+        return Response({
+            'process': Metrics.snapshot(),
+            'cluster': Metrics.get_all(),
+        })
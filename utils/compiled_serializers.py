@@ -0,0 +1,104 @@
+from operator import attrgetter
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+
+# context 里带上这个 key 的时候，serializer 用编译好的函数输出
+COMPILED_CONTEXT_KEY = 'compiled'
+
+
+class CompiledSerializer:
+    """
+    只读场景下代替 DRF 的 Serializer.to_representation
+    DRF 每次序列化都要 deepcopy 一遍 fields 再 bind 到 serializer 上，然后逐个字段判断
+    PKOnlyObject, SkipField 等情况，一页 tweets 里嵌套的 user 每个都要走一遍
+    这里每个 serializer class 只解析一次字段，编译成一个函数，直接输出 dict
+    输出和 DRF 完全一样（字段顺序也一样），渲染出来的 JSON 是一样的
+    字段里有嵌套的 serializer, RelatedField 或者 FileField 的时候输出依赖 context，
+    不编译，还是交给 DRF
+    """
+    # serializer_class -> 编译好的函数，不能编译的是 None
+    _compiled = {}
+
+    @classmethod
+    def compile(cls, serializer_class):
+        if serializer_class not in cls._compiled:
+            cls._compiled[serializer_class] = cls._compile(serializer_class)
+        return cls._compiled[serializer_class]
+
+    @classmethod
+    def _depends_on_context(cls, field):
+        # 编译用的 template 没有 context，这些字段的输出和真正的 serializer 不一样
+        # RelatedField 包括 HyperlinkedRelatedField 和 HyperlinkedIdentityField
+        # FileField（包括 ImageField）在 context 里有 request 的时候输出的是绝对 url
+        if isinstance(field, (
+            serializers.BaseSerializer,
+            serializers.RelatedField,
+            serializers.ManyRelatedField,
+            serializers.FileField,
+        )):
+            return True
+        # ListField, DictField 等字段的输出取决于 child
+        child = getattr(field, 'child', None)
+        return child is not None and cls._depends_on_context(child)
+
+    @classmethod
+    def _compile(cls, serializer_class):
+        # 只用来读取字段的定义，绑定在这个 serializer 上的 field 之后一直复用
+        template = serializer_class()
+        model_attrs = set()
+        if isinstance(template, serializers.ModelSerializer):
+            for field in template.Meta.model._meta.concrete_fields:
+                model_attrs.update([field.name, field.attname])
+
+        plan = []
+        for field in template._readable_fields:
+            if isinstance(field, serializers.SerializerMethodField):
+                plan.append((field.field_name, field.method_name, None, None))
+                continue
+            if cls._depends_on_context(field):
+                return None
+            if field.source in model_attrs:
+                # model 的字段直接 getattr，不需要 get_attribute 里对 dict 和 callable 的判断
+                getter = attrgetter(field.source)
+            else:
+                getter = field.get_attribute
+            plan.append((field.field_name, None, getter, field.to_representation))
+        plan = tuple(plan)
+
+        def to_representation(serializer, instance):
+            ret = {}
+            for field_name, method_name, getter, to_representation in plan:
+                if method_name is not None:
+                    ret[field_name] = getattr(serializer, method_name)(instance)
+                    continue
+                try:
+                    attribute = getter(instance)
+                except SkipField:
+                    continue
+                # 和 Serializer.to_representation 一样，None 不需要再转换
+                if isinstance(attribute, PKOnlyObject):
+                    check_for_none = attribute.pk
+                else:
+                    check_for_none = attribute
+                if check_for_none is None:
+                    ret[field_name] = None
+                else:
+                    ret[field_name] = to_representation(attribute)
+            return ret
+
+        return to_representation
+
+
+class CompiledSerializerMixin:
+    """
+    加在只读的 serializer 上，context 里有 COMPILED_CONTEXT_KEY 的时候用 CompiledSerializer
+    嵌套在 SerializerMethodField 里的 serializer 用的是同一个 context，也会跟着用编译好的函数
+    """
+
+    def to_representation(self, instance):
+        if self.context.get(COMPILED_CONTEXT_KEY):
+            to_representation = CompiledSerializer.compile(self.__class__)
+            if to_representation is not None:
+                return to_representation(self, instance)
+        return super(CompiledSerializerMixin, self).to_representation(instance)
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from django.conf import settings
+from utils.metrics import Metrics
+from utils.redis_client import RedisClient
+import os
+import redis
+import threading
+import time
+
+# 所有进程都订阅这个 channel，收到 key 之后删掉本进程里的数据
+INVALIDATION_CHANNEL = 'local_cache:invalidate'
+
+
+class LocalCache:
+    """
+    进程内的 LRU cache，放在 memcached 前面，用来缓存少数访问量特别大的 objects
+    比如明星用户和热门 tweet，命中的时候不需要访问网络
+    - 存的是序列化之后的 bytes，调用方每次反序列化得到一个新的 object，不会互相影响
+    - 按照条数和 bytes 的总大小淘汰最久没有被访问的数据，每条数据有 TTL
+    - 数据修改之后通过 redis 的 pub/sub 通知所有的 gunicorn 和 celery 进程删掉自己的数据
+    """
+    _store = OrderedDict()  # key -> (expire_at, data)
+    _bytes = 0
+    _hits = 0
+    _misses = 0
+    _lock = threading.Lock()
+    # 启动订阅线程的进程，fork 之后的子进程里没有这个线程，需要重新启动
+    _pid = None
+    _subscribed = threading.Event()
+
+    @classmethod
+    def is_enabled_for(cls, model_class):
+        return settings.LOCAL_CACHE_ENABLED and \
+            model_class.__name__ in settings.LOCAL_CACHE_MODELS
+
+    @classmethod
+    def _ensure_listener(cls):
+        pid = os.getpid()
+        if cls._pid == pid:
+            return
+        with cls._lock:
+            if cls._pid == pid:
+                return
+            cls._store.clear()
+            cls._bytes = 0
+            cls._subscribed = threading.Event()
+            threading.Thread(target=cls._listen, daemon=True).start()
+            cls._pid = pid
+        # 等订阅成功之后再开始缓存，避免错过这期间的 invalidate 消息
+        cls._subscribed.wait(timeout=1)
+
+    @classmethod
+    def _listen(cls):
+        while True:
+            try:
+                pubsub = RedisClient.get_connection().pubsub(
+                    ignore_subscribe_messages=True,
+                )
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                if cls._subscribed.is_set():
+                    # 断线重连的期间可能错过了一些消息，清空本进程的数据
+                    cls.clear()
+                cls._subscribed.set()
+                while True:
+                    # 不使用 listen()，避免空闲的时候触发 socket timeout
+                    message = pubsub.get_message(timeout=1)
+                    if message is not None:
+                        cls.delete(message['data'].decode('utf-8'))
+            except redis.RedisError:
+                time.sleep(1)
+
+    @classmethod
+    def _remove(cls, key):
+        # 调用之前需要持有 _lock
+        entry = cls._store.pop(key, None)
+        if entry is not None:
+            cls._bytes -= len(entry[1])
+
+    @classmethod
+    def get(cls, key):
+        cls._ensure_listener()
+        with cls._lock:
+            entry = cls._store.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                cls._remove(key)
+                entry = None
+            if entry is None:
+                cls._misses += 1
+            else:
+                cls._store.move_to_end(key)
+                cls._hits += 1
+        if entry is None:
+            Metrics.cache_miss('local', key)
+            return None
+        Metrics.cache_hit('local', key, len(entry[1]))
+        return entry[1]
+
+    @classmethod
+    def set(cls, key, data):
+        cls._ensure_listener()
+        if len(data) > settings.LOCAL_CACHE_MAX_BYTES:
+            return
+        with cls._lock:
+            cls._remove(key)
+            cls._store[key] = (time.monotonic() + settings.LOCAL_CACHE_TTL, data)
+            cls._bytes += len(data)
+            while len(cls._store) > settings.LOCAL_CACHE_MAX_ENTRIES or \
+                    cls._bytes > settings.LOCAL_CACHE_MAX_BYTES:
+                _, (_, evicted) = cls._store.popitem(last=False)
+                cls._bytes -= len(evicted)
+
+    @classmethod
+    def delete(cls, key):
+        with cls._lock:
+            cls._remove(key)
+
+    @classmethod
+    def invalidate(cls, key):
+        # 删掉本进程的数据，并通知其他所有进程
+        cls.delete(key)
+        RedisClient.get_connection().publish(INVALIDATION_CHANNEL, key)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._store.clear()
+            cls._bytes = 0
+
+    @classmethod
+    def get_stats(cls):
+        with cls._lock:
+            total = cls._hits + cls._misses
+            return {
+                'hits': cls._hits,
+                'misses': cls._misses,
+                'hit_rate': cls._hits / total if total else 0,
+                'entries': len(cls._store),
+                'bytes': cls._bytes,
+            }
@@ -0,0 +1,53 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from newsfeeds.api.serializers import NewsFeedSerializer
+from newsfeeds.services import NewsFeedService
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+from utils.renderers import ORJSONRenderer
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compare JSONRenderer and ORJSONRenderer on a newsfeed page of a user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, required=True)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--iterations', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(id=options['user_id'])
+        except User.DoesNotExist:
+            raise CommandError('user {} does not exist'.format(options['user_id']))
+
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(user.id)
+        newsfeeds = newsfeeds[:options['page_size']]
+        request = APIRequestFactory().get('/api/newsfeeds/')
+        request.user = user
+        data = {
+            'results': NewsFeedSerializer(
+                newsfeeds,
+                context={'request': request},
+                many=True,
+            ).data,
+            'has_next_page': False,
+        }
+
+        # 只比较渲染的时间，序列化的部分两种 renderer 是一样的
+        results = {}
+        for renderer in [JSONRenderer(), ORJSONRenderer()]:
+            name = renderer.__class__.__name__
+            if renderer.render(data) != JSONRenderer().render(data):
+                self.stdout.write('{} output differs from JSONRenderer'.format(name))
+            start = time.perf_counter()
+            for _ in range(options['iterations']):
+                renderer.render(data)
+            results[name] = (time.perf_counter() - start) * 1000 / options['iterations']
+            self.stdout.write('{} {:.3f} ms/render'.format(name, results[name]))
+
+        if results['ORJSONRenderer']:
+            self.stdout.write('speedup {:.1f}x'.format(
+                results['JSONRenderer'] / results['ORJSONRenderer'],
+            ))
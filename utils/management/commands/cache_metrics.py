@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from utils.metrics import Metrics
+
+
+class Command(BaseCommand):
+    help = 'Print cache hit/miss/latency counters of all processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Clear all counters after printing them',
+        )
+
+    def handle(self, *args, **options):
+        counters = Metrics.get_all()
+        for field in sorted(counters):
+            self.stdout.write('{} {}'.format(field, counters[field]))
+        if options['reset']:
+            Metrics.reset()
+            self.stdout.write('metrics reset')
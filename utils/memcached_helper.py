@@ -1,30 +1,202 @@
 from django.conf import settings
 from django.core.cache import caches
+from utils import xfetch
+from utils.local_cache import LocalCache
+from utils.metrics import Metrics
+from utils.redis_serializers import CompactModelSerializer
+from utils.request_cache import RequestCache
 
 cache = caches['testing'] if settings.TESTING else caches['default']
 
+# 数据库里不存在的 object 在 cache 里存一个 tombstone，避免每次都去数据库里查询
+TOMBSTONE = b'\x00'
+# request cache 里用来表示 "已经确认不存在"，和 "没有缓存" 的 None 区分开
+DOES_NOT_EXIST = object()
+
 
 class MemcachedHelper:
+    # 和 redis 里的 list 使用同样的紧凑格式，只存 concrete fields，读取的时候不需要 unpickle
+    serializer = CompactModelSerializer
 
     @classmethod
     def get_key(cls, model_class, object_id):
         return '{}:{}'.format(model_class.__name__, object_id)
 
+    @classmethod
+    def encode(cls, obj, delta=0):
+        # 带上过期时间和这次从数据库读取花了多长时间，用来判断是否需要提前刷新
+        return xfetch.wrap(cls.serializer.serialize(obj), delta, cache.default_timeout)
+
+    @classmethod
+    def _does_not_exist(cls, model_class, object_id):
+        return model_class.DoesNotExist(
+            '{} matching id={} does not exist.'.format(model_class.__name__, object_id),
+        )
+
+    @classmethod
+    def decode(cls, data):
+        # 升级之前写入的是 pickle 之后的 model instance，当成 cache miss，读数据库之后
+        # 用新的格式重新写入。model 的字段变了之后 deserialize 会返回 None，同样当成 miss
+        # 其他 model 的数据不受影响，所以上线之后不会突然出现大量的 cache miss
+        data = xfetch.unwrap(data)[0]
+        if not isinstance(data, bytes) or data[:1] != cls.serializer.VERSION_BYTE:
+            return None
+        return cls.serializer.deserialize(data)
+
+    @classmethod
+    def load(cls, data):
+        """
+        decode 从 memcached 里读到的数据，快要过期的数据按照 XFetch 的概率提前当成 cache miss
+        由这一个请求去数据库重新读取，而不是等到过期之后所有请求一起去数据库里读
+        """
+        _, expire_at, delta = xfetch.unwrap(data)
+        if xfetch.should_refresh_early(expire_at, delta):
+            Metrics.incr('xfetch_early_refresh')
+            return None
+        return cls.decode(data)
+
+    @classmethod
+    def _get_from_memory(cls, model_class, key):
+        # 同一个 request 里已经读过了
+        obj = RequestCache.get(key)
+        if obj is not None:
+            return obj
+        # 本进程里缓存的热门 objects
+        if LocalCache.is_enabled_for(model_class):
+            data = LocalCache.get(key)
+            if data == TOMBSTONE:
+                obj = DOES_NOT_EXIST
+            elif data is not None:
+                obj = cls.decode(data)
+            if obj is not None:
+                RequestCache.set(key, obj)
+        return obj
+
+    @classmethod
+    def _set_to_memory(cls, model_class, key, obj, data):
+        RequestCache.set(key, obj)
+        if LocalCache.is_enabled_for(model_class):
+            LocalCache.set(key, data)
+
     @classmethod
     def get_object_through_cache(cls, model_class, object_id):
         key = cls.get_key(model_class, object_id)
+        obj = cls._get_from_memory(model_class, key)
+        if obj is DOES_NOT_EXIST:
+            Metrics.incr('memcached_tombstone_hits')
+            raise cls._does_not_exist(model_class, object_id)
+        if obj is not None:
+            return obj
+
         # cache hit
-        obj = cache.get(key)
-        if obj:
+        with Metrics.timer('cache_latency_ms', tier='memcached', pattern=model_class.__name__):
+            data = cache.get(key)
+        if data == TOMBSTONE:
+            cls._set_to_memory(model_class, key, DOES_NOT_EXIST, data)
+            Metrics.incr('memcached_tombstone_hits')
+            raise cls._does_not_exist(model_class, object_id)
+        obj = cls.load(data)
+        if obj is not None:
+            Metrics.cache_hit('memcached', key, len(data))
+            cls._set_to_memory(model_class, key, obj, data)
             return obj
 
         # cache miss
-        obj = model_class.objects.get(id=object_id)
+        Metrics.cache_miss('memcached', key)
+        with xfetch.Timer() as timer:
+            obj = model_class.objects.filter(id=object_id).first()
+        if obj is None:
+            # 不存在的 object 只缓存很短的时间，被创建之后 post_save 也会把 tombstone 删掉
+            cache.set(key, TOMBSTONE, settings.MEMCACHED_TOMBSTONE_TIMEOUT)
+            cls._set_to_memory(model_class, key, DOES_NOT_EXIST, TOMBSTONE)
+            raise cls._does_not_exist(model_class, object_id)
+        data = cls.encode(obj, timer.delta)
         # using default expire time
-        cache.set(key, obj)
+        cache.set(key, data)
+        Metrics.cache_fill('memcached', key, len(data))
+        cls._set_to_memory(model_class, key, obj, data)
         return obj
 
+    @classmethod
+    def get_objects_through_cache(cls, model_class, object_ids):
+        """
+        批量版本的 get_object_through_cache，一次 get_many 读出所有的 objects
+        cache miss 的用一次 id__in 的数据库查询读出来之后 set_many 写回 cache
+        按照 object_ids 的顺序返回，数据库里不存在的 object 会被跳过
+        """
+        keys = {
+            object_id: cls.get_key(model_class, object_id)
+            for object_id in object_ids
+            if object_id is not None
+        }
+        objects = {}
+        for object_id, key in keys.items():
+            obj = cls._get_from_memory(model_class, key)
+            if obj is not None:
+                objects[object_id] = obj
+        with Metrics.timer('cache_latency_ms', tier='memcached', pattern=model_class.__name__):
+            cached = cache.get_many([
+                key
+                for object_id, key in keys.items()
+                if object_id not in objects
+            ])
+
+        missing_ids = []
+        for object_id, key in keys.items():
+            if object_id in objects:
+                continue
+            if cached.get(key) == TOMBSTONE:
+                objects[object_id] = DOES_NOT_EXIST
+                cls._set_to_memory(model_class, key, DOES_NOT_EXIST, TOMBSTONE)
+                Metrics.incr('memcached_tombstone_hits')
+                continue
+            obj = cls.load(cached.get(key))
+            if obj is not None:
+                Metrics.cache_hit('memcached', key, len(cached[key]))
+                objects[object_id] = obj
+                cls._set_to_memory(model_class, key, obj, cached[key])
+            else:
+                Metrics.cache_miss('memcached', key)
+                missing_ids.append(object_id)
+
+        if missing_ids:
+            with xfetch.Timer() as timer:
+                db_objects = {
+                    obj.id: obj
+                    for obj in model_class.objects.filter(id__in=missing_ids)
+                }
+            encoded = {
+                cls.get_key(model_class, object_id): cls.encode(obj, timer.delta)
+                for object_id, obj in db_objects.items()
+            }
+            cache.set_many(encoded)
+            for key, data in encoded.items():
+                Metrics.cache_fill('memcached', key, len(data))
+            for object_id, obj in db_objects.items():
+                key = cls.get_key(model_class, object_id)
+                cls._set_to_memory(model_class, key, obj, encoded[key])
+            objects.update(db_objects)
+
+            tombstones = {
+                keys[object_id]: TOMBSTONE
+                for object_id in missing_ids
+                if object_id not in db_objects
+            }
+            cache.set_many(tombstones, settings.MEMCACHED_TOMBSTONE_TIMEOUT)
+            for key in tombstones:
+                cls._set_to_memory(model_class, key, DOES_NOT_EXIST, TOMBSTONE)
+
+        return [
+            objects[object_id]
+            for object_id in object_ids
+            if objects.get(object_id, DOES_NOT_EXIST) is not DOES_NOT_EXIST
+        ]
+
     @classmethod
     def invalidate_cached_object(cls, model_class, object_id):
         key = cls.get_key(model_class, object_id)
         cache.delete(key)
+        RequestCache.delete(key)
+        if LocalCache.is_enabled_for(model_class):
+            # 通知所有的进程删掉自己缓存的数据
+            LocalCache.invalidate(key)
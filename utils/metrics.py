@@ -0,0 +1,170 @@
+from collections import defaultdict
+from django.conf import settings
+from utils.redis_client import RedisClient
+import bisect
+import redis
+import threading
+import time
+
+
+class Metrics:
+    """
+    带 label 的计数器和直方图，先在进程内累加，每隔 METRICS_FLUSH_INTERVAL 秒
+    通过一次 pipeline 把增量累加到 redis 的同一个 hash 里，得到所有进程的汇总
+    每次记录只是进程内的几次 dict 操作，可以在生产环境一直打开
+
+    计数器的名字和 label 拼成 name{label=value,...} 作为 hash 的 field
+    直方图拆成多个计数器：name_bucket{le=...}, name_count, name_sum
+    """
+    KEY = 'metrics:counters'
+    # 直方图的桶的上界
+    LATENCY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)  # in milliseconds
+    SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288)  # in bytes
+
+    _lock = threading.Lock()
+    # 还没有写到 redis 里的增量
+    _pending = defaultdict(int)
+    # 本进程启动以来的累计值
+    _totals = defaultdict(int)
+    _last_flush = time.monotonic()
+
+    @classmethod
+    def get_field(cls, name, **labels):
+        if not labels:
+            return name
+        return '{}{{{}}}'.format(name, ','.join(
+            '{}={}'.format(label, labels[label])
+            for label in sorted(labels)
+        ))
+
+    @classmethod
+    def _add(cls, fields):
+        with cls._lock:
+            for field, amount in fields:
+                cls._pending[field] += amount
+                cls._totals[field] += amount
+            should_flush = time.monotonic() - cls._last_flush >= \
+                settings.METRICS_FLUSH_INTERVAL
+        if should_flush:
+            cls.flush()
+
+    @classmethod
+    def incr(cls, name, amount=1, **labels):
+        cls._add([(cls.get_field(name, **labels), amount)])
+
+    @classmethod
+    def observe(cls, name, value, buckets, **labels):
+        # 落在第一个 >= value 的桶里，比最大的桶还大的计入 le=inf
+        index = bisect.bisect_left(buckets, value)
+        le = buckets[index] if index < len(buckets) else 'inf'
+        cls._add([
+            (cls.get_field(name + '_bucket', le=le, **labels), 1),
+            (cls.get_field(name + '_count', **labels), 1),
+            (cls.get_field(name + '_sum', **labels), int(value)),
+        ])
+
+    @classmethod
+    def timer(cls, name, **labels):
+        """
+        with Metrics.timer('cache_latency_ms', tier='redis', pattern='user_tweets'):
+            ...
+        """
+        return _Timer(name, labels)
+
+    @classmethod
+    def get_pattern(cls, key):
+        # user_tweets:1 -> user_tweets, Tweet:1 -> Tweet, Tweet.counts:1 -> Tweet.counts
+        return key.split(':', 1)[0]
+
+    @classmethod
+    def _record_cache(cls, name, tier, key, size):
+        pattern = cls.get_pattern(key)
+        fields = [(cls.get_field(name, tier=tier, pattern=pattern), 1)]
+        if size is not None:
+            index = bisect.bisect_left(cls.SIZE_BUCKETS, size)
+            le = cls.SIZE_BUCKETS[index] if index < len(cls.SIZE_BUCKETS) else 'inf'
+            labels = {'tier': tier, 'pattern': pattern}
+            fields.extend([
+                (cls.get_field('cache_payload_bytes_bucket', le=le, **labels), 1),
+                (cls.get_field('cache_payload_bytes_count', **labels), 1),
+                (cls.get_field('cache_payload_bytes_sum', **labels), size),
+            ])
+        cls._add(fields)
+
+    @classmethod
+    def cache_hit(cls, tier, key, size=None):
+        cls._record_cache('cache_hits', tier, key, size)
+
+    @classmethod
+    def cache_miss(cls, tier, key):
+        cls._record_cache('cache_misses', tier, key, None)
+
+    @classmethod
+    def cache_fill(cls, tier, key, size=None):
+        cls._record_cache('cache_fills', tier, key, size)
+
+    @classmethod
+    def flush(cls):
+        with cls._lock:
+            pending = cls._pending
+            cls._pending = defaultdict(int)
+            cls._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            pipe = RedisClient.get_connection().pipeline(transaction=False)
+            for field, amount in pending.items():
+                pipe.hincrby(cls.KEY, field, amount)
+            pipe.execute()
+        except redis.RedisError:
+            # redis 暂时不可用的时候留到下一次再写
+            with cls._lock:
+                for field, amount in pending.items():
+                    cls._pending[field] += amount
+
+    @classmethod
+    def get(cls, name, **labels):
+        # 所有进程汇总之后的值
+        cls.flush()
+        value = RedisClient.get_connection().hget(cls.KEY, cls.get_field(name, **labels))
+        return int(value) if value is not None else 0
+
+    @classmethod
+    def get_all(cls):
+        cls.flush()
+        return {
+            field.decode('utf-8'): int(value)
+            for field, value in RedisClient.get_connection().hgetall(cls.KEY).items()
+        }
+
+    @classmethod
+    def snapshot(cls):
+        # 本进程启动以来的值
+        with cls._lock:
+            return dict(cls._totals)
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._pending = defaultdict(int)
+            cls._totals = defaultdict(int)
+        RedisClient.get_connection().delete(cls.KEY)
+
+
+class _Timer:
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        Metrics.observe(
+            self.name,
+            (time.monotonic() - self.start) * 1000,
+            Metrics.LATENCY_BUCKETS,
+            **self.labels,
+        )
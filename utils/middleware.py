@@ -0,0 +1,24 @@
+from django.conf import settings
+from utils.request_cache import RequestCache
+
+
+class RequestCacheMiddleware:
+    """
+    每个 request 使用一个新的 RequestCache，通过 X-Request-Cache-Hits 这个 header
+    返回这个 request 里有多少次 memcached / redis 的访问被合并掉了
+    这是内部的调试信息，只在 DEBUG 模式下或者 staff 用户的 request 里返回
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        RequestCache.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            hits = RequestCache.end()
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or (user is not None and user.is_staff):
+            response['X-Request-Cache-Hits'] = hits
+        return response
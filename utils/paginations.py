@@ -1,5 +1,6 @@
 from dateutil import parser
 from django.conf import settings
+from django.http import HttpResponse
 from rest_framework.pagination import BasePagination
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
@@ -150,12 +151,49 @@ class EndlessPagination(BasePagination):
         # 如果进入这里，说明可能存在在数据库里没有 load 在 cache 里的数据，需要直接去数据库查询
         return None
 
+    def paginate_cached_window(self, load_window, request):
+        """
+        load_window(limit=None, created_at__lt=None, created_at__gt=None) 只从 cache 里
+        读出当前这一页需要的 objects，返回 None 表示超出了 cache 的范围，需要去数据库查询
+        """
+        if 'created_at__gt' in request.query_params:
+            # 下拉刷新，加载所有比 created_at__gt 更新的数据
+            created_at__gt = parser.isoparse(request.query_params['created_at__gt'])
+            self.has_next_page = False
+            return load_window(created_at__gt=created_at__gt)
+
+        created_at__lt = None
+        if 'created_at__lt' in request.query_params:
+            created_at__lt = parser.isoparse(request.query_params['created_at__lt'])
+        # 多取一个用来判断是否还有下一页
+        objects = load_window(
+            limit=self.page_size + 1,
+            created_at__lt=created_at__lt,
+        )
+        if objects is None:
+            return None
+        self.has_next_page = len(objects) > self.page_size
+        return objects[:self.page_size]
+
     def get_paginated_response(self, data):
         return Response({
             'has_next_page': self.has_next_page,
             'results': data,
         })
 
+    def get_paginated_fragments_response(self, fragments):
+        """
+        fragments 是每个 object 已经渲染好的 JSON bytes，直接拼成 response，不再经过 renderer
+        """
+        content = b''.join([
+            b'{"has_next_page":',
+            b'true' if self.has_next_page else b'false',
+            b',"results":[',
+            b','.join(fragments),
+            b']}',
+        ])
+        return HttpResponse(content, content_type='application/json')
+
 
 class FriendshipPagination(PageNumberPagination):
     # 默认的 page size，也就是 page 没有在 url 参数里的时候
@@ -1,20 +1,58 @@
 from django.conf import settings
+import os
 import redis
 
 
 class RedisClient:
     conn = None
+    # 只读的 replica，没有配置 REDIS_REPLICA_HOST 的时候读写都走 master
+    replica_conn = None
+    # 创建连接池的进程，fork 出来的子进程（比如 celery 的 worker）不能和父进程共用 socket
+    pid = None
 
     @classmethod
-    def get_connection(cls):
-        # 使用 singleton 模式，全局只创建一个 connection
-        if cls.conn:
-            return cls.conn
-        cls.conn = redis.Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
+    def _create_connection(cls, host, port):
+        # redis.Redis 本身是线程安全的，每个命令从连接池里拿一个连接，用完放回去
+        kwargs = dict(
+            host=host,
+            port=port,
             db=settings.REDIS_DB,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
         )
+        if settings.REDIS_MAX_CONNECTIONS is None:
+            # 默认不限制连接数，和以前的 ConnectionPool 一样，突发流量的时候不会因为等连接报错
+            pool = redis.ConnectionPool(**kwargs)
+        else:
+            # 限制了连接数的时候，连接池满了等待 REDIS_POOL_TIMEOUT 秒，还没有空闲的连接再抛出 ConnectionError
+            pool = redis.BlockingConnectionPool(
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                timeout=settings.REDIS_POOL_TIMEOUT,
+                **kwargs,
+            )
+        return redis.Redis(connection_pool=pool)
+
+    @classmethod
+    def get_connection(cls, read_only=False):
+        # 每个进程只创建一个连接池，fork 之后在子进程里重新创建
+        pid = os.getpid()
+        if cls.pid != pid:
+            cls.conn = cls._create_connection(
+                settings.REDIS_HOST,
+                settings.REDIS_PORT,
+            )
+            cls.replica_conn = None
+            if settings.REDIS_REPLICA_HOST:
+                cls.replica_conn = cls._create_connection(
+                    settings.REDIS_REPLICA_HOST,
+                    settings.REDIS_REPLICA_PORT,
+                )
+            cls.pid = pid
+
+        # replica 上的数据可能会有一点延迟，只有能接受读到旧数据的地方才使用 read_only
+        if read_only and cls.replica_conn is not None:
+            return cls.replica_conn
         return cls.conn
 
     @classmethod
@@ -1,9 +1,249 @@
 from django.conf import settings
+from django.db import transaction
+from utils import xfetch
+from utils.metrics import Metrics
 from utils.redis_client import RedisClient
-from utils.redis_serializers import DjangoModelSerializer
+from utils.redis_serializers import CompactModelSerializer
+from utils.request_cache import RequestCache
+from utils.time_helpers import to_microseconds
+import time
+import uuid
+
+
+# 只有 key 不存在的时候才写入，rpush 和 expire 在 redis 服务端一次性原子地完成
+# 避免两个请求同时 cache miss 的时候把同一份数据 rpush 两遍
+# ARGV[1] 是过期时间，ARGV[2:] 是序列化之后的 objects
+LOAD_OBJECTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('RPUSH', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# 只有 key 存在的时候才 push，避免 exists 和 lpush 之间 key 过期导致 list 里只剩一个 object
+# 如果 list 头部已经是这个 object（比如刚刚从数据库 load 的时候已经读到了），就不再重复 push
+# ARGV[1] 是序列化之后的 object，ARGV[2] 是 list 的长度上限
+# KEYS[2] 是可选的，灰度切换存储方式的时候用来删掉另一种存储方式下已经过时的 key
+PUSH_OBJECT_SCRIPT = """
+if KEYS[2] then
+    redis.call('DEL', KEYS[2])
+end
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if redis.call('LINDEX', KEYS[1], 0) ~= ARGV[1] then
+    redis.call('LPUSH', KEYS[1], ARGV[1])
+    redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+end
+return 1
+"""
+
+# 从 list 里删掉 ARGV[1]，ARGV[1] 已经不在 list 里的时候返回 0
+# list 已经达到长度上限的时候，ARGV[3] 是数据库里紧接着 list 末尾 ARGV[2] 的下一个 object
+# 补在末尾保持 list 是满的，否则读取的时候会以为 list 里已经是全部的数据了
+REMOVE_OBJECT_SCRIPT = """
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 0 then
+    return 0
+end
+if ARGV[3] then
+    if redis.call('LINDEX', KEYS[1], -1) ~= ARGV[2] then
+        return 0
+    end
+    redis.call('RPUSH', KEYS[1], ARGV[3])
+end
+return 1
+"""
+
+# 把 list 里的 ARGV[1] 替换成 ARGV[2]，ARGV[1] 已经不在 list 里的时候返回 0
+REPLACE_OBJECT_SCRIPT = """
+if redis.call('LINSERT', KEYS[1], 'BEFORE', ARGV[1], ARGV[2]) <= 0 then
+    return 0
+end
+redis.call('LREM', KEYS[1], 1, ARGV[1])
+return 1
+"""
+
+# sorted set 版本的 timeline，score 是 created_at 的微秒时间戳
+# ARGV[1] 是过期时间，ARGV[2:] 是 score, member, score, member ...
+LOAD_SORTED_OBJECTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('ZADD', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# sorted set 里同一个 member 只会存在一次，所以不需要像 list 一样判断是否重复 push
+# 超过长度上限的时候删掉最旧的 objects
+# ARGV[1] 是 score，ARGV[2] 是 member，ARGV[3] 是长度上限
+PUSH_SORTED_OBJECT_SCRIPT = """
+if KEYS[2] then
+    redis.call('DEL', KEYS[2])
+end
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[3]) - 1)
+return 1
+"""
+
+# 只有锁还是自己持有的时候才释放，避免锁过期之后把别人的锁删掉
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+FILL_LOCK_PATTERN = '{key}:fill_lock'
+
+# 同一个 object 的所有计数器存在同一个 hash 里，比如 Tweet.counts:1 -> likes_count, comments_count
+COUNTS_PATTERN = '{model_name}.counts:{object_id}'
+
+# write behind 模式下，还没有写回数据库的 object id 记录在这个 set 里
+COUNTS_DIRTY_PATTERN = '{model_name}.counts:dirty'
+COUNTS_FLUSH_LOCK_PATTERN = '{model_name}.counts:flush_lock'
+# hash 里的版本号，每次加减都会 +1，flush 的时候用来判断写回数据库之后计数器有没有再被修改过
+COUNTS_VERSION_FIELD = '_v'
+
+# 只有计数器已经在 cache 里的时候才加减，否则返回 nil，由调用方从数据库 back fill
+# ARGV[1] 是计数器的名字，ARGV[2] 是增量，ARGV[3] 是 object id
+# KEYS[2] 是可选的 dirty set，write behind 模式下把 object 标记为还没有写回数据库
+# 标记之后 hash 不能过期，否则还没有写回数据库的计数就丢了
+INCR_COUNT_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return nil
+end
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HINCRBY', KEYS[1], '_v', 1)
+if KEYS[2] then
+    redis.call('PERSIST', KEYS[1])
+    redis.call('SADD', KEYS[2], ARGV[3])
+end
+return count
+"""
+
+# 写回数据库之后，如果计数器没有再被修改过，就从 dirty set 里删掉并恢复过期时间
+# 否则留在 dirty set 里等下一次 flush
+# ARGV[1] 是写回数据库时读到的版本号，ARGV[2] 是 object id，ARGV[3] 是过期时间
+FLUSH_COUNTS_SCRIPT = """
+if redis.call('HGET', KEYS[1], '_v') ~= ARGV[1] then
+    return 0
+end
+redis.call('SREM', KEYS[2], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# 从数据库 back fill 计数器，已经存在的计数器不覆盖（可能刚刚被别的请求加减过）
+# 只有新建的 hash 才设置过期时间，返回写入之后这些 field 在 cache 里的值
+# ARGV[1] 是过期时间，ARGV[2:] 是 field, value, field, value ...
+LOAD_COUNTS_SCRIPT = """
+local created = redis.call('EXISTS', KEYS[1]) == 0
+local fields = {}
+for i = 2, #ARGV, 2 do
+    redis.call('HSETNX', KEYS[1], ARGV[i], ARGV[i + 1])
+    table.insert(fields, ARGV[i])
+end
+if created then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return redis.call('HMGET', KEYS[1], unpack(fields))
+"""
+
+# set 里总是放一个 sentinel，这样没有任何 member 的 set 也能存在于 redis 里
+# 用来区分 "cache 里没有" 和 "cache 里有，但是是空的"
+SET_SENTINEL = 0
+
+# set 每次被修改都把 generation 加一，不管 set 在不在 cache 里
+# back fill 在读数据库之前先记下 generation，写入的时候 generation 变了说明读数据库的时候
+# 可能还没有看到这次修改，这次 back fill 就放弃，等下一次读取的时候重新 back fill
+SET_GENERATION_PATTERN = '{key}:gen'
+# 正在 back fill 的 set 用这个 key 标记，避免同一个 set 的 back fill 任务被重复提交
+SET_LOADING_PATTERN = '{key}:loading'
+
+# 只有 set 已经在 cache 里的时候才修改，否则等之后读取的时候从数据库 back fill
+# KEYS[2] 是 generation，ARGV[1] 是 member，ARGV[2] 是 generation 的过期时间
+ADD_TO_SET_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+return redis.call('SADD', KEYS[1], ARGV[1])
+"""
+REMOVE_FROM_SET_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+return redis.call('SREM', KEYS[1], ARGV[1])
+"""
+
+# 从数据库 back fill 整个 set，已经存在的 set 不覆盖（可能刚刚被别的请求 load 并修改过）
+# 读数据库之后 set 又被修改过（generation 变了）也不写入
+# lua 的 unpack 一次最多展开大约 8000 个值，所以每 5000 个 members 调用一次 SADD
+# KEYS[2] 是 generation，ARGV[1] 是过期时间，ARGV[2] 是读数据库之前的 generation
+# ARGV[3] 是 sentinel，ARGV[4:] 是 members
+LOAD_SET_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[2] then
+    return 0
+end
+for i = 3, #ARGV, 5000 do
+    redis.call('SADD', KEYS[1], unpack(ARGV, i, math.min(i + 4999, #ARGV)))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# load_objects_window 内部用来区分 cache miss 和 "需要的数据超出了 cache 的范围"
+CACHE_MISS = object()
 
 
 class RedisHelper:
+    # list 里每个 object 的编码方式，CompactModelSerializer 也能读取旧的 JSON 格式
+    # 所以切换之后已经在 cache 里的数据不需要清空
+    serializer = CompactModelSerializer
+    # 注册过的 lua script，避免每次调用都重新计算 sha
+    _scripts = {}
+    # 带 cursor 读取 list 的时候每次 lrange 的数量
+    WINDOW_SCAN_SIZE = 100
+    # cache miss 的时候只让一个 worker 去数据库 load，锁的过期时间（毫秒）
+    FILL_LOCK_TIMEOUT = 3000
+    # 没抢到锁的 worker 每隔多久（秒）看一下 cache 是否已经写好，最多看几次
+    FILL_WAIT_INTERVAL = 0.05
+    FILL_WAIT_RETRIES = 4
+    # 写回计数器的锁的过期时间（毫秒），要比一次 flush 的时间长
+    FLUSH_LOCK_TIMEOUT = 60 * 1000
+    # set 的 back fill 标记的过期时间（毫秒），要比 back fill 一个 set 的时间长
+    SET_LOADING_TIMEOUT = 60 * 1000
+    # 最近几次从数据库 load 数据到 cache 花的时间的滑动平均（秒），作为 XFetch 的 delta
+    _fill_delta = 0.0
+
+    @classmethod
+    def _run_script(cls, conn, script, keys, args):
+        if script not in cls._scripts:
+            cls._scripts[script] = conn.register_script(script)
+        # 使用 evalsha 执行，如果 redis 里没有这个 script 会自动 load 一次
+        return cls._scripts[script](keys=keys, args=args, client=conn)
+
+    @classmethod
+    def _deserialize_list(cls, serialized_list):
+        objects = []
+        for serialized_data in serialized_list:
+            deserialized_obj = cls.serializer.deserialize(serialized_data)
+            if deserialized_obj is None:
+                return None
+            objects.append(deserialized_obj)
+        return objects
 
     @classmethod
     def _load_objects_to_cache(cls, key, objects):
@@ -14,92 +254,906 @@ class RedisHelper:
         # 超过这个限制的 objects，就去数据库里读取。一般这个限制会比较大，比如 1000
         # 因此翻页翻到 1000 的用户访问量会比较少，从数据库读取也不是大问题
         for obj in objects:
-            serialized_data = DjangoModelSerializer.serialize(obj)
+            serialized_data = cls.serializer.serialize(obj)
             serialized_list.append(serialized_data)
 
-        if serialized_list:
-            conn.rpush(key, *serialized_list)
-            conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        if not serialized_list:
+            return False
+        # 返回是否真正写入了 cache，如果 key 已经被别的请求写入了就返回 False
+        return bool(cls._run_script(
+            conn,
+            LOAD_OBJECTS_SCRIPT,
+            keys=[key],
+            args=[settings.REDIS_KEY_EXPIRE_TIME, *serialized_list],
+        ))
 
     @classmethod
-    def load_objects(cls, key, queryset):
+    def _fill_with_single_flight(cls, key, queryset, load_to_cache):
+        """
+        cache miss 的时候只让抢到锁的一个 worker 去数据库 load 并写入 cache
+        其他的 worker 短暂地等一下，cache 写好了就返回 None，调用方直接从 cache 里读
+        等不到的话直接从数据库读，但是不再写 cache
+        """
         conn = RedisClient.get_connection()
         # 最多只 cache REDIS_LIST_LENGTH_LIMIT 那么多个 objects
         # 超过这个限制的 objects，就去数据库里读取。一般这个限制会比较大，比如 1000
         # 因此翻页翻到 1000 的用户访问量会比较少，从数据库读取也不是大问题
         queryset = queryset[:settings.REDIS_LIST_LENGTH_LIMIT]
+        lock_key = FILL_LOCK_PATTERN.format(key=key)
+        token = uuid.uuid4().hex
+        if conn.set(lock_key, token, nx=True, px=cls.FILL_LOCK_TIMEOUT):
+            try:
+                with xfetch.Timer() as timer:
+                    # 转换为 list 的原因是保持返回类型的统一，因为存在 redis 里的数据是 list 的形式
+                    objects = list(queryset)
+                    load_to_cache(key, objects)
+                cls._record_fill_delta(timer.delta)
+                Metrics.cache_fill('redis', key)
+                return objects
+            finally:
+                cls._run_script(conn, RELEASE_LOCK_SCRIPT, keys=[lock_key], args=[token])
+
+        # 已经有别的 worker 在 load 同一个 key 了，这个请求被合并掉
+        Metrics.incr('redis_fill_coalesced')
+        for _ in range(cls.FILL_WAIT_RETRIES):
+            time.sleep(cls.FILL_WAIT_INTERVAL)
+            pipe = conn.pipeline(transaction=False)
+            pipe.exists(key)
+            pipe.exists(lock_key)
+            key_exists, lock_exists = pipe.execute()
+            if key_exists:
+                return None
+            # 锁已经释放了但是 key 还不存在，说明数据库里没有数据，不用再等了
+            if not lock_exists:
+                break
+        return list(queryset)
+
+    @classmethod
+    def _record_fill_delta(cls, delta):
+        if not cls._fill_delta:
+            cls._fill_delta = delta
+        else:
+            cls._fill_delta = cls._fill_delta * 0.8 + delta * 0.2
+
+    @classmethod
+    def _renew_if_expiring(cls, key, pttl):
+        """
+        XFetch 提前刷新。timeline 和计数器一直被 push 和 incr 更新，不会因为时间久了而过时
+        所以提前 "刷新" 只需要延长过期时间，重新从数据库 load 反而会和同时发生的 push 冲突
+        pttl 是 key 剩余的毫秒数，-1 表示没有过期时间（比如 write behind 的计数器），-2 表示不存在
+        """
+        if pttl is None or pttl < 0:
+            return
+        if xfetch.should_refresh_early(time.time() + pttl / 1000, cls._fill_delta):
+            RedisClient.get_connection().expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+            Metrics.incr('xfetch_early_refresh')
+
+    @classmethod
+    def load_objects(cls, key, queryset):
+        conn = RedisClient.get_connection()
+        # 空的 list 在 redis 里是不存在的，所以不需要先 exists 再 lrange
+        # 直接 lrange，拿到数据就说明 cache hit，只需要一次 round trip
+        # 读操作走 replica，写 cache 和写好之后再读都走 master，避免 replica 的延迟
+        pipe = RedisClient.get_connection(read_only=True).pipeline(transaction=False)
+        pipe.lrange(key, 0, -1)
+        pipe.pttl(key)
+        with Metrics.timer('cache_latency_ms', tier='redis', pattern=Metrics.get_pattern(key)):
+            serialized_list, pttl = pipe.execute()
+        cls._renew_if_expiring(key, pttl)
+        if serialized_list:
+            objects = cls._deserialize_list(serialized_list)
+            if objects is not None:
+                Metrics.cache_hit('redis', key, sum(map(len, serialized_list)))
+                return objects
+            # model 的字段变了，旧数据读不出来了，删掉之后重新从数据库 load
+            conn.delete(key)
+        Metrics.cache_miss('redis', key)
 
-        # 如果在 cache 里存在，则直接拿出来，然后返回
-        if conn.exists(key):
-            serialized_list = conn.lrange(key, 0, -1)
-            objects = []
-            for serialized_data in serialized_list:
-                deserialized_obj = DjangoModelSerializer.deserialize(serialized_data)
-                objects.append(deserialized_obj)
+        objects = cls._fill_with_single_flight(
+            key,
+            queryset,
+            cls._load_objects_to_cache,
+        )
+        if objects is not None:
+            return objects
+        # 别的 worker 已经把 cache 写好了
+        objects = cls._deserialize_list(conn.lrange(key, 0, -1))
+        if objects:
             return objects
+        return list(queryset[:settings.REDIS_LIST_LENGTH_LIMIT])
 
-        cls._load_objects_to_cache(key, queryset)
+    @classmethod
+    def load_objects_window(
+        cls,
+        key,
+        queryset,
+        limit=None,
+        created_at__lt=None,
+        created_at__gt=None,
+    ):
+        """
+        list 里的 objects 是按照 created_at 倒序存放的，这个方法只读取并反序列化需要的那一段
+        - created_at__gt: 返回所有比 created_at__gt 新的 objects
+        - created_at__lt: 返回比 created_at__lt 旧的最多 limit 个 objects
+        - 都没有的时候返回最新的 limit 个 objects
+        返回 None 表示需要的数据超出了 cache 的范围，需要去数据库里查询
+        """
+        objects = cls._load_window_from_cache(
+            key,
+            limit,
+            created_at__lt,
+            created_at__gt,
+            read_only=True,
+        )
+        if objects is not CACHE_MISS:
+            # 超出 cache 范围的也算 miss
+            if objects is None:
+                Metrics.cache_miss('redis', key)
+            else:
+                Metrics.cache_hit('redis', key)
+            return objects
 
-        # 转换为 list 的原因是保持返回类型的统一，因为存在 redis 里的数据是 list 的形式
-        return list(queryset)
+        # cache miss 或者 model 的字段变了，从数据库把整个 list load 到 cache 里之后再读一次
+        # 这次 miss 由 load_objects 记录
+        if not cls.load_objects(key, queryset):
+            return []
+        objects = cls._load_window_from_cache(
+            key,
+            limit,
+            created_at__lt,
+            created_at__gt,
+        )
+        # 刚写进去又读不到了（比如被清空了），直接去数据库里查询
+        if objects is CACHE_MISS:
+            return None
+        return objects
+
+    @classmethod
+    def _load_window_from_cache(
+        cls,
+        key,
+        limit,
+        created_at__lt,
+        created_at__gt,
+        read_only=False,
+    ):
+        conn = RedisClient.get_connection(read_only=read_only)
+        # 读第一页的时候只需要 lrange 前 limit 个
+        # 有 cursor 的时候每次多读一些，减少找到 cursor 位置需要的 round trip
+        if limit is not None and created_at__lt is None and created_at__gt is None:
+            scan_size = limit
+        else:
+            scan_size = max(limit or 0, cls.WINDOW_SCAN_SIZE)
+
+        selected = []
+        # 分段读取的过程中如果有新的 object 被 push 到 list 头部，后面的数据会往后移
+        # 同一个 object 可能被读到两次，按照序列化之后的数据去重
+        # 不能用上一个 object 的 created_at 作为上界，created_at 相同的 object 会被跳过
+        seen = set()
+        start = 0
+        while True:
+            if start == 0:
+                # 第一次读的时候顺便读一下剩余的过期时间
+                pipe = conn.pipeline(transaction=False)
+                pipe.lrange(key, start, start + scan_size - 1)
+                pipe.pttl(key)
+                with Metrics.timer(
+                    'cache_latency_ms',
+                    tier='redis',
+                    pattern=Metrics.get_pattern(key),
+                ):
+                    chunk, pttl = pipe.execute()
+                cls._renew_if_expiring(key, pttl)
+            else:
+                chunk = conn.lrange(key, start, start + scan_size - 1)
+            if not chunk and start == 0:
+                return CACHE_MISS
+            for serialized_data in chunk:
+                created_at = cls.serializer.deserialize_field(
+                    serialized_data,
+                    'created_at',
+                )
+                if created_at is None:
+                    RedisClient.get_connection().delete(key)
+                    return CACHE_MISS
+                if created_at__gt is not None and created_at <= created_at__gt:
+                    return cls._deserialize_window(key, selected)
+                if created_at__lt is not None and created_at >= created_at__lt:
+                    continue
+                if serialized_data in seen:
+                    continue
+                seen.add(serialized_data)
+                selected.append(serialized_data)
+                if limit is not None and len(selected) >= limit:
+                    return cls._deserialize_window(key, selected)
+
+            if len(chunk) < scan_size:
+                break
+            start += scan_size
+
+        # 读到了 list 的末尾，如果 list 已经达到了长度上限，说明数据库里可能还有更旧的数据
+        if start + len(chunk) >= settings.REDIS_LIST_LENGTH_LIMIT:
+            return None
+        return cls._deserialize_window(key, selected)
+
+    @classmethod
+    def _deserialize_window(cls, key, serialized_list):
+        objects = cls._deserialize_list(serialized_list)
+        if objects is None:
+            RedisClient.get_connection().delete(key)
+            return CACHE_MISS
+        return objects
+
+    @classmethod
+    def push_object(cls, key, obj, queryset, stale_key=None):
+        conn = RedisClient.get_connection()
+        serialized_data = cls.serializer.serialize(obj)
+        keys = [key] if stale_key is None else [key, stale_key]
+        args = [serialized_data, settings.REDIS_LIST_LENGTH_LIMIT]
+        if cls._run_script(conn, PUSH_OBJECT_SCRIPT, keys=keys, args=args):
+            return
+
+        # 如果 key 不存在，直接从数据库里 load
+        # 就不走单个 push 的方式加到 cache 里了
+        queryset = queryset[:settings.REDIS_LIST_LENGTH_LIMIT]
+        if cls._load_objects_to_cache(key, queryset):
+            return
+        # 有别的请求抢先把 cache 填上了，它从数据库读到的数据不一定包含 obj
+        # 所以再 push 一次，如果已经在 list 头部了 script 会跳过
+        cls._run_script(conn, PUSH_OBJECT_SCRIPT, keys=[key], args=args)
+
+    @classmethod
+    def push_objects(cls, items):
+        """
+        items 是 [(key, obj, stale_key), ...]，一次 pipeline 把每个 obj push 到对应的 list 里
+        和 push_object 不同，key 不存在的时候直接跳过，不从数据库 load，下次读的时候再 load
+        返回 push 成功的 key 的数量
+        """
+        return cls._push_in_pipeline(PUSH_OBJECT_SCRIPT, [
+            (key, stale_key, [
+                cls.serializer.serialize(obj),
+                settings.REDIS_LIST_LENGTH_LIMIT,
+            ])
+            for key, obj, stale_key in items
+        ])
+
+    @classmethod
+    def _find_serialized_object(cls, serialized_list, obj):
+        # 按照 id 找到 obj 在 list 里序列化之后的数据，list 里存的是修改之前的版本
+        for serialized_data in serialized_list:
+            if cls.serializer.deserialize_field(serialized_data, 'id') == obj.id:
+                return serialized_data
+        return None
+
+    @classmethod
+    def remove_object(cls, key, obj, queryset):
+        """
+        obj 从数据库删掉之后调用，从 list 里删掉 obj，不需要删掉整个 list 再从数据库重新 load
+        obj 不在 list 里（list 不在 cache 里，或者 obj 比 list 里的都旧）的时候什么都不做
+        """
+        conn = RedisClient.get_connection()
+        serialized_list = conn.lrange(key, 0, -1)
+        serialized_data = cls._find_serialized_object(serialized_list, obj)
+        if serialized_data is None:
+            return
+        args = [serialized_data]
+        limit = settings.REDIS_LIST_LENGTH_LIMIT
+        if len(serialized_list) >= limit:
+            # obj 已经从数据库删掉了，数据库里的第 limit 个就是 list 末尾的下一个
+            next_objects = list(queryset[limit - 1:limit])
+            if next_objects:
+                remaining = [data for data in serialized_list if data != serialized_data]
+                args += [remaining[-1], cls.serializer.serialize(next_objects[0])]
+        if not cls._run_script(conn, REMOVE_OBJECT_SCRIPT, keys=[key], args=args):
+            # 同时有别的请求修改了这个 list，删掉整个 list，下次读取的时候重新 load
+            conn.delete(key)
+
+    @classmethod
+    def replace_object(cls, key, obj):
+        """
+        obj 被修改之后，把 list 里的旧版本替换成新的，位置不变
+        """
+        conn = RedisClient.get_connection()
+        serialized_data = cls._find_serialized_object(conn.lrange(key, 0, -1), obj)
+        if serialized_data is None:
+            return
+        if not cls._run_script(
+            conn,
+            REPLACE_OBJECT_SCRIPT,
+            keys=[key],
+            args=[serialized_data, cls.serializer.serialize(obj)],
+        ):
+            conn.delete(key)
+
+    @classmethod
+    def _push_in_pipeline(cls, script, pushes):
+        if not pushes:
+            return 0
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline(transaction=False)
+        for key, stale_key, args in pushes:
+            keys = [key] if stale_key is None else [key, stale_key]
+            cls._run_script(pipe, script, keys=keys, args=args)
+        return sum(pipe.execute())
+
+    @classmethod
+    def _serialize_sorted_member(cls, obj):
+        # member 前面加上 8 个字节的 id，created_at 相同（score 相同）的时候
+        # sorted set 按照 member 的字典序排序，也就相当于按照 id 排序
+        return (obj.id or 0).to_bytes(8, 'big') + cls.serializer.serialize(obj)
 
     @classmethod
-    def push_object(cls, key, obj, queryset):
+    def _deserialize_sorted_members(cls, members):
+        return cls._deserialize_list([member[8:] for member in members])
+
+    @classmethod
+    def _load_sorted_objects_to_cache(cls, key, objects):
+        conn = RedisClient.get_connection()
+        args = [settings.REDIS_KEY_EXPIRE_TIME]
+        for obj in objects:
+            args.append(to_microseconds(obj.created_at))
+            args.append(cls._serialize_sorted_member(obj))
+        if len(args) == 1:
+            return False
+        return bool(cls._run_script(
+            conn,
+            LOAD_SORTED_OBJECTS_SCRIPT,
+            keys=[key],
+            args=args,
+        ))
+
+    @classmethod
+    def load_sorted_objects(cls, key, queryset):
+        """
+        load_objects 的 sorted set 版本，返回 cache 里所有的 objects，按照 created_at 倒序
+        """
+        conn = RedisClient.get_connection()
+        pipe = RedisClient.get_connection(read_only=True).pipeline(transaction=False)
+        pipe.zrevrange(key, 0, -1)
+        pipe.pttl(key)
+        with Metrics.timer('cache_latency_ms', tier='redis', pattern=Metrics.get_pattern(key)):
+            members, pttl = pipe.execute()
+        cls._renew_if_expiring(key, pttl)
+        if members:
+            objects = cls._deserialize_sorted_members(members)
+            if objects is not None:
+                Metrics.cache_hit('redis', key, sum(map(len, members)))
+                return objects
+            # model 的字段变了，旧数据读不出来了，删掉之后重新从数据库 load
+            conn.delete(key)
+        Metrics.cache_miss('redis', key)
+
+        objects = cls._fill_with_single_flight(
+            key,
+            queryset,
+            cls._load_sorted_objects_to_cache,
+        )
+        if objects is not None:
+            return objects
+        # 别的 worker 已经把 cache 写好了
+        objects = cls._deserialize_sorted_members(conn.zrevrange(key, 0, -1))
+        if objects:
+            return objects
+        return list(queryset[:settings.REDIS_LIST_LENGTH_LIMIT])
+
+    @classmethod
+    def load_sorted_objects_window(
+        cls,
+        key,
+        queryset,
+        limit=None,
+        created_at__lt=None,
+        created_at__gt=None,
+    ):
+        """
+        和 load_objects_window 一样的接口，数据存在 sorted set 里，按照 score 直接定位到
+        cursor 的位置，不需要从头扫描，每一页都只需要一次 round trip
+        返回 None 表示需要的数据超出了 cache 的范围，需要去数据库里查询
+        """
+        objects = cls._load_sorted_window_from_cache(
+            key,
+            limit,
+            created_at__lt,
+            created_at__gt,
+            read_only=True,
+        )
+        if objects is not CACHE_MISS:
+            # 超出 cache 范围的也算 miss
+            if objects is None:
+                Metrics.cache_miss('redis', key)
+            else:
+                Metrics.cache_hit('redis', key)
+            return objects
+
+        Metrics.cache_miss('redis', key)
+        objects = cls._fill_with_single_flight(
+            key,
+            queryset,
+            cls._load_sorted_objects_to_cache,
+        )
+        # 返回 None 说明别的 worker 已经把 cache 写好了
+        if objects is not None and not objects:
+            return []
+        objects = cls._load_sorted_window_from_cache(
+            key,
+            limit,
+            created_at__lt,
+            created_at__gt,
+        )
+        if objects is CACHE_MISS:
+            return None
+        return objects
+
+    @classmethod
+    def _load_sorted_window_from_cache(
+        cls,
+        key,
+        limit,
+        created_at__lt,
+        created_at__gt,
+        read_only=False,
+    ):
+        conn = RedisClient.get_connection(read_only=read_only)
+        # 开区间用 ( 表示
+        max_score = '+inf'
+        if created_at__lt is not None:
+            max_score = '({}'.format(to_microseconds(created_at__lt))
+        min_score = '-inf'
+        if created_at__gt is not None:
+            min_score = '({}'.format(to_microseconds(created_at__gt))
+
+        pipe = conn.pipeline(transaction=False)
+        if limit is None:
+            pipe.zrevrangebyscore(key, max_score, min_score)
+        else:
+            pipe.zrevrangebyscore(key, max_score, min_score, start=0, num=limit)
+        pipe.zcard(key)
+        # 最旧的一个 object 的 score，用来判断需要的数据是否超出了 cache 的范围
+        pipe.zrange(key, 0, 0, withscores=True)
+        pipe.pttl(key)
+        with Metrics.timer('cache_latency_ms', tier='redis', pattern=Metrics.get_pattern(key)):
+            members, size, oldest, pttl = pipe.execute()
+        cls._renew_if_expiring(key, pttl)
+
+        if not size:
+            return CACHE_MISS
+        objects = cls._deserialize_sorted_members(members)
+        if objects is None:
+            # model 的字段变了，旧数据读不出来了
+            RedisClient.get_connection().delete(key)
+            return CACHE_MISS
+
+        if size < settings.REDIS_LIST_LENGTH_LIMIT:
+            # 还没有达到长度上限，cache 里就是所有的数据
+            return objects
+        if limit is not None and len(objects) >= limit:
+            return objects
+        if created_at__gt is not None:
+            # 数据库里可能还有在 created_at__gt 和 cache 里最旧的 object 之间的数据
+            if oldest[0][1] > to_microseconds(created_at__gt):
+                return None
+            return objects
+        # 往下翻页的时候不够 limit 个，数据库里可能还有更旧的数据
+        return None
+
+    @classmethod
+    def push_sorted_object(cls, key, obj, queryset, stale_key=None):
         conn = RedisClient.get_connection()
+        keys = [key] if stale_key is None else [key, stale_key]
+        args = [
+            to_microseconds(obj.created_at),
+            cls._serialize_sorted_member(obj),
+            settings.REDIS_LIST_LENGTH_LIMIT,
+        ]
+        if cls._run_script(conn, PUSH_SORTED_OBJECT_SCRIPT, keys=keys, args=args):
+            return
+
+        # key 不存在的时候从数据库里 load
         queryset = queryset[:settings.REDIS_LIST_LENGTH_LIMIT]
-        if not conn.exists(key):
-            # 如果 key 不存在，直接从数据库里 load
-            # 就不走单个 push 的方式加到 cache 里了
-            cls._load_objects_to_cache(key, queryset)
+        if cls._load_sorted_objects_to_cache(key, queryset):
             return
-        serialized_data = DjangoModelSerializer.serialize(obj)
-        conn.lpush(key, serialized_data)
-        conn.ltrim(name=key, start=0, end=settings.REDIS_LIST_LENGTH_LIMIT - 1)
+        # 被别的请求抢先 load 了，再 push 一次，同一个 member 不会重复
+        cls._run_script(conn, PUSH_SORTED_OBJECT_SCRIPT, keys=keys, args=args)
+
+    @classmethod
+    def push_sorted_objects(cls, items):
+        """
+        sorted set 版本的 push_objects，key 不存在的时候跳过
+        """
+        return cls._push_in_pipeline(PUSH_SORTED_OBJECT_SCRIPT, [
+            (key, stale_key, [
+                to_microseconds(obj.created_at),
+                cls._serialize_sorted_member(obj),
+                settings.REDIS_LIST_LENGTH_LIMIT,
+            ])
+            for key, obj, stale_key in items
+        ])
+
+    @classmethod
+    def get_counts_key(cls, model_class, object_id):
+        return COUNTS_PATTERN.format(
+            model_name=model_class.__name__,
+            object_id=object_id,
+        )
+
+    @classmethod
+    def _load_counts_to_cache(cls, conn, model_class, attrs_by_id):
+        """
+        attrs_by_id 是 {object_id: [cache 里缺少的 attrs]}
+        一次数据库查询读出缺少的计数器，只写回 cache 里没有的 field，返回 {object_id: {attr: count}}
+        cache 里已经有的 field 可能包含还没有写回数据库的计数，不能用数据库里的旧值覆盖
+        所以返回的是写入之后 cache 里的值
+        数据库里不存在的 object 不写 cache，还没有回填的计数器（null）当成 0
+        """
+        all_attrs = list(dict.fromkeys(
+            attr for attrs in attrs_by_id.values() for attr in attrs
+        ))
+        rows = model_class.objects.filter(id__in=list(attrs_by_id)).values('id', *all_attrs)
+        object_ids = []
+        pipe = conn.pipeline(transaction=False)
+        for row in rows:
+            args = [settings.REDIS_KEY_EXPIRE_TIME]
+            for attr in attrs_by_id[row['id']]:
+                args.extend([attr, row[attr] or 0])
+            cls._run_script(
+                pipe,
+                LOAD_COUNTS_SCRIPT,
+                keys=[cls.get_counts_key(model_class, row['id'])],
+                args=args,
+            )
+            object_ids.append(row['id'])
+        return {
+            object_id: {
+                attr: int(value)
+                for attr, value in zip(attrs_by_id[object_id], values)
+            }
+            for object_id, values in zip(object_ids, pipe.execute())
+        }
+
+    @classmethod
+    def get_counts(cls, model_class, object_ids, attrs):
+        """
+        一次 pipeline 读出一页 objects 的计数器，返回 {object_id: {attr: count}}
+        cache 里没有的用一次 id__in 的数据库查询 back fill
+        """
+        conn = RedisClient.get_connection()
+        counts, pending_ids = {}, []
+        for object_id in dict.fromkeys(object_ids):
+            # 同一个 request 里已经读过了
+            cached = RequestCache.get(cls.get_counts_key(model_class, object_id))
+            if cached is not None and all(attr in cached for attr in attrs):
+                counts[object_id] = {attr: cached[attr] for attr in attrs}
+            else:
+                pending_ids.append(object_id)
+
+        # object_id -> cache 里缺少的 attrs
+        missing_attrs = {}
+        if pending_ids:
+            pipe = RedisClient.get_connection(read_only=True).pipeline(transaction=False)
+            for object_id in pending_ids:
+                key = cls.get_counts_key(model_class, object_id)
+                pipe.hmget(key, attrs)
+                pipe.pttl(key)
+            with Metrics.timer(
+                'cache_latency_ms',
+                tier='redis',
+                pattern=Metrics.get_pattern(key),
+            ):
+                results = pipe.execute()
+            for object_id, values, pttl in zip(pending_ids, results[::2], results[1::2]):
+                key = cls.get_counts_key(model_class, object_id)
+                cls._renew_if_expiring(key, pttl)
+                # 只有部分 field 在 cache 里的时候，已经有的 field 直接用，只 back fill 缺少的
+                counts[object_id] = {
+                    attr: int(value)
+                    for attr, value in zip(attrs, values)
+                    if value is not None
+                }
+                if None in values:
+                    Metrics.cache_miss('redis', key)
+                    missing_attrs[object_id] = [
+                        attr
+                        for attr, value in zip(attrs, values)
+                        if value is None
+                    ]
+                    continue
+                Metrics.cache_hit('redis', key)
+
+        if missing_attrs:
+            loaded = cls._load_counts_to_cache(conn, model_class, missing_attrs)
+            for object_id in missing_attrs:
+                # 数据库里也不存在的 object（比如已经被删掉了），计数都是 0
+                object_counts = {**counts[object_id], **loaded.get(object_id, {})}
+                counts[object_id] = {attr: object_counts.get(attr, 0) for attr in attrs}
+
+        for object_id in pending_ids:
+            key = cls.get_counts_key(model_class, object_id)
+            RequestCache.set(key, {
+                **RequestCache.peek(key, {}),
+                **counts[object_id],
+            })
+        return counts
 
     @classmethod
-    def get_count_key(cls, obj, attr):
-        return '{}.{}:{}'.format(obj.__class__.__name__, attr, obj.id)
+    def get_counts_dirty_key(cls, model_class):
+        return COUNTS_DIRTY_PATTERN.format(model_name=model_class.__name__)
 
     @classmethod
-    def incr_count(cls, obj, attr):
+    def _change_count(cls, obj, attr, amount, write_behind):
         conn = RedisClient.get_connection()
-        key = cls.get_count_key(obj, attr)
-        if conn.exists(key):
-            return conn.incr(key)
+        model_class = obj.__class__
+        keys = [cls.get_counts_key(model_class, obj.id)]
+        RequestCache.delete(keys[0])
+        if write_behind:
+            keys.append(cls.get_counts_dirty_key(model_class))
+        count = cls._run_script(
+            conn,
+            INCR_COUNT_SCRIPT,
+            keys=keys,
+            args=[attr, amount, obj.id],
+        )
+        if count is not None:
+            return count
 
         # back fill from db
-        # 重新从数据库把 obj 给 load一下
-        # 不执行 +1 操作，因为必须保证调用 incr_count 之前 obj.attr 已经 +1 过了
-        obj.refresh_from_db()
-        conn.set(key, getattr(obj, attr))
-        conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
-        return getattr(obj, attr)
+        counts = cls._load_counts_to_cache(conn, model_class, {obj.id: [attr]})
+        if not write_behind:
+            # 不执行加减操作，因为必须保证调用之前数据库里的 obj.attr 已经加减过了
+            return counts.get(obj.id, {}).get(attr, 0)
 
+        # write behind 模式下数据库还没有加减过，back fill 之后再加减一次
+        count = cls._run_script(
+            conn,
+            INCR_COUNT_SCRIPT,
+            keys=keys,
+            args=[attr, amount, obj.id],
+        )
+        return count if count is not None else 0
+
+    @classmethod
+    def incr_count(cls, obj, attr, write_behind=False):
+        """
+        write_behind=False: 调用之前数据库里的 obj.attr 已经 +1 过了，redis 里跟着 +1
+        write_behind=True: 只在 redis 里 +1，由 flush_counts 定期批量写回数据库
+        """
+        return cls._change_count(obj, attr, 1, write_behind)
+
+    @classmethod
+    def decr_count(cls, obj, attr, write_behind=False):
+        return cls._change_count(obj, attr, -1, write_behind)
+
+    @classmethod
+    def flush_counts_in_batches(cls, model_class, batch_size, max_batches):
+        """
+        由定时任务调用，返回写回的 object 的个数
+        热门 object 的计数器一直在变化，可能一直留在 dirty set 里，所以限制每次执行的 batch 数
+        剩下的留给下一次定时任务
+        """
+        total = 0
+        for _ in range(max_batches):
+            flushed = cls.flush_counts(model_class, batch_size)
+            total += flushed
+            # 不满一个 batch 说明已经写完了（或者另一个 flush 正在进行）
+            if flushed < batch_size:
+                break
+        return total
 
     @classmethod
-    def decr_count(cls, obj, attr):
+    def flush_counts(cls, model_class, batch_size):
+        """
+        把 write behind 模式下 redis 里的计数器批量写回数据库，返回写回的 object 的个数
+        写回的是计数器的绝对值而不是增量，所以中途挂掉之后重新 flush 不会重复计数
+        """
         conn = RedisClient.get_connection()
-        key = cls.get_count_key(obj, attr)
-        if conn.exists(key):
-            return conn.decr(key)
+        lock_key = COUNTS_FLUSH_LOCK_PATTERN.format(model_name=model_class.__name__)
+        token = uuid.uuid4().hex
+        # 同时只能有一个 flush，否则旧的值可能会覆盖掉另一个 flush 刚写回的新的值
+        if not conn.set(lock_key, token, nx=True, px=cls.FLUSH_LOCK_TIMEOUT):
+            return 0
+        try:
+            return cls._flush_counts(conn, model_class, batch_size)
+        finally:
+            cls._run_script(conn, RELEASE_LOCK_SCRIPT, keys=[lock_key], args=[token])
 
-        # 重新从数据库把 obj 给 load一下
-        # 不执行 -1 操作，因为必须保证调用 incr_count 之前 obj.attr 已经 -1 过了
-        obj.refresh_from_db()
-        conn.set(key, getattr(obj, attr))
-        conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
-        return getattr(obj, attr)
+    @classmethod
+    def _flush_counts(cls, conn, model_class, batch_size):
+        dirty_key = cls.get_counts_dirty_key(model_class)
+        object_ids = [
+            int(object_id)
+            for object_id in conn.srandmember(dirty_key, batch_size)
+        ]
+        if not object_ids:
+            return 0
+
+        pipe = conn.pipeline(transaction=False)
+        for object_id in object_ids:
+            pipe.hgetall(cls.get_counts_key(model_class, object_id))
+
+        # 按照需要更新的字段分组，每组用一次 bulk_update 写回数据库
+        groups, versions, missing_ids = {}, {}, []
+        for object_id, values in zip(object_ids, pipe.execute()):
+            if not values:
+                # hash 已经不在了，没有可以写回的数据
+                missing_ids.append(object_id)
+                continue
+            values = {
+                field.decode('utf-8'): value
+                for field, value in values.items()
+            }
+            versions[object_id] = values.pop(COUNTS_VERSION_FIELD, None)
+            counts = {attr: int(value) for attr, value in values.items()}
+            groups.setdefault(tuple(sorted(counts)), []).append(
+                model_class(id=object_id, **counts),
+            )
+
+        with transaction.atomic():
+            for attrs, objects in groups.items():
+                model_class.objects.bulk_update(objects, attrs)
+
+        pipe = conn.pipeline(transaction=False)
+        for object_id, version in versions.items():
+            cls._run_script(
+                pipe,
+                FLUSH_COUNTS_SCRIPT,
+                keys=[cls.get_counts_key(model_class, object_id), dirty_key],
+                args=[version or b'', object_id, settings.REDIS_KEY_EXPIRE_TIME],
+            )
+        if missing_ids:
+            pipe.srem(dirty_key, *missing_ids)
+        pipe.execute()
+        return len(versions)
 
     @classmethod
     def get_count(cls, obj, attr):
+        return cls.get_counts(obj.__class__, [obj.id], [attr])[obj.id][attr]
+
+    @classmethod
+    def delete_counts(cls, model_class, object_ids):
+        """
+        数据库里的计数器被直接修正（比如回填）之后，删掉 cache 里的计数器，下次读取的时候重新 load
+        同时从 dirty set 里删掉，避免 write behind 把旧的值写回数据库
+        """
+        if not object_ids:
+            return
+        pipe = RedisClient.get_connection().pipeline(transaction=False)
+        pipe.delete(*[
+            cls.get_counts_key(model_class, object_id)
+            for object_id in object_ids
+        ])
+        pipe.srem(cls.get_counts_dirty_key(model_class), *object_ids)
+        pipe.execute()
+
+    @classmethod
+    def acquire_set_loading(cls, keys):
+        """
+        标记 keys 里的 sets 正在 back fill，返回 True/False 的 list
+        False 表示已经有别的请求在 back fill 这个 set 了，不需要再提交任务
+        """
+        if not keys:
+            return []
+        pipe = RedisClient.get_connection().pipeline(transaction=False)
+        for key in keys:
+            pipe.set(
+                SET_LOADING_PATTERN.format(key=key),
+                1,
+                nx=True,
+                px=cls.SET_LOADING_TIMEOUT,
+            )
+        return [bool(acquired) for acquired in pipe.execute()]
+
+    @classmethod
+    def release_set_loading(cls, keys):
+        if not keys:
+            return
+        RedisClient.get_connection().delete(*[
+            SET_LOADING_PATTERN.format(key=key)
+            for key in keys
+        ])
+
+    @classmethod
+    def get_set_generations(cls, keys):
+        """
+        back fill 读数据库之前调用，返回 {key: generation}，作为 load_sets 的参数
+        """
+        if not keys:
+            return {}
+        generations = RedisClient.get_connection().mget([
+            SET_GENERATION_PATTERN.format(key=key)
+            for key in keys
+        ])
+        return {
+            key: generation.decode() if generation is not None else '0'
+            for key, generation in zip(keys, generations)
+        }
+
+    @classmethod
+    def load_sets(cls, members_by_key, generations):
+        """
+        一次 pipeline 把 {key: members} 写入 cache，每个 set 里都会带上 SET_SENTINEL
+        generations 是读数据库之前 get_set_generations 的结果
+        已经存在或者读数据库之后被修改过的 set 跳过，返回写入的 set 的个数
+        """
         conn = RedisClient.get_connection()
-        key = cls.get_count_key(obj, attr)
-        count = conn.get(key)
-        if count is not None:
-            return int(count)
+        pipe = conn.pipeline(transaction=False)
+        for key, members in members_by_key.items():
+            cls._run_script(
+                pipe,
+                LOAD_SET_SCRIPT,
+                keys=[key, SET_GENERATION_PATTERN.format(key=key)],
+                args=[
+                    settings.REDIS_KEY_EXPIRE_TIME,
+                    generations[key],
+                    SET_SENTINEL,
+                    *members,
+                ],
+            )
+        loaded = 0
+        for key, result in zip(members_by_key, pipe.execute()):
+            if result:
+                Metrics.cache_fill('redis', key)
+                loaded += 1
+        return loaded
 
-     # 重新从数据库把 obj 给 load一下
-        obj.refresh_from_db()
-        count = getattr(obj, attr)
-        conn.set(key, count)
-        return count
+    @classmethod
+    def add_to_set(cls, key, member):
+        conn = RedisClient.get_connection()
+        cls._run_script(
+            conn,
+            ADD_TO_SET_SCRIPT,
+            keys=[key, SET_GENERATION_PATTERN.format(key=key)],
+            args=[member, settings.REDIS_KEY_EXPIRE_TIME],
+        )
+
+    @classmethod
+    def remove_from_set(cls, key, member):
+        conn = RedisClient.get_connection()
+        cls._run_script(
+            conn,
+            REMOVE_FROM_SET_SCRIPT,
+            keys=[key, SET_GENERATION_PATTERN.format(key=key)],
+            args=[member, settings.REDIS_KEY_EXPIRE_TIME],
+        )
+
+    @classmethod
+    def get_set_memberships(cls, key_member_pairs):
+        """
+        一次 pipeline 查询 [(key, member), ...] 里每个 member 是否在对应的 set 里
+        返回 True/False 的 list，set 不在 cache 里的返回 None
+        """
+        if not key_member_pairs:
+            return []
+        pipe = RedisClient.get_connection(read_only=True).pipeline(transaction=False)
+        for key, member in key_member_pairs:
+            pipe.sismember(key, member)
+            pipe.sismember(key, SET_SENTINEL)
+        with Metrics.timer(
+            'cache_latency_ms',
+            tier='redis',
+            pattern=Metrics.get_pattern(key_member_pairs[0][0]),
+        ):
+            results = pipe.execute()
+        memberships = []
+        for (key, member), is_member, exists in zip(
+            key_member_pairs,
+            results[::2],
+            results[1::2],
+        ):
+            if not exists:
+                Metrics.cache_miss('redis', key)
+                memberships.append(None)
+                continue
+            Metrics.cache_hit('redis', key)
+            memberships.append(bool(is_member))
+        return memberships
+
+    @classmethod
+    def get_set_size(cls, key):
+        # 不包括 sentinel，set 不在 cache 里的返回 None
+        conn = RedisClient.get_connection(read_only=True)
+        pipe = conn.pipeline(transaction=False)
+        pipe.scard(key)
+        pipe.sismember(key, SET_SENTINEL)
+        size, exists = pipe.execute()
+        if not exists:
+            return None
+        return size - 1
@@ -1,5 +1,13 @@
+from datetime import datetime, timedelta
+from django.apps import apps
 from django.core import serializers
+from django.db import DEFAULT_DB_ALIAS, models
+from django.db.models import signals
+from django.db.models.base import ModelState
 from utils.json_encoder import JSONEncoder
+from utils.time_helpers import EPOCH, to_microseconds
+import msgpack
+import zlib
 
 
 class DjangoModelSerializer:
@@ -15,3 +23,174 @@ class DjangoModelSerializer:
         # 需要加 .object 来得到原始的 model 类型的 object 数据，要不然得到的数据并不是一个
         # ORM 的 object，而是一个 DeserializedObject 的类型
         return list(serializers.deserialize('json', serialized_data))[0].object
+
+
+class CompactModelSerializer:
+    """
+    紧凑的二进制格式：1 个字节的版本号 + msgpack 打包的 [schema_id, 字段值...]
+    字段值按照 model 的 concrete fields 的顺序排列，不存字段名
+    schema_id 由 model 的 label 和字段列表计算而来，model 的字段发生变化之后 schema_id
+    也会跟着变化，旧的数据读出来会返回 None，调用方当成 cache miss 处理即可
+    不是以版本号开头的数据认为是旧的 JSON 格式，交给 DjangoModelSerializer 去读
+    """
+    VERSION = 1
+    VERSION_BYTE = bytes([VERSION])
+
+    # model_class -> layout, schema_id -> layout
+    _layouts = {}
+    _layouts_by_schema_id = {}
+
+    @classmethod
+    def _build_layout(cls, model_class):
+        fields = model_class._meta.concrete_fields
+        signature = '{}:{}'.format(model_class._meta.label, ','.join(
+            '{}.{}'.format(field.attname, field.get_internal_type())
+            for field in fields
+        ))
+        return {
+            'model_class': model_class,
+            'attnames': [field.attname for field in fields],
+            'schema_id': zlib.crc32(signature.encode('utf-8')),
+            'encoders': [cls._get_encoder(field) for field in fields],
+            # 只记录需要转换的字段，(在 values 里的下标, decoder)，下标 0 是 schema_id
+            'decoders': [
+                (index, decoder)
+                for index, decoder in enumerate(
+                    (cls._get_decoder(field) for field in fields),
+                    start=1,
+                )
+                if decoder is not None
+            ],
+        }
+
+    @classmethod
+    def get_layout(cls, model_class):
+        layout = cls._layouts.get(model_class)
+        if layout is None:
+            layout = cls._build_layout(model_class)
+            cls._layouts[model_class] = layout
+            cls._layouts_by_schema_id[layout['schema_id']] = layout
+        return layout
+
+    @classmethod
+    def get_layout_by_schema_id(cls, schema_id):
+        if schema_id not in cls._layouts_by_schema_id:
+            # 读到了还没有见过的 schema，把所有 model 的 layout 都算一遍
+            for model_class in apps.get_models():
+                cls.get_layout(model_class)
+        # 找不到说明是 model 修改之前写入的数据
+        return cls._layouts_by_schema_id.get(schema_id)
+
+    @classmethod
+    def _get_encoder(cls, field):
+        if isinstance(field, models.DateTimeField):
+            return to_microseconds
+        if isinstance(field, models.DateField):
+            return _encode_date
+        if isinstance(field, models.FileField):
+            return _encode_file
+        if isinstance(field, (
+            models.DecimalField,
+            models.UUIDField,
+            models.TimeField,
+            models.DurationField,
+        )):
+            return _encode_str
+        return None
+
+    @classmethod
+    def _get_decoder(cls, field):
+        if isinstance(field, models.DateTimeField):
+            return _decode_datetime
+        if isinstance(field, models.DateField):
+            return _decode_date
+        if isinstance(field, (
+            models.DecimalField,
+            models.UUIDField,
+            models.TimeField,
+            models.DurationField,
+        )):
+            return field.to_python
+        return None
+
+    @classmethod
+    def serialize(cls, instance):
+        layout = cls.get_layout(instance.__class__)
+        values = [layout['schema_id']]
+        for field, encoder in zip(
+            instance._meta.concrete_fields,
+            layout['encoders'],
+        ):
+            value = getattr(instance, field.attname)
+            if encoder is not None and value is not None:
+                value = encoder(value)
+            values.append(value)
+        return cls.VERSION_BYTE + msgpack.packb(values, use_bin_type=True)
+
+    @classmethod
+    def deserialize(cls, serialized_data):
+        if serialized_data[:1] != cls.VERSION_BYTE:
+            # 升级之前写入的 JSON 格式
+            return DjangoModelSerializer.deserialize(serialized_data)
+
+        values = msgpack.unpackb(serialized_data[1:], raw=False)
+        layout = cls.get_layout_by_schema_id(values[0])
+        if layout is None:
+            return None
+        for index, decoder in layout['decoders']:
+            if values[index] is not None:
+                values[index] = decoder(values[index])
+        values = values[1:]
+        model_class = layout['model_class']
+        if signals.pre_init.has_listeners(model_class) or \
+                signals.post_init.has_listeners(model_class):
+            return model_class.from_db(DEFAULT_DB_ALIAS, None, values)
+        # 没有 init 相关的 signal 的时候，直接填 __dict__，跳过 Model.__init__ 里逐个字段
+        # setattr 的开销，得到的 object 和从数据库里读出来的是一样的
+        instance = model_class.__new__(model_class)
+        instance.__dict__.update(zip(layout['attnames'], values))
+        instance._state = ModelState()
+        instance._state.adding = False
+        instance._state.db = DEFAULT_DB_ALIAS
+        return instance
+
+    @classmethod
+    def deserialize_field(cls, serialized_data, attname):
+        """
+        只读出某一个字段的值，不创建 model 的 object，用于在 list 里按照 created_at 查找位置
+        读不出来（model 的字段已经变了）的时候返回 None
+        """
+        if serialized_data[:1] != cls.VERSION_BYTE:
+            return getattr(DjangoModelSerializer.deserialize(serialized_data), attname)
+
+        values = msgpack.unpackb(serialized_data[1:], raw=False)
+        layout = cls.get_layout_by_schema_id(values[0])
+        if layout is None:
+            return None
+        # values 的下标 0 是 schema_id
+        index = layout['attnames'].index(attname) + 1
+        value = values[index]
+        for decoder_index, decoder in layout['decoders']:
+            if decoder_index == index and value is not None:
+                return decoder(value)
+        return value
+
+
+def _decode_datetime(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def _encode_date(value):
+    return value.toordinal()
+
+
+def _decode_date(value):
+    return datetime.fromordinal(value).date()
+
+
+def _encode_file(value):
+    return value.name or None
+
+
+def _encode_str(value):
+    return str(value)
@@ -0,0 +1,50 @@
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+import orjson
+
+_encoder = JSONEncoder()
+
+# OPT_UTC_Z: UTC 的时间用 Z 结尾，和 utils.json_encoder.JSONEncoder 一样保留 micro second
+# OPT_NON_STR_KEYS: 和 json 模块一样允许 int 之类的 key
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+def default(o):
+    """
+    orjson 直接处理 str, int, dict, list, datetime, date, uuid 等类型，不会调用这个函数
+    只有 Decimal, timedelta, lazy string, QuerySet 之类的类型才交给 DRF 的 JSONEncoder
+    转换，保证输出和 JSONRenderer 一样
+    """
+    return _encoder.default(o)
+
+
+def dumps(data):
+    ret = orjson.dumps(data, default=default, option=ORJSON_OPTIONS)
+    # 和 DRF 的 JSONRenderer 一样把 \u2028 和 \u2029 转义，保证输出是 javascript 的子集
+    if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+        ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return ret
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    用 orjson 代替标准库的 json 渲染 response，输出和 JSONRenderer 一样
+    例外是 datetime.time 会保留 micro second，JSONEncoder 只保留到 milli second
+    在 view 里设置 renderer_classes = FAST_RENDERER_CLASSES 打开
+    或者在 REST_FRAMEWORK 的 DEFAULT_RENDERER_CLASSES 里全局打开
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # 需要缩进的时候（比如 BrowsableAPIRenderer 里）还是用 JSONRenderer，orjson 只支持缩进 2 格
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super(ORJSONRenderer, self).render(
+                data,
+                accepted_media_type,
+                renderer_context,
+            )
+        return dumps(data)
+
+
+FAST_RENDERER_CLASSES = (ORJSONRenderer, BrowsableAPIRenderer)
@@ -0,0 +1,58 @@
+from utils.metrics import Metrics
+import threading
+
+
+class RequestCache:
+    """
+    只在一个 request 内有效的 identity map，同一个 request 里重复读取同一个 key 的时候
+    不再访问 memcached 和 redis，直接返回第一次读到的 object
+    由 RequestCacheMiddleware 在 request 开始的时候打开，response 返回之后清空
+    不在 request 里的时候（比如 celery 的 task）不做任何缓存
+    """
+    _local = threading.local()
+
+    @classmethod
+    def start(cls):
+        cls._local.store = {}
+        cls._local.hits = 0
+
+    @classmethod
+    def end(cls):
+        # 返回这个 request 里一共省掉了多少次 cache 访问
+        hits = getattr(cls._local, 'hits', 0)
+        cls._local.store = None
+        cls._local.hits = 0
+        return hits
+
+    @classmethod
+    def _get_store(cls):
+        return getattr(cls._local, 'store', None)
+
+    @classmethod
+    def get(cls, key, default=None):
+        store = cls._get_store()
+        if store is None or key not in store:
+            return default
+        cls._local.hits += 1
+        Metrics.cache_hit('request', key)
+        return store[key]
+
+    @classmethod
+    def peek(cls, key, default=None):
+        # 和 get 一样，但是不计入 hits，用于合并已有的数据
+        store = cls._get_store()
+        if store is None:
+            return default
+        return store.get(key, default)
+
+    @classmethod
+    def set(cls, key, value):
+        store = cls._get_store()
+        if store is not None:
+            store[key] = value
+
+    @classmethod
+    def delete(cls, key):
+        store = cls._get_store()
+        if store is not None:
+            store.pop(key, None)
@@ -1,5 +1,40 @@
+from accounts.api.serializers import UserSerializer, UserSerializerForTweet
+from comments.api.serializers import CommentSerializer
+from comments.models import Comment
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from friendships.api.serializers import FollowerSerializer, FollowingSerializer
+from friendships.models import Friendship
+from io import StringIO
+from newsfeeds.api.serializers import NewsFeedSerializer
+from newsfeeds.models import NewsFeed
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
 from testing.testcases import TestCase
+from tweets.api.serializers import TweetSerializer, TweetSerializerForDetail
+from tweets.models import Tweet, TweetPhoto
+from utils import xfetch
+from utils.compiled_serializers import (
+    COMPILED_CONTEXT_KEY,
+    CompiledSerializer,
+    CompiledSerializerMixin,
+)
+from utils.local_cache import INVALIDATION_CHANNEL, LocalCache
+from utils.memcached_helper import MemcachedHelper, TOMBSTONE, cache
+from utils.metrics import Metrics
 from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+from utils.redis_serializers import CompactModelSerializer, DjangoModelSerializer
+from utils.renderers import ORJSONRenderer
+from utils.request_cache import RequestCache
+import msgpack
+import time
 
 
 class UtilsTests(TestCase):
@@ -17,3 +52,654 @@ class UtilsTests(TestCase):
         RedisClient.clear()
         cached_list = conn.lrange('redis_key', 0, -1)
         self.assertEqual(cached_list, [])
+
+    def test_redis_client_connection_pool(self):
+        conn = RedisClient.get_connection()
+        self.assertEqual(RedisClient.get_connection() is conn, True)
+        # 没有配置 replica 的时候读写都走同一个连接池
+        self.assertEqual(RedisClient.get_connection(read_only=True) is conn, True)
+
+        # fork 之后的子进程会重新创建连接池
+        RedisClient.pid = None
+        new_conn = RedisClient.get_connection()
+        self.assertEqual(new_conn is conn, False)
+        self.assertEqual(RedisClient.get_connection() is new_conn, True)
+
+    def test_request_cache(self):
+        alex = self.create_user('alex')
+        self.clear_cache()
+
+        # 不在 request 里的时候不做任何缓存
+        MemcachedHelper.get_object_through_cache(User, alex.id)
+        self.assertEqual(RequestCache.get(MemcachedHelper.get_key(User, alex.id)), None)
+
+        RequestCache.start()
+        user1 = MemcachedHelper.get_object_through_cache(User, alex.id)
+        user2 = MemcachedHelper.get_object_through_cache(User, alex.id)
+        self.assertEqual(user1 is user2, True)
+        # invalidate 之后重新从 memcached 读取
+        MemcachedHelper.invalidate_cached_object(User, alex.id)
+        user3 = MemcachedHelper.get_object_through_cache(User, alex.id)
+        self.assertEqual(user3 is user1, False)
+        self.assertEqual(RequestCache.end(), 1)
+
+        # middleware 通过 header 返回合并掉的 cache 访问次数
+        tweet = self.create_tweet(alex)
+        self.create_tweet(alex)
+        self.create_comment(alex, tweet)
+        self.create_comment(alex, tweet)
+        url = '/api/tweets/{}/'.format(tweet.id)
+        response = self.anonymous_client.get(url)
+        self.assertEqual(response.has_header('X-Request-Cache-Hits'), False)
+        with override_settings(DEBUG=True):
+            response = self.anonymous_client.get(url)
+        self.assertEqual(int(response['X-Request-Cache-Hits']) > 0, True)
+
+        # staff 用户不需要打开 DEBUG 也能看到
+        admin, admin_client = self.create_user_and_client('admin')
+        admin.is_staff = True
+        admin.save()
+        response = admin_client.get(url)
+        self.assertEqual(int(response['X-Request-Cache-Hits']) > 0, True)
+
+    def test_xfetch(self):
+        now = time.time()
+        # 已经过期的数据一定会刷新
+        self.assertEqual(xfetch.should_refresh_early(now - 1, 0.1), True)
+        # 离过期还很远的数据不会刷新
+        self.assertEqual(xfetch.should_refresh_early(now + 3600, 0.1), False)
+        # 没有过期时间的旧数据不会刷新
+        self.assertEqual(xfetch.should_refresh_early(None, 0), False)
+
+        data, expire_at, delta = xfetch.unwrap(xfetch.wrap(b'data', 0.5, 60))
+        self.assertEqual(data, b'data')
+        self.assertEqual(delta, 0.5)
+        self.assertEqual(now + 59 < expire_at <= time.time() + 60, True)
+        self.assertEqual(xfetch.unwrap(b'legacy'), (b'legacy', None, 0))
+
+        # 快要过期的 memcached 数据会被当成 cache miss，提前从数据库重新读取
+        alex = self.create_user('alex')
+        self.clear_cache()
+        key = MemcachedHelper.get_key(User, alex.id)
+        cache.set(key, xfetch.wrap(
+            CompactModelSerializer.serialize(alex),
+            0.5,
+            -1,
+        ))
+        with self.assertNumQueries(1):
+            MemcachedHelper.get_object_through_cache(User, alex.id)
+        self.assertEqual(xfetch.unwrap(cache.get(key))[1] > time.time(), True)
+
+    def test_metrics(self):
+        self.clear_cache()
+        Metrics.incr('requests', method='GET')
+        Metrics.incr('requests', 2, method='GET')
+        self.assertEqual(Metrics.get('requests', method='GET'), 3)
+        self.assertEqual(Metrics.get('requests', method='POST'), 0)
+
+        # 直方图落在第一个 >= value 的桶里
+        Metrics.observe('latency', 3, (1, 5, 10))
+        Metrics.observe('latency', 20, (1, 5, 10))
+        self.assertEqual(Metrics.get('latency_bucket', le=5), 1)
+        self.assertEqual(Metrics.get('latency_bucket', le='inf'), 1)
+        self.assertEqual(Metrics.get('latency_count'), 2)
+        self.assertEqual(Metrics.get('latency_sum'), 23)
+
+        # 按 tier 和 key 的 pattern 统计命中率
+        alex = self.create_user('alex')
+        self.clear_cache()
+        MemcachedHelper.get_object_through_cache(User, alex.id)
+        RequestCache.start()
+        try:
+            MemcachedHelper.get_object_through_cache(User, alex.id)
+            MemcachedHelper.get_object_through_cache(User, alex.id)
+        finally:
+            RequestCache.end()
+        labels = {'tier': 'memcached', 'pattern': 'User'}
+        self.assertEqual(Metrics.get('cache_misses', **labels), 1)
+        self.assertEqual(Metrics.get('cache_fills', **labels), 1)
+        self.assertEqual(Metrics.get('cache_hits', **labels), 1)
+        self.assertEqual(Metrics.get('cache_payload_bytes_count', **labels), 2)
+        self.assertEqual(Metrics.get('cache_latency_ms_count', **labels), 2)
+        self.assertEqual(Metrics.get('cache_hits', tier='request', pattern='User'), 1)
+        self.assertEqual(Metrics.snapshot()['cache_hits{pattern=User,tier=request}'], 1)
+
+
+class RedisHelperTests(TestCase):
+
+    def setUp(self):
+        super(RedisHelperTests, self).setUp()
+        self.alex = self.create_user('alex')
+
+    def test_load_objects_only_once(self):
+        tweets = [self.create_tweet(self.alex) for _ in range(3)]
+        RedisClient.clear()
+        conn = RedisClient.get_connection()
+        key = 'redis_helper:tweets'
+
+        self.assertEqual(RedisHelper._load_objects_to_cache(key, tweets), True)
+        # key 已经存在的时候不会重复写入
+        self.assertEqual(RedisHelper._load_objects_to_cache(key, tweets), False)
+        self.assertEqual(conn.llen(key), 3)
+        self.assertEqual(conn.ttl(key) > 0, True)
+
+    def test_push_object(self):
+        tweet1 = self.create_tweet(self.alex)
+        RedisClient.clear()
+        conn = RedisClient.get_connection()
+        key = 'redis_helper:tweets'
+        queryset = Tweet.objects.filter(user=self.alex).order_by('-created_at')
+
+        # key 不存在的时候从数据库 load
+        tweet2 = self.create_tweet(self.alex)
+        RedisHelper.push_object(key, tweet2, queryset)
+        objects = RedisHelper.load_objects(key, queryset)
+        self.assertEqual([t.id for t in objects], [tweet2.id, tweet1.id])
+
+        # 同一个 object 不会被 push 两次
+        RedisHelper.push_object(key, tweet2, queryset)
+        self.assertEqual(conn.llen(key), 2)
+
+    def test_replace_and_remove_object(self):
+        limit = settings.REDIS_LIST_LENGTH_LIMIT
+        tweets = [self.create_tweet(self.alex) for _ in range(limit + 1)][::-1]
+        RedisClient.clear()
+        conn = RedisClient.get_connection()
+        key = 'redis_helper:tweets'
+        queryset = Tweet.objects.filter(user=self.alex).order_by('-created_at')
+        RedisHelper.load_objects(key, queryset)
+        self.assertEqual(conn.llen(key), limit)
+
+        # 修改之后原地替换，不需要重新 load
+        tweets[1].content = 'updated'
+        with self.assertNumQueries(0):
+            RedisHelper.replace_object(key, tweets[1])
+        objects = RedisHelper.load_objects(key, queryset)
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets[:limit]])
+        self.assertEqual(objects[1].content, 'updated')
+
+        # list 是满的，删掉一个之后从数据库补上末尾的下一个
+        # 实例的 delete() 之后 id 会被清空，listener 里拿到的 id 还在
+        Tweet.objects.filter(id=tweets[0].id).delete()
+        with self.assertNumQueries(1):
+            RedisHelper.remove_object(key, tweets[0], queryset)
+        objects = RedisHelper.load_objects(key, queryset)
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets[1:]])
+
+        # 数据库里没有更多的了，直接删掉
+        Tweet.objects.filter(id=tweets[2].id).delete()
+        with self.assertNumQueries(1):
+            RedisHelper.remove_object(key, tweets[2], queryset)
+        self.assertEqual(conn.llen(key), limit - 1)
+
+        # list 不在 cache 里的时候什么都不做
+        RedisClient.clear()
+        RedisHelper.remove_object(key, tweets[1], queryset)
+        RedisHelper.replace_object(key, tweets[1])
+        self.assertEqual(conn.exists(key), False)
+
+    def test_load_objects_window(self):
+        tweets = [self.create_tweet(self.alex) for _ in range(5)][::-1]
+        RedisClient.clear()
+        key = 'redis_helper:tweets'
+        queryset = Tweet.objects.filter(user=self.alex).order_by('-created_at')
+
+        # cache miss 的时候从数据库 load
+        objects = RedisHelper.load_objects_window(key, queryset, limit=2)
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets[:2]])
+
+        objects = RedisHelper.load_objects_window(
+            key,
+            queryset,
+            limit=2,
+            created_at__lt=tweets[1].created_at,
+        )
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets[2:4]])
+
+        objects = RedisHelper.load_objects_window(
+            key,
+            queryset,
+            created_at__gt=tweets[2].created_at,
+        )
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets[:2]])
+
+        # 读到末尾的时候 list 没有达到长度上限，说明已经是所有数据了
+        objects = RedisHelper.load_objects_window(
+            key,
+            queryset,
+            limit=10,
+            created_at__lt=tweets[3].created_at,
+        )
+        self.assertEqual([t.id for t in objects], [tweets[4].id])
+
+    def test_load_objects_window_with_same_created_at(self):
+        tweets = [self.create_tweet(self.alex) for _ in range(3)]
+        Tweet.objects.filter(id__in=[t.id for t in tweets[1:]]).update(
+            created_at=tweets[1].created_at,
+        )
+        RedisClient.clear()
+        key = 'redis_helper:tweets'
+        queryset = Tweet.objects.filter(user=self.alex).order_by('-created_at', '-id')
+        expected_ids = [tweets[2].id, tweets[1].id, tweets[0].id]
+
+        # 两个 created_at 相同的 tweets 都要读出来
+        objects = RedisHelper.load_objects_window(key, queryset, limit=3)
+        self.assertEqual([t.id for t in objects], expected_ids)
+        objects = RedisHelper.load_objects_window(
+            key,
+            queryset,
+            created_at__gt=tweets[0].created_at,
+        )
+        self.assertEqual([t.id for t in objects], expected_ids[:2])
+
+    def test_load_large_set(self):
+        RedisClient.clear()
+        key = 'redis_helper:set'
+        # 超过 lua 的 unpack 一次能展开的数量
+        RedisHelper.load_sets(
+            {key: list(range(1, 12001))},
+            RedisHelper.get_set_generations([key]),
+        )
+        self.assertEqual(RedisHelper.get_set_size(key), 12000)
+        self.assertEqual(
+            RedisHelper.get_set_memberships([(key, 1), (key, 12000), (key, 12001)]),
+            [True, True, False],
+        )
+
+    def test_load_objects_single_flight(self):
+        tweets = [self.create_tweet(self.alex) for _ in range(3)][::-1]
+        RedisClient.clear()
+        conn = RedisClient.get_connection()
+        key = 'redis_helper:tweets'
+        lock_key = '{}:fill_lock'.format(key)
+        queryset = Tweet.objects.filter(user=self.alex).order_by('-created_at')
+
+        # 别的 worker 持有锁并且一直没有写好 cache，等一会儿之后直接读数据库，不写 cache
+        conn.set(lock_key, 'other worker')
+        objects = RedisHelper.load_objects(key, queryset)
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets])
+        self.assertEqual(conn.exists(key), False)
+        self.assertEqual(Metrics.get('redis_fill_coalesced'), 1)
+        # 不会释放别人持有的锁
+        self.assertEqual(conn.get(lock_key), b'other worker')
+
+        # 锁释放了之后正常 load 到 cache 里，并且释放自己的锁
+        conn.delete(lock_key)
+        objects = RedisHelper.load_objects(key, queryset)
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets])
+        self.assertEqual(conn.llen(key), 3)
+        self.assertEqual(conn.exists(lock_key), False)
+        self.assertEqual(Metrics.get('redis_fill_coalesced'), 1)
+
+    def test_get_counts(self):
+        tweets = [self.create_tweet(self.alex) for _ in range(3)]
+        Tweet.objects.filter(id=tweets[0].id).update(likes_count=2, comments_count=1)
+        RedisClient.clear()
+        conn = RedisClient.get_connection()
+        tweet_ids = [tweet.id for tweet in tweets]
+        attrs = ['likes_count', 'comments_count']
+
+        # cache miss 的时候只有一次数据库查询
+        with self.assertNumQueries(1):
+            counts = RedisHelper.get_counts(Tweet, tweet_ids, attrs)
+        self.assertEqual(counts[tweets[0].id], {'likes_count': 2, 'comments_count': 1})
+        self.assertEqual(counts[tweets[1].id], {'likes_count': 0, 'comments_count': 0})
+        key = RedisHelper.get_counts_key(Tweet, tweets[0].id)
+        self.assertEqual(conn.ttl(key) > 0, True)
+
+        # cache hit 的时候不访问数据库
+        with self.assertNumQueries(0):
+            counts = RedisHelper.get_counts(Tweet, tweet_ids, attrs)
+        self.assertEqual(counts[tweets[0].id]['likes_count'], 2)
+
+        # 计数器在 cache 里的时候直接加减
+        self.assertEqual(RedisHelper.incr_count(tweets[0], 'likes_count'), 3)
+        self.assertEqual(RedisHelper.decr_count(tweets[0], 'comments_count'), 0)
+        self.assertEqual(RedisHelper.get_count(tweets[0], 'likes_count'), 3)
+
+        # 计数器不在 cache 里的时候从数据库 back fill，不重复加减
+        conn.delete(key)
+        Tweet.objects.filter(id=tweets[0].id).update(likes_count=5)
+        self.assertEqual(RedisHelper.incr_count(tweets[0], 'likes_count'), 5)
+        self.assertEqual(conn.ttl(key) > 0, True)
+
+    def test_get_counts_with_partial_hash(self):
+        tweet = self.create_tweet(self.alex)
+        Tweet.objects.filter(id=tweet.id).update(likes_count=1, comments_count=2)
+        RedisClient.clear()
+        conn = RedisClient.get_connection()
+        key = RedisHelper.get_counts_key(Tweet, tweet.id)
+
+        # write behind 的计数还没有写回数据库，hash 里只有 likes_count
+        RedisHelper.get_counts(Tweet, [tweet.id], ['likes_count'])
+        RedisHelper.incr_count(tweet, 'likes_count', write_behind=True)
+        counts = RedisHelper.get_counts(Tweet, [tweet.id], ['likes_count', 'comments_count'])
+        self.assertEqual(counts[tweet.id], {'likes_count': 2, 'comments_count': 2})
+        self.assertEqual(conn.hget(key, 'likes_count'), b'2')
+        self.assertEqual(conn.hget(key, 'comments_count'), b'2')
+
+
+class MemcachedHelperTests(TestCase):
+
+    def setUp(self):
+        super(MemcachedHelperTests, self).setUp()
+        self.alex = self.create_user('alex')
+
+    def test_get_objects_through_cache(self):
+        tweets = [self.create_tweet(self.alex) for _ in range(3)]
+        self.clear_cache()
+        tweet_ids = [tweets[2].id, tweets[0].id, -1, tweets[1].id]
+
+        # cache miss 的时候只有一次数据库查询，按照输入的顺序返回，不存在的 object 被跳过
+        with self.assertNumQueries(1):
+            objects = MemcachedHelper.get_objects_through_cache(Tweet, tweet_ids)
+        self.assertEqual(
+            [tweet.id for tweet in objects],
+            [tweets[2].id, tweets[0].id, tweets[1].id],
+        )
+
+        tweet_ids = [tweet.id for tweet in tweets]
+        with self.assertNumQueries(0):
+            objects = MemcachedHelper.get_objects_through_cache(Tweet, tweet_ids)
+        self.assertEqual([tweet.id for tweet in objects], tweet_ids)
+
+        # 部分 cache miss 的时候只查询 miss 的部分
+        MemcachedHelper.invalidate_cached_object(Tweet, tweets[0].id)
+        with self.assertNumQueries(1):
+            objects = MemcachedHelper.get_objects_through_cache(Tweet, tweet_ids)
+        self.assertEqual([tweet.id for tweet in objects], tweet_ids)
+
+    def test_compact_cache_entries(self):
+        tweet = self.create_tweet(self.alex)
+        self.clear_cache()
+        key = MemcachedHelper.get_key(Tweet, tweet.id)
+
+        # 升级之前写入的 pickle 格式当成 cache miss，重新写入紧凑格式
+        cache.set(key, tweet)
+        with self.assertNumQueries(1):
+            cached_tweet = MemcachedHelper.get_object_through_cache(Tweet, tweet.id)
+        self.assertEqual(cached_tweet.content, tweet.content)
+        data = xfetch.unwrap(cache.get(key))[0]
+        self.assertEqual(data[:1], CompactModelSerializer.VERSION_BYTE)
+
+        # model 的字段变了之后写入的数据同样当成 cache miss
+        cache.set(key, CompactModelSerializer.VERSION_BYTE + msgpack.packb([0, tweet.id]))
+        with self.assertNumQueries(1):
+            MemcachedHelper.get_object_through_cache(Tweet, tweet.id)
+
+        with self.assertNumQueries(0):
+            cached_tweet = MemcachedHelper.get_object_through_cache(Tweet, tweet.id)
+        self.assertEqual(cached_tweet.created_at, tweet.created_at)
+
+    def test_tombstone(self):
+        self.clear_cache()
+
+        # 不存在的 object 只查询一次数据库，之后由 tombstone 直接返回
+        with self.assertNumQueries(1):
+            with self.assertRaises(Tweet.DoesNotExist):
+                MemcachedHelper.get_object_through_cache(Tweet, -1)
+        with self.assertNumQueries(0):
+            with self.assertRaises(Tweet.DoesNotExist):
+                MemcachedHelper.get_object_through_cache(Tweet, -1)
+            self.assertEqual(
+                MemcachedHelper.get_objects_through_cache(Tweet, [-1]),
+                [],
+            )
+        self.assertEqual(Metrics.get('memcached_tombstone_hits'), 2)
+
+        # 创建之后 tombstone 会被 post_save 删掉
+        tweet = self.create_tweet(self.alex)
+        cache.set(MemcachedHelper.get_key(Tweet, tweet.id), TOMBSTONE)
+        tweet.save()
+        cached_tweet = MemcachedHelper.get_object_through_cache(Tweet, tweet.id)
+        self.assertEqual(cached_tweet.id, tweet.id)
+
+
+class LocalCacheTests(TestCase):
+
+    @override_settings(
+        LOCAL_CACHE_ENABLED=True,
+        LOCAL_CACHE_MAX_ENTRIES=2,
+    )
+    def test_local_cache(self):
+        LocalCache.clear()
+        alex = self.create_user('alex')
+        bob = self.create_user('bob')
+        tweet = self.create_tweet(alex)
+        self.clear_cache()
+
+        # 第一次读的时候写入本进程的 cache，之后不再访问 memcached
+        MemcachedHelper.get_object_through_cache(User, alex.id)
+        cache.clear()
+        with self.assertNumQueries(0):
+            user = MemcachedHelper.get_object_through_cache(User, alex.id)
+        self.assertEqual(user.username, 'alex')
+        # 每次读到的都是新的 object
+        self.assertEqual(
+            user is MemcachedHelper.get_object_through_cache(User, alex.id),
+            False,
+        )
+
+        # 超过条数上限的时候淘汰最久没有被访问的数据
+        MemcachedHelper.get_object_through_cache(User, bob.id)
+        MemcachedHelper.get_object_through_cache(Tweet, tweet.id)
+        self.assertEqual(LocalCache.get(MemcachedHelper.get_key(User, alex.id)), None)
+        self.assertEqual(LocalCache.get_stats()['entries'], 2)
+
+        # 修改之后通过 pub/sub 通知所有进程删掉缓存的数据
+        key = MemcachedHelper.get_key(User, bob.id)
+        LocalCache.set(key, MemcachedHelper.encode(bob))
+        RedisClient.get_connection().publish(INVALIDATION_CHANNEL, key)
+        for _ in range(20):
+            if LocalCache.get(key) is None:
+                break
+            time.sleep(0.1)
+        self.assertEqual(LocalCache.get(key), None)
+
+        stats = LocalCache.get_stats()
+        self.assertEqual(stats['hits'] > 0, True)
+        self.assertEqual(stats['misses'] > 0, True)
+
+
+class CompactModelSerializerTests(TestCase):
+
+    def setUp(self):
+        super(CompactModelSerializerTests, self).setUp()
+        self.alex = self.create_user('alex')
+        self.tweet = self.create_tweet(self.alex, 'compact tweet 你好')
+
+    def test_serialize_and_deserialize(self):
+        data = CompactModelSerializer.serialize(self.tweet)
+        self.assertEqual(data[:1], CompactModelSerializer.VERSION_BYTE)
+        self.assertEqual(len(data) < len(DjangoModelSerializer.serialize(self.tweet)), True)
+
+        cached_tweet = CompactModelSerializer.deserialize(data)
+        self.assertEqual(cached_tweet, self.tweet)
+        self.assertEqual(cached_tweet.user_id, self.alex.id)
+        self.assertEqual(cached_tweet.content, self.tweet.content)
+        self.assertEqual(cached_tweet.created_at, self.tweet.created_at)
+        self.assertEqual(cached_tweet.likes_count, self.tweet.likes_count)
+
+    def test_deserialize_legacy_json(self):
+        data = DjangoModelSerializer.serialize(self.tweet)
+        cached_tweet = CompactModelSerializer.deserialize(data.encode('utf-8'))
+        self.assertEqual(cached_tweet, self.tweet)
+        self.assertEqual(cached_tweet.created_at, self.tweet.created_at)
+
+    def test_unknown_schema(self):
+        data = CompactModelSerializer.serialize(self.tweet)
+        values = msgpack.unpackb(data[1:])
+        values[0] = 0
+        data = CompactModelSerializer.VERSION_BYTE + msgpack.packb(values)
+        self.assertEqual(CompactModelSerializer.deserialize(data), None)
+
+
+
+class ORJSONRendererTests(TestCase):
+
+    def test_same_output_as_json_renderer(self):
+        data = {
+            'id': 1,
+            'content': 'orjson 你好 \u2028 "quoted"',
+            'created_at': timezone.now(),
+            'price': Decimal('1.50'),
+            'duration': timedelta(seconds=3),
+            'float': 1.5,
+            'nested': [{'a': None, 'b': True}, []],
+            10: 'int key',
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+        # 浏览器里需要缩进的时候和 JSONRenderer 一样
+        self.assertEqual(
+            ORJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4'),
+        )
+
+    def test_api_response(self):
+        alex = self.create_user('alex')
+        self.create_tweet(alex, 'orjson tweet')
+        response = self.anonymous_client.get('/api/tweets/', {'user_id': alex.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['content'], 'orjson tweet')
+        self.assertEqual(
+            response.content,
+            JSONRenderer().render(response.data),
+        )
+
+    def test_benchmark_command(self):
+        alex = self.create_user('alex')
+        self.create_newsfeed(alex, self.create_tweet(alex))
+        out = StringIO()
+        call_command(
+            'benchmark_renderers',
+            user_id=alex.id,
+            iterations=2,
+            stdout=out,
+        )
+        self.assertEqual('ORJSONRenderer' in out.getvalue(), True)
+        self.assertEqual('differs' in out.getvalue(), False)
+
+
+class CompiledSerializerTests(TestCase):
+
+    def setUp(self):
+        super(CompiledSerializerTests, self).setUp()
+        self.alex = self.create_user('alex')
+        self.bob = self.create_user('bob')
+        self.bob.profile.nickname = 'bob 你好'
+        self.bob.profile.save()
+        self.create_friendship(self.bob, self.alex)
+        self.tweets = []
+        for i in range(3):
+            tweet = self.create_tweet(self.alex, 'tweet {}'.format(i))
+            self.create_newsfeed(self.bob, tweet)
+            self.create_comment(self.bob, tweet, 'comment {}'.format(i))
+            self.tweets.append(tweet)
+        self.create_like(self.bob, self.tweets[0])
+        self.create_like(self.bob, self.tweets[0].comment_set.first())
+
+    def _render(self, serializer_class, instance, compiled, **kwargs):
+        request = APIRequestFactory().get('/')
+        request.user = self.bob
+        context = {'request': request}
+        if compiled:
+            context[COMPILED_CONTEXT_KEY] = True
+        self.clear_cache()
+        return JSONRenderer().render(
+            serializer_class(instance, context=context, **kwargs).data,
+        )
+
+    def _assert_same_output(self, serializer_class, instance, **kwargs):
+        expected = self._render(serializer_class, instance, False, **kwargs)
+        self.assertEqual(
+            self._render(serializer_class, instance, True, **kwargs),
+            expected,
+        )
+        return expected
+
+    def test_parity(self):
+        output = self._assert_same_output(
+            TweetSerializer,
+            Tweet.objects.order_by('-created_at'),
+            many=True,
+        )
+        self.assertEqual(b'"has_liked":true' in output, True)
+        self._assert_same_output(TweetSerializerForDetail, self.tweets[0])
+        self._assert_same_output(
+            NewsFeedSerializer,
+            NewsFeed.objects.filter(user=self.bob).order_by('-created_at'),
+            many=True,
+        )
+        output = self._assert_same_output(
+            CommentSerializer,
+            Comment.objects.order_by('created_at'),
+            many=True,
+        )
+        self.assertEqual('bob 你好'.encode('utf-8') in output, True)
+        self._assert_same_output(
+            FollowerSerializer,
+            Friendship.objects.filter(to_user=self.alex),
+            many=True,
+        )
+        self._assert_same_output(
+            FollowingSerializer,
+            Friendship.objects.filter(from_user=self.bob),
+            many=True,
+        )
+        for serializer_class in [
+            TweetSerializer,
+            NewsFeedSerializer,
+            CommentSerializer,
+            FollowerSerializer,
+            UserSerializerForTweet,
+        ]:
+            self.assertEqual(CompiledSerializer._compiled[serializer_class] is None, False)
+
+    def test_not_compiled_with_nested_serializer(self):
+        class NestedSerializer(serializers.ModelSerializer):
+            user = UserSerializer()
+
+            class Meta:
+                model = Tweet
+                fields = ('id', 'user')
+
+        self.assertEqual(CompiledSerializer.compile(NestedSerializer), None)
+        self._assert_same_output(NestedSerializer, self.tweets[0])
+
+    def test_not_compiled_with_file_field(self):
+        class PhotoSerializer(CompiledSerializerMixin, serializers.ModelSerializer):
+
+            class Meta:
+                model = TweetPhoto
+                fields = ('id', 'file')
+
+        class PhotoListSerializer(PhotoSerializer):
+            files = serializers.ListField(child=serializers.FileField(), source='get_files')
+
+            class Meta:
+                model = TweetPhoto
+                fields = ('id', 'files')
+
+        photo = TweetPhoto.objects.create(
+            tweet=self.tweets[0],
+            user=self.alex,
+            file='photo.jpg',
+        )
+        photo.get_files = lambda: [photo.file]
+        # 有 request 的时候 FileField 输出的是绝对 url
+        self.assertEqual(CompiledSerializer.compile(PhotoSerializer), None)
+        output = self._assert_same_output(PhotoSerializer, photo)
+        self.assertEqual(b'"http://testserver/' in output, True)
+        self.assertEqual(CompiledSerializer.compile(PhotoListSerializer), None)
+        self._assert_same_output(PhotoListSerializer, photo)
+
+    def test_list_endpoints(self):
+        client = self.create_user_and_client('charlie')[1]
+        client.force_authenticate(self.bob)
+        response = client.get('/api/newsfeeds/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(response.data['results'][0]['tweet']['user']['username'], 'alex')
+        response = client.get('/api/friendships/{}/followers/'.format(self.alex.id))
+        self.assertEqual(response.data['results'][0]['user']['username'], 'bob')
@@ -2,5 +2,16 @@ from datetime import datetime
 import pytz
 
 
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+
 def utc_now():
     return datetime.now().replace(tzinfo=pytz.utc)
+
+
+def to_microseconds(dt):
+    # 转换成 UTC 的微秒时间戳，用整数保存，不会丢失精度
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=pytz.utc)
+    delta = dt - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
@@ -0,0 +1,56 @@
+"""
+XFetch 提前刷新 (Optimal Probabilistic Cache Stampede Prevention)
+每次读到数据的时候，按照一定的概率认为它已经 "过期"，提前重新计算
+越接近过期时间、重新计算越慢 (delta 越大) 的数据，被提前刷新的概率越大
+访问量越大的 key，越有可能在真正过期之前就被某一个请求刷新掉
+"""
+from django.conf import settings
+import math
+import random
+import struct
+import time
+
+# memcached 里带有过期时间和重新计算耗时的数据的格式：
+# 1 个字节的标记 + 8 个字节的过期时间 + 8 个字节的 delta (都是秒) + 原始数据
+ENVELOPE_BYTE = b'\x02'
+_header = struct.Struct('>dd')
+
+
+def should_refresh_early(expire_at, delta, beta=None):
+    if expire_at is None or delta <= 0:
+        return False
+    if beta is None:
+        beta = settings.XFETCH_BETA
+    # 1 - random() 的范围是 (0, 1]，避免 log(0)
+    return time.time() - delta * beta * math.log(1 - random.random()) >= expire_at
+
+
+def wrap(data, delta, timeout):
+    return ENVELOPE_BYTE + _header.pack(time.time() + timeout, delta) + data
+
+
+def unwrap(data):
+    """
+    返回 (原始数据, 过期时间, delta)，不带过期时间的旧数据返回 (data, None, 0)
+    """
+    if not isinstance(data, bytes) or data[:1] != ENVELOPE_BYTE:
+        return data, None, 0
+    expire_at, delta = _header.unpack_from(data, 1)
+    return data[1 + _header.size:], expire_at, delta
+
+
+class Timer:
+    """
+    记录重新计算一次花了多长时间
+
+        with Timer() as timer:
+            ...
+        timer.delta
+    """
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        self.delta = time.monotonic() - self.start